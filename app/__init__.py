@@ -8,9 +8,17 @@ from flask.json.provider import JSONProvider
 
 from app.api.routes import api_bp
 from app.api.v1 import api_v1_blueprint
+from app.commands import build_benchmarks_command, build_screener_command
 from app.main.routes import main_bp
 from app.models import db
 from config import Config
+from myutils.bench_store_util import benchmark_store
+from myutils.bench_util import benchmark_registry
+from myutils.cache_util import price_cache
+from myutils.correlation_util import covariance_cache
+from myutils.holding_util import holding_simulator
+from myutils.http_cache_util import response_cache
+from myutils.screener_util import screener_store
 
 def custom_serializer(obj):
     if dataclasses.is_dataclass(obj):
@@ -39,10 +47,21 @@ def create_app():
 
     # 初始化数据库
     db.init_app(app)
+    price_cache.init_app(app)
+    benchmark_store.init_app(app)
+    benchmark_registry.init_app(app)
+    screener_store.init_app(app)
+    response_cache.init_app(app)
+    holding_simulator.init_app(app)
+    covariance_cache.init_app(app)
 
     # 注册蓝图
     app.register_blueprint(main_bp)
     app.register_blueprint(api_bp, url_prefix="/api")  # API 路由前缀为 /api
     app.register_blueprint(api_v1_blueprint)
 
+    # 注册命令
+    app.cli.add_command(build_benchmarks_command)
+    app.cli.add_command(build_screener_command)
+
     return app
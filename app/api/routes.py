@@ -1,17 +1,45 @@
 from datetime import datetime
 
+import numpy as np
 import pandas as pd
-from flask import jsonify, request
-from data_module.data_api import DataManager
+from flask import Response, jsonify, request
 from app.api import api_bp
+from app.api.v1.utilities import query_cache
 from app.models.views import Security
-from app.models.views.private_pension import EnhancedIndexFund, IndexFund, TargetDateFund
+from app.models.views.private_pension import EnhancedIndexFund, IndexFund, TargetDateFund, TargetDateFundV2
+from myutils.bench_store_util import benchmark_store, get_definition_version
+from myutils.bench_util import REBALANCE_FREQUENCIES
 from myutils.bench_util import get_benchmark_data as u_get_benchmark_data
-from myutils import eval_util
+from myutils.bench_util import get_benchmark_segments
+from myutils import (columnar_util, contribution_util, drawdown_util, eval_util, portfolio_util, relative_util,
+                     rolling_util, serialize_util, stream_util)
+from myutils.cache_util import price_cache
+from myutils.columnar_util import COLUMNAR_MIMETYPE
+from myutils.correlation_util import covariance_cache, get_covariance
+from myutils.holding_util import HOLDING_METHODS, holding_simulator
+from myutils.http_cache_util import get_trading_day_version, response_cache
+from myutils.portfolio_util import PORTFOLIO_METHODS
+from myutils.screener_util import SCREENER_COLUMNS, screener_store
 
-data_manager = DataManager()
+def _get_benchmark_data_version():
+    # The benchmark changes with the prices and with the fund's benchmark definitions.
+    fund_id = request.args.get("fund_id", type=int)
+    if fund_id is None:
+        return None
+    return f"{get_trading_day_version()}-{get_definition_version(get_benchmark_segments(fund_id))}"
+
+def _get_holding_version():
+    # Benchmark outcomes also change with the fund's benchmark definitions.
+    if request.args.get("source", "fund") != "benchmark":
+        return get_trading_day_version()
+    try:
+        segments = get_benchmark_segments(int(request.view_args["fund_id"]))
+    except (TypeError, ValueError):
+        return None
+    return f"{get_trading_day_version()}-{get_definition_version(segments)}"
 
 @api_bp.route("/funds/research/indices/<index_code>/data")
+@response_cache.cached(get_trading_day_version)
 def api_funds_research_index_data(index_code):
     """API: 获取基准指数的行情数据"""
     security = Security.query.filter(Security.code == index_code).first()
@@ -22,7 +50,7 @@ def api_funds_research_index_data(index_code):
     code = security.code
 
     try:
-        index_data = data_manager.get_data(
+        index_data = price_cache.get_data(
             start="1980-01-01",
             end=datetime.now(),
             frequency="1d",
@@ -35,105 +63,355 @@ def api_funds_research_index_data(index_code):
     if len(index_data) == 0 or "AdjClose" not in index_data.data_vars:
         return jsonify({"error": "No data available for the given index"}), 404
 
+    if request.accept_mimetypes.best_match(["application/json", COLUMNAR_MIMETYPE]) == COLUMNAR_MIMETYPE:
+        response = Response(columnar_util.encode_columns({
+            "dates": columnar_util.get_epoch_days(index_data.datetime.values),
+            "closing_prices": index_data["AdjClose"].sel(security=code).values.astype(np.float64)
+        }), mimetype=COLUMNAR_MIMETYPE)
+        response.vary.add("Accept")
+        return response
+
     dates = [date.strftime("%Y-%m-%d") for date in pd.to_datetime(index_data.datetime)]
     closing_prices = [price.item() for price in index_data["AdjClose"].values]
 
-    return jsonify({
+    response = jsonify({
         "dates": dates,
         "closing_prices": closing_prices
     })
+    response.vary.add("Accept")
+    return response
+
+@api_bp.route("/cache/stats", methods=["GET"])
+def get_cache_stats():
+    return jsonify(price_cache.stats())
+
+@api_bp.route("/cache/responses/stats", methods=["GET"])
+def get_response_cache_stats():
+    return jsonify(response_cache.stats())
+
+@api_bp.route("/cache/queries/stats", methods=["GET"])
+def get_query_cache_stats():
+    return jsonify(query_cache.stats())
+
+@api_bp.route("/cache/covariances/stats", methods=["GET"])
+def get_covariance_cache_stats():
+    return jsonify(covariance_cache.stats())
+
+@api_bp.route("/cache/holdings/stats", methods=["GET"])
+def get_holding_cache_stats():
+    return jsonify(holding_simulator.stats())
+
+TARGET_DATE_FUND_COLUMNS = {
+    "id": TargetDateFund.id,
+    "code": TargetDateFund.code,
+    "name": TargetDateFund.name,
+    "type": TargetDateFund.type,
+    "target_year": TargetDateFund.target_year,
+    "holding_period": TargetDateFund.holding_period,
+    "is_initiated_fund": TargetDateFund.is_initiated_fund,
+    "amc_id": TargetDateFund.management_company_id,
+    "amc_name": TargetDateFund.management_company_name,
+    "csrc_ann_date": TargetDateFund.csrc_announce_date
+}
+
+INDEX_FUND_COLUMNS = {
+    "id": IndexFund.id,
+    "code": IndexFund.code,
+    "name": IndexFund.name,
+    "is_initiated_fund": IndexFund.is_initiated_fund,
+    "benchmark_index_id": IndexFund.tracked_index_id,
+    "benchmark_index_code": IndexFund.tracked_index_code,
+    "benchmark_index_name": IndexFund.tracked_index_name,
+    "is_etf_linked": IndexFund.is_etf_linked,
+    "is_lof": IndexFund.is_lof,
+    "amc_id": IndexFund.management_company_id,
+    "amc_name": IndexFund.management_company_name,
+    "csrc_ann_date": IndexFund.csrc_announce_date
+}
+
+ENHANCED_INDEX_FUND_COLUMNS = {
+    "id": EnhancedIndexFund.id,
+    "code": EnhancedIndexFund.code,
+    "name": EnhancedIndexFund.name,
+    "is_initiated_fund": EnhancedIndexFund.is_initiated_fund,
+    "benchmark_index_id": EnhancedIndexFund.benchmark_index_id,
+    "benchmark_index_code": EnhancedIndexFund.benchmark_index_code,
+    "benchmark_index_name": EnhancedIndexFund.benchmark_index_name,
+    "is_lof": EnhancedIndexFund.is_lof,
+    "amc_id": EnhancedIndexFund.management_company_id,
+    "amc_name": EnhancedIndexFund.management_company_name,
+    "csrc_ann_date": EnhancedIndexFund.csrc_announce_date
+}
+
+BENCHMARK_COLUMNS = {
+    "id": Security.id,
+    "code": Security.code,
+    "name": Security.name,
+    "type": Security.type
+}
+
+def _get_list_response(query, columns):
+    # ?stream=ndjson or ?stream=json, or Accept: application/x-ndjson, streams the rows.
+    try:
+        mode = stream_util.get_stream_mode(request.args.get("stream"), request.accept_mimetypes)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    query = query.with_entities(*[column.label(key) for key, column in columns.items()])
+    encoder = serialize_util.RowEncoder.from_query(query)
+    if mode is not None:
+        return stream_util.get_streaming_response(stream_util.iter_batches(query), mode,
+                                                  dump_batch=encoder.to_dicts, dumps=serialize_util.dumps)
+    return Response(encoder.encode(query.all()), mimetype="application/json")
 
 @api_bp.route("/targetDateFunds", methods=["GET"])
+@response_cache.cached(get_trading_day_version)
 def get_target_date_funds():
-    target_date_funds = TargetDateFund.query.all()
-    return jsonify(
-        [
-            {
-                "id": fund.id,
-                "code": fund.code,
-                "name": fund.name,
-                "type": fund.type,
-                "target_year": fund.target_year,
-                "holding_period": fund.holding_period,
-                "is_initiated_fund": fund.is_initiated_fund,
-                "amc_id": fund.amc_id,
-                "amc_name": fund.amc_name,
-                "csrc_ann_date": fund.csrc_ann_date
-            }
-            for fund in target_date_funds
-        ]
-    )
+    return _get_list_response(TargetDateFund.query, TARGET_DATE_FUND_COLUMNS)
 
 @api_bp.route("/indexFunds", methods=["GET"])
+@response_cache.cached(get_trading_day_version)
 def get_index_funds():
-    index_funds = IndexFund.query.all()
-    return jsonify(
-        [
-            {
-                "id": fund.id,
-                "code": fund.code,
-                "name": fund.name,
-                "is_initiated_fund": fund.is_initiated_fund,
-                "benchmark_index_id": fund.benchmark_index_id,
-                "benchmark_index_code": fund.benchmark_index_code,
-                "benchmark_index_name": fund.benchmark_index_name,
-                "is_etf_linked": fund.is_etf_linked,
-                "is_lof": fund.is_lof,
-                "amc_id": fund.amc_id,
-                "amc_name": fund.amc_name,
-                "csrc_ann_date": fund.csrc_ann_date
-            }
-            for fund in index_funds
-        ]
-    )
+    return _get_list_response(IndexFund.query, INDEX_FUND_COLUMNS)
 
 @api_bp.route("/enhancedIndexFunds", methods=["GET"])
+@response_cache.cached(get_trading_day_version)
 def get_enhanced_index_funds():
-    enhanced_index_funds = EnhancedIndexFund.query.all()
-    return jsonify(
-        [
-            {
-                "id": fund.id,
-                "code": fund.code,
-                "name": fund.name,
-                "is_initiated_fund": fund.is_initiated_fund,
-                "benchmark_index_id": fund.benchmark_index_id,
-                "benchmark_index_code": fund.benchmark_index_code,
-                "benchmark_index_name": fund.benchmark_index_name,
-                "is_lof": fund.is_lof,
-                "amc_id": fund.amc_id,
-                "amc_name": fund.amc_name,
-                "csrc_ann_date": fund.csrc_ann_date
-            }
-            for fund in enhanced_index_funds
-        ]
-    )
+    return _get_list_response(EnhancedIndexFund.query, ENHANCED_INDEX_FUND_COLUMNS)
 
 @api_bp.route("/benchmark", methods=["GET"])
+@response_cache.cached(get_trading_day_version)
 def get_benchmark():
-    benchmark = Security.query.filter(Security.type.like("TI%")).all()
-    return jsonify(
-        [
-            {
-                "id": index.id,
-                "code": index.code,
-                "name": index.name,
-                "type": index.type
-            }
-            for index in benchmark
-        ]
-    )
+    return _get_list_response(Security.query.filter(Security.type.like("TI%")), BENCHMARK_COLUMNS)
 
 @api_bp.route("/benchmarkData", methods=["GET"])
+@response_cache.cached(_get_benchmark_data_version)
 def get_benchmark_data():
-    fund_id = request.args.get("fund_id")
+    fund_id = request.args.get("fund_id", type=int)
+    if fund_id is None:
+        return jsonify({"error": "fund_id must be an integer"}), 400
     start_date = request.args.get("start_date")
     end_date = request.args.get("end_date")
+    method = request.args.get("method", "level")
+
+    if method == "level":
+        benchmark_data = u_get_benchmark_data(fund_id, start_date, end_date)
+    elif method == "chained":
+        rebalance = request.args.get("rebalance", "D")
+        if rebalance not in REBALANCE_FREQUENCIES:
+            return jsonify({"error": f"rebalance must be one of {REBALANCE_FREQUENCIES}"}), 400
+        benchmark_data = benchmark_store.get_data(fund_id, start_date, end_date, rebalance)
+    else:
+        return jsonify({"error": "method must be level or chained"}), 400
+    return jsonify({
+        "dates": np.datetime_as_string(benchmark_data.datetime.values, unit="D").tolist(),
+        "AdjClose": benchmark_data.values.tolist()
+    })
+
+@api_bp.route("/securities/performance", methods=["GET"])
+@response_cache.cached(get_trading_day_version)
+def get_securities_performance():
+    """
+    Evaluate many securities at once, selected by `codes=a,b,c` and/or `type=TI%`.
+
+    Every metric is a column of shape (period, security).
+    """
+    codes = request.args.get("codes")
+    security_type = request.args.get("type")
+    if not codes and not security_type:
+        return jsonify({"error": "Either codes or type is required"}), 400
+
+    query = Security.query.with_entities(Security.code)
+    if codes:
+        query = query.filter(Security.code.in_(codes.split(",")))
+    if security_type:
+        query = query.filter(Security.type.like(security_type))
+    codes = [row.code for row in query.all()]
+    if len(codes) == 0:
+        return jsonify({"error": "No such security found"}), 404
+
+    try:
+        ds = price_cache.get_data(
+            start="1980-01-01",
+            end=datetime.now(),
+            frequency="1d",
+            securities=codes,
+            fields=["AdjClose"]
+        )
+    except Exception as e:
+        return jsonify({"error": "Failed to retrieve security data", "message": str(e)}), 500
+
+    if len(ds) == 0 or "AdjClose" not in ds.data_vars:
+        return jsonify({"error": "No data available for the given securities"}), 404
+
+    table = eval_util.get_evaluation_table(ds["AdjClose"])
+    return jsonify(_get_table_json(table))
+
+@api_bp.route("/funds/contributions", methods=["GET"])
+@response_cache.cached(get_trading_day_version)
+def get_funds_contributions():
+    """
+    Backtest contributing `amount` a month to funds selected by `codes=a,b,c`, from every start month.
+
+    `start=2018-01` keeps only the accounts started in that month. Every
+    metric is a column of shape (start, fund).
+    """
+    codes = request.args.get("codes")
+    if not codes:
+        return jsonify({"error": "codes is required"}), 400
+    amount = request.args.get("amount", 1000, type=float)
+    start = request.args.get("start")
+    if start:
+        try:
+            start = pd.Period(start, freq="M").to_timestamp()
+        except ValueError:
+            return jsonify({"error": "start must be a month like 2018-01"}), 400
+
+    codes = [row.code for row in Security.query.with_entities(Security.code)
+                                                .filter(Security.code.in_(codes.split(","))).all()]
+    if len(codes) == 0:
+        return jsonify({"error": "No such fund found"}), 404
+
+    try:
+        ds = price_cache.get_data(
+            start="1980-01-01",
+            end=datetime.now(),
+            frequency="1d",
+            securities=codes,
+            fields=["AdjClose"]
+        )
+    except Exception as e:
+        return jsonify({"error": "Failed to retrieve fund data", "message": str(e)}), 500
+
+    if len(ds) == 0 or "AdjClose" not in ds.data_vars:
+        return jsonify({"error": "No data available for the given funds"}), 404
+
+    try:
+        table = contribution_util.get_contribution_table(ds["AdjClose"], amount)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if start:
+        table = table.sel(start=[start]) if start in table.start.values else table.isel(start=slice(0, 0))
+    return jsonify({
+        "securities": table.security.values.tolist(),
+        "starts": np.datetime_as_string(table.start.values, unit="M").tolist(),
+        "end_date": pd.Timestamp(table.end_date.values).strftime("%Y-%m-%d"),
+        "amount": amount,
+        "columns": {name: table[name].values.tolist() for name in contribution_util.CONTRIBUTION_METRICS}
+    })
+
+@api_bp.route("/funds/relative", methods=["GET"])
+@response_cache.cached(get_trading_day_version)
+def get_funds_relative_performance():
+    """
+    Evaluate funds against their benchmark indices, for a whole category at once.
+
+    `category` is indexfunds or enhanced, optionally narrowed by `codes=a,b,c`.
+    Every metric is a column of shape (period, fund).
+    """
+    category = request.args.get("category")
+    if category == "indexfunds":
+        query = IndexFund.query.with_entities(IndexFund.code, IndexFund.tracked_index_code.label("benchmark_code"))
+        model = IndexFund
+    elif category == "enhanced":
+        query = EnhancedIndexFund.query.with_entities(EnhancedIndexFund.code,
+                                                      EnhancedIndexFund.benchmark_index_code.label("benchmark_code"))
+        model = EnhancedIndexFund
+    else:
+        return jsonify({"error": "category must be indexfunds or enhanced"}), 400
+
+    codes = request.args.get("codes")
+    if codes:
+        query = query.filter(model.code.in_(codes.split(",")))
+    pairs = [(row.code, row.benchmark_code) for row in query.all() if row.benchmark_code]
+    if len(pairs) == 0:
+        return jsonify({"error": "No such fund found"}), 404
+
+    try:
+        ds = price_cache.get_data(
+            start="1980-01-01",
+            end=datetime.now(),
+            frequency="1d",
+            securities=list(dict.fromkeys([code for pair in pairs for code in pair])),
+            fields=["AdjClose"]
+        )
+    except Exception as e:
+        return jsonify({"error": "Failed to retrieve fund data", "message": str(e)}), 500
+
+    if len(ds) == 0 or "AdjClose" not in ds.data_vars:
+        return jsonify({"error": "No data available for the given funds"}), 404
+
+    fund_codes = [fund_code for fund_code, _ in pairs]
+    fund = ds["AdjClose"].reindex(security=fund_codes)
+    benchmark = ds["AdjClose"].reindex(security=[benchmark_code for _, benchmark_code in pairs]) \
+                              .assign_coords(security=fund_codes)
+    table = relative_util.get_relative_table(fund, benchmark)
+    response = _get_table_json(table)
+    response["benchmarks"] = [benchmark_code for _, benchmark_code in pairs]
+    return jsonify(response)
+
+@api_bp.route("/screener", methods=["GET"])
+@response_cache.cached(screener_store.get_built_at)
+def get_screener():
+    """
+    Screen funds on the nightly screener table, without touching any time series.
+
+    `category` is fof, indexfunds or enhanced, `sort=-1Y_annualized_return`
+    sorts descending, `<column>.min` and `<column>.max` filter, and `limit`
+    and `offset` page the result. Every column is a list of one value per fund.
+    """
+    table = screener_store.read()
+    if table is None:
+        return jsonify({"error": "Screener table has not been built yet"}), 503
+
+    category = request.args.get("category")
+    if category:
+        table = table[table["category"] == category]
+
+    for key, value in request.args.items():
+        column, _, bound = key.rpartition(".")
+        if bound not in ["min", "max"]:
+            continue
+        if column not in SCREENER_COLUMNS:
+            return jsonify({"error": f"Unknown column: {column}"}), 400
+        try:
+            value = float(value)
+        except ValueError:
+            return jsonify({"error": f"{key} must be a number"}), 400
+        table = table[table[column] >= value] if bound == "min" else table[table[column] <= value]
+
+    sort = request.args.get("sort")
+    if sort:
+        column = sort.lstrip("-")
+        if column not in ["code"] + SCREENER_COLUMNS:
+            return jsonify({"error": f"Unknown column: {column}"}), 400
+        table = table.sort_values(column, ascending=not sort.startswith("-"), na_position="last", kind="stable")
+
+    offset = request.args.get("offset", 0, type=int)
+    limit = request.args.get("limit", type=int)
+    page = table.iloc[offset:] if limit is None else table.iloc[offset:offset + limit]
+    return jsonify({
+        "built_at": screener_store.get_built_at(),
+        "total": len(table),
+        "columns": {name: page[name].tolist() for name in page.columns}
+    })
 
-    benchmark_data = u_get_benchmark_data(fund_id, start_date, end_date)
-    return jsonify(benchmark_data)
+def _get_date_strings(values: np.ndarray) -> list:
+    # Securities without a result have no date, which is sent as null.
+    strings = np.datetime_as_string(values, unit="D")
+    return np.where(np.isnat(values), None, strings).tolist()
+
+def _get_table_json(table):
+    return {
+        "securities": table.security.values.tolist(),
+        "periods": table.period.values.tolist(),
+        "start_dates": _get_date_strings(table.start_date.values),
+        "end_dates": _get_date_strings(table.end_date.values),
+        "columns": {name: table[name].values.tolist() for name in table.data_vars}
+    }
 
 @api_bp.route("/securities/<code>/performance", methods=["GET"])
+@response_cache.cached(get_trading_day_version)
 def get_security_performance(code):
     security = Security.query.filter(Security.code == code).first()
     if security is None:
@@ -142,7 +420,27 @@ def get_security_performance(code):
         return jsonify({"error": "This is not an equity security"}), 400
 
     try:
-        ds = data_manager.get_data(
+        stats = price_cache.get_statistics(code, "AdjClose", "1d")
+    except Exception as e:
+        return jsonify({"error": "Failed to retrieve security data", "message": str(e)}), 500
+
+    if stats is None:
+        return jsonify({"error": "No data available for the given security"}), 404
+
+    results = eval_util.get_evaluation_results_from_statistics(stats)
+    return jsonify(results)
+
+@api_bp.route("/securities/<code>/drawdown", methods=["GET"])
+@response_cache.cached(get_trading_day_version)
+def get_security_drawdown(code):
+    security = Security.query.filter(Security.code == code).first()
+    if security is None:
+        return jsonify({"error": "No such security found"}), 404
+    if security.type not in ["TIE", "TID"]:
+        return jsonify({"error": "This is not an equity security"}), 400
+
+    try:
+        ds = price_cache.get_data(
             start="1980-01-01",
             end=datetime.now(),
             frequency="1d",
@@ -155,6 +453,268 @@ def get_security_performance(code):
     if len(ds) == 0 or "AdjClose" not in ds.data_vars:
         return jsonify({"error": "No data available for the given security"}), 404
 
-    da = ds["AdjClose"]
-    results = eval_util.get_evaluation_results(da)
-    return jsonify(results)
+    result = drawdown_util.get_drawdown_result(ds["AdjClose"])
+    return jsonify(result)
+
+@api_bp.route("/securities/<code>/rolling", methods=["GET"])
+@response_cache.cached(get_trading_day_version)
+def get_security_rolling(code):
+    """
+    Rolling 1Y/3Y/5Y metrics of a security, with the outcomes of holding for each window.
+
+    `windows=1Y,3Y` selects the windows. Every metric is a list of one value
+    per date, null where the window starts before the first price.
+    """
+    windows = request.args.get("windows")
+    windows = windows.split(",") if windows else list(rolling_util.ROLLING_WINDOWS)
+    unknown = [window for window in windows if window not in rolling_util.ROLLING_WINDOWS]
+    if unknown:
+        return jsonify({"error": f"windows must be among {list(rolling_util.ROLLING_WINDOWS)}"}), 400
+
+    security = Security.query.filter(Security.code == code).first()
+    if security is None:
+        return jsonify({"error": "No such security found"}), 404
+
+    try:
+        ds = price_cache.get_data(
+            start="1980-01-01",
+            end=datetime.now(),
+            frequency="1d",
+            securities=[code],
+            fields=["AdjClose"]
+        )
+    except Exception as e:
+        return jsonify({"error": "Failed to retrieve security data", "message": str(e)}), 500
+
+    if len(ds) == 0 or "AdjClose" not in ds.data_vars:
+        return jsonify({"error": "No data available for the given security"}), 404
+
+    table = rolling_util.get_rolling_table(ds["AdjClose"], windows).isel(security=0)
+    summary = rolling_util.get_rolling_summary(table.expand_dims("security", axis=-1)).isel(security=0)
+    # Dates before the first result of any window carry no values.
+    has_result = (table["observations"] > 0).any(dim="window").values
+    table = table.isel(datetime=slice(int(np.argmax(has_result)) if has_result.any() else has_result.size, None))
+    return jsonify({
+        "dates": np.datetime_as_string(table.datetime.values, unit="D").tolist(),
+        "windows": {
+            window: {name: table[name].sel(window=window).values.tolist() for name in rolling_util.ROLLING_METRICS}
+            for window in windows
+        },
+        "summary": {
+            window: {name: summary[name].sel(window=window).item() for name in summary.data_vars}
+            for window in windows
+        }
+    })
+
+@api_bp.route("/funds/<int:fund_id>/holding", methods=["GET"])
+@response_cache.cached(_get_holding_version)
+def get_fund_holding_outcomes(fund_id):
+    """
+    What holding a fund for its holding period has produced, over every entry date.
+
+    `period=3Y` defaults to the holding period of the target date fund,
+    `source=benchmark` uses the chained composite benchmark instead of the
+    fund's own prices, and `method` is auto, historical or bootstrap.
+    """
+    security = Security.query.filter(Security.id == fund_id).first()
+    if security is None:
+        return jsonify({"error": "No such fund found"}), 404
+
+    period = request.args.get("period")
+    if not period:
+        fund = TargetDateFundV2.query.filter(TargetDateFundV2.code == security.code).first()
+        period = fund.holding_period if fund is not None else None
+        if not period:
+            return jsonify({"error": "period is required for a fund without a holding period"}), 400
+    source = request.args.get("source", "fund")
+    if source not in ["fund", "benchmark"]:
+        return jsonify({"error": "source must be fund or benchmark"}), 400
+    method = request.args.get("method", "auto")
+    if method not in HOLDING_METHODS:
+        return jsonify({"error": f"method must be one of {HOLDING_METHODS}"}), 400
+
+    try:
+        if source == "benchmark":
+            da = benchmark_store.get_data(fund_id, None, None)
+        else:
+            ds = price_cache.get_data(
+                start="1980-01-01",
+                end=datetime.now(),
+                frequency="1d",
+                securities=[security.code],
+                fields=["AdjClose"]
+            )
+            da = ds["AdjClose"].sel(security=security.code) if "AdjClose" in ds.data_vars else None
+    except Exception as e:
+        return jsonify({"error": "Failed to retrieve fund data", "message": str(e)}), 500
+
+    if da is None or da.datetime.size == 0:
+        return jsonify({"error": "No data available for the given fund"}), 404
+
+    try:
+        outcomes = holding_simulator.get_outcomes((source, fund_id), _get_holding_version() or "",
+                                                  da.datetime.values, da.values.astype(np.float64), period, method)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(outcomes)
+
+COVARIANCE_UNIVERSES = {
+    "indices": lambda: Security.query.with_entities(Security.code).filter(Security.type.like("TI%")),
+    "fof": lambda: TargetDateFundV2.query.with_entities(TargetDateFundV2.code).distinct(),
+    "indexfunds": lambda: IndexFund.query.with_entities(IndexFund.code),
+    "enhanced": lambda: EnhancedIndexFund.query.with_entities(EnhancedIndexFund.code)
+}
+
+def _get_universe_key():
+    universe = request.args.get("universe")
+    codes = request.args.get("codes")
+    if universe in COVARIANCE_UNIVERSES:
+        return universe
+    if codes and universe is None:
+        return ("codes", tuple(sorted(set(codes.split(",")))))
+    return None
+
+def _get_universe_prices(universe_key):
+    if universe_key in COVARIANCE_UNIVERSES:
+        universe_codes = [row.code for row in COVARIANCE_UNIVERSES[universe_key]().all()]
+    else:
+        universe_codes = [row.code for row in Security.query.with_entities(Security.code)
+                                                            .filter(Security.code.in_(universe_key[1])).all()]
+    if len(universe_codes) == 0:
+        raise LookupError("No such security found")
+    ds = price_cache.get_data(
+        start="1980-01-01",
+        end=datetime.now(),
+        frequency="1d",
+        securities=universe_codes,
+        fields=["AdjClose"]
+    )
+    if len(ds) == 0 or "AdjClose" not in ds.data_vars:
+        raise LookupError("No data available for the given securities")
+    return ds["AdjClose"]
+
+def _get_universe_covariance(universe_key, start_date, end_date, halflife):
+    key = (universe_key, start_date, end_date, halflife, get_trading_day_version())
+    return covariance_cache.get(key, lambda: get_covariance(_get_universe_prices(universe_key),
+                                                            start_date, end_date, halflife))
+
+@api_bp.route("/covariance", methods=["GET"])
+@response_cache.cached(get_trading_day_version)
+def get_covariance_matrix():
+    """
+    Covariance and correlation matrices of the daily returns of a universe.
+
+    The universe is `universe=indices|fof|indexfunds|enhanced` or `codes=a,b,c`.
+    `start_date` and `end_date` limit the period and `halflife=60` weights
+    the returns exponentially, in trading days. Matrices are row-major
+    lists, or float32 columns with Accept: application/vnd.private-pension.columnar.
+    """
+    universe_key = _get_universe_key()
+    if universe_key is None:
+        return jsonify({"error": f"Either codes or universe among {list(COVARIANCE_UNIVERSES)} is required"}), 400
+    start_date = request.args.get("start_date")
+    end_date = request.args.get("end_date")
+    halflife = request.args.get("halflife", type=float)
+    if halflife is not None and halflife <= 0:
+        return jsonify({"error": "halflife must be positive"}), 400
+
+    try:
+        result = _get_universe_covariance(universe_key, start_date, end_date, halflife)
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": "Failed to retrieve security data", "message": str(e)}), 500
+
+    metadata = {
+        "securities": result.securities.tolist(),
+        "start_date": result.start_date.strftime("%Y-%m-%d"),
+        "end_date": result.end_date.strftime("%Y-%m-%d"),
+        "periods_per_year": result.periods_per_year
+    }
+    if request.accept_mimetypes.best_match(["application/json", COLUMNAR_MIMETYPE]) == COLUMNAR_MIMETYPE:
+        response = Response(columnar_util.encode_columns({
+            "covariance": result.covariance.astype(np.float32).ravel(),
+            "correlation": result.correlation.astype(np.float32).ravel(),
+            "observations": result.observations.astype(np.int32).ravel()
+        }, metadata), mimetype=COLUMNAR_MIMETYPE)
+    else:
+        response = jsonify({
+            **metadata,
+            "covariance": result.covariance.tolist(),
+            "correlation": result.correlation.tolist(),
+            "observations": result.observations.tolist()
+        })
+    response.vary.add("Accept")
+    return response
+
+@api_bp.route("/portfolio", methods=["GET"])
+@response_cache.cached(get_trading_day_version)
+def get_portfolio():
+    """
+    Long-only portfolio weights of a universe, backtested over the covariance period.
+
+    The universe and the period are those of /covariance. `method` is
+    min_variance, risk_parity or target_volatility (with
+    `target_volatility=0.1`, annualized), `max_weight=0.2` caps every fund
+    and `rebalance=D|M|Q|Y|N` restores the weights. Securities without a
+    variance in the period are left out. The backtest is evaluated like a
+    single security, and so is in-sample.
+    """
+    universe_key = _get_universe_key()
+    if universe_key is None:
+        return jsonify({"error": f"Either codes or universe among {list(COVARIANCE_UNIVERSES)} is required"}), 400
+    method = request.args.get("method", "min_variance")
+    if method not in PORTFOLIO_METHODS:
+        return jsonify({"error": f"method must be one of {PORTFOLIO_METHODS}"}), 400
+    max_weight = request.args.get("max_weight", type=float)
+    if max_weight is not None and not 0 < max_weight <= 1:
+        return jsonify({"error": "max_weight must be in (0, 1]"}), 400
+    target_volatility = request.args.get("target_volatility", type=float)
+    rebalance = request.args.get("rebalance", "M")
+    if rebalance not in REBALANCE_FREQUENCIES:
+        return jsonify({"error": f"rebalance must be one of {REBALANCE_FREQUENCIES}"}), 400
+    start_date = request.args.get("start_date")
+    end_date = request.args.get("end_date")
+    halflife = request.args.get("halflife", type=float)
+    if halflife is not None and halflife <= 0:
+        return jsonify({"error": "halflife must be positive"}), 400
+
+    try:
+        result = _get_universe_covariance(universe_key, start_date, end_date, halflife)
+        da = _get_universe_prices(universe_key).sel(datetime=slice(result.start_date, result.end_date))
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": "Failed to retrieve security data", "message": str(e)}), 500
+
+    keep = np.flatnonzero(np.diag(result.covariance) > 0)
+    if keep.size == 0:
+        return jsonify({"error": "No security has enough data in the period"}), 404
+    da = da.sel(security=result.securities[keep])
+    try:
+        weights = portfolio_util.build_portfolio(result.securities[keep].tolist(),
+                                                 result.covariance[np.ix_(keep, keep)],
+                                                 portfolio_util.get_expected_returns(da),
+                                                 method, max_weight, target_volatility)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        value = portfolio_util.backtest_portfolio(da, np.array(weights.weights), rebalance)
+        results, drawdown = portfolio_util.evaluate_portfolio(value)
+    except Exception as e:
+        return jsonify({"error": "Failed to evaluate the portfolio", "message": str(e)}), 500
+    return jsonify({
+        **vars(weights),
+        "rebalance": rebalance,
+        "start_date": result.start_date.strftime("%Y-%m-%d"),
+        "end_date": result.end_date.strftime("%Y-%m-%d"),
+        "dates": [date.strftime("%Y-%m-%d") for date in pd.to_datetime(value.datetime.values)],
+        "values": value.values.tolist(),
+        "performance": results,
+        "drawdown": drawdown
+    })
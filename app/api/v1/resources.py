@@ -1,14 +1,83 @@
-from flask import request
+import json
+from collections import Counter
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+from flask import current_app, request
 from flask_restful import Resource
 from marshmallow import ValidationError
+from sqlalchemy.exc import SQLAlchemyError
 
 from app.models import db
 from app.models.tables import Security
 from app.api.v1.schemas import SecuritySchema
-from app.api.v1.utilities import create_query_from_request_args
+from app.api.v1.utilities import create_upsert_statement, get_next_cursor, has_unique_index, query_cache
+from myutils import serialize_util, stream_util
 
 security_schema = SecuritySchema()
 securities_schema = SecuritySchema(many=True)
+security_fields = list(security_schema.fields)
+
+BULK_BATCH_SIZE = 500
+BULK_STATUSES = ["created", "updated", "invalid", "duplicate", "error"]
+
+
+def iter_ndjson(lines: Iterable[bytes]) -> Iterator[Any]:
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            # Not an object, so the schema reports it as invalid input.
+            yield line.decode("utf-8", errors="replace")
+
+
+def upsert_securities(batch: List[Tuple[int, Any]]) -> List[Dict[str, Any]]:
+    """
+    Validate a batch of securities and upsert the valid ones by code.
+
+    Returns one result per item, in order. When a code appears more than
+    once in the batch, the last one is written and the others are
+    reported as duplicates.
+    """
+    errors = securities_schema.validate([item for _, item in batch])
+    results = {
+        index: {"index": index, "code": item.get("code") if isinstance(item, dict) else None,
+                "status": "invalid", "errors": errors[i]}
+        for i, (index, item) in enumerate(batch) if i in errors
+    }
+
+    valid = [(index, item) for i, (index, item) in enumerate(batch) if i not in errors]
+    latest = {item["code"]: index for index, item in valid}
+    rows = []
+    for index, item in valid:
+        if latest[item["code"]] != index:
+            results[index] = {"index": index, "code": item["code"], "status": "duplicate"}
+            continue
+        row = security_schema.load(item)
+        row.setdefault("full_name", None)
+        rows.append(row)
+
+    if rows:
+        try:
+            statement = create_upsert_statement(Security, rows, "code", keep_when_null=["full_name"])
+            inserted = {row.code: row.inserted for row in db.session.execute(statement)}
+            db.session.commit()
+        except SQLAlchemyError:
+            db.session.rollback()
+            # The driver's message may expose the schema, so it is only logged.
+            current_app.logger.exception("Failed to upsert a batch of securities")
+            inserted = None
+        for code, index in latest.items():
+            if inserted is None:
+                results[index] = {"index": index, "code": code, "status": "error",
+                                  "errors": "The batch could not be written"}
+            else:
+                results[index] = {"index": index, "code": code,
+                                  "status": "created" if inserted.get(code) else "updated"}
+
+    return [results[index] for index, _ in batch]
 
 
 class SecurityListResource(Resource):
@@ -17,10 +86,44 @@ class SecurityListResource(Resource):
         """
         Handle GET requests to /securities
         Lists securities with optional query parameters for filtering, ordering, etc.
+        Filters are `<column>=v` and `<column>.<operator>=v`, where the operator
+        is like, startswith, gt, gte, lt, lte, in (`a,b`), between (`a,b`) or
+        isnull (`true`/`false`).
+        With `.limit`, the next page is fetched by passing the `X-Next-Cursor`
+        response header as `.cursor`. `.fields` selects only the given columns,
+        and `.count=true` adds the `X-Total-Count` header. `.stream=ndjson` or
+        `.stream=json` streams the rows instead, without a next cursor.
         """
-        query = create_query_from_request_args(Security, request.args.items())
-        securities = query.all()
-        return securities_schema.dump(securities), 200
+        request_args = list(request.args.items())
+        if ".fields" not in request.args:
+            request_args.append((".fields", ",".join(security_fields)))
+
+        try:
+            compiled, params = query_cache.get(Security, request_args)
+            unknown = [name for name in compiled.fields if name not in security_fields]
+            if unknown:
+                raise ValueError(f"Unsupported fields: {unknown}")
+            stream = stream_util.get_stream_mode(compiled.stream, request.accept_mimetypes)
+        except ValueError as err:
+            return {"message": str(err)}, 400
+
+        # The rows are plain column tuples, so they are encoded without the schema.
+        encoder = serialize_util.RowEncoder.from_query(compiled.statement, only=compiled.fields)
+
+        headers = {}
+        if compiled.count_statement is not None:
+            headers["X-Total-Count"] = str(db.session.execute(compiled.count_statement, params).scalar())
+        if stream is not None:
+            batches = stream_util.iter_statement_batches(db.session, compiled.statement, params)
+            return stream_util.get_streaming_response(batches, stream, dump_batch=encoder.to_dicts,
+                                                      dumps=serialize_util.dumps, headers=headers)
+
+        securities = db.session.execute(compiled.statement, params).all()
+        next_cursor = get_next_cursor(compiled, securities)
+        if next_cursor is not None:
+            headers["X-Next-Cursor"] = next_cursor
+        headers["Content-Type"] = "application/json"
+        return current_app.response_class(encoder.encode(securities), 200, headers)
 
     def post(self):
         """
@@ -39,6 +142,33 @@ class SecurityListResource(Resource):
         return security_schema.dump(security), 201
 
 
+class SecurityBulkResource(Resource):
+
+    def post(self):
+        """
+        Handle POST requests to /securities/bulk
+        Creates or updates many securities by code, given as a JSON array or
+        as NDJSON (Content-Type: application/x-ndjson). Every batch is
+        validated at once and written with a single upsert.
+        """
+        if not has_unique_index(db.engine, Security, "code"):
+            return {"message": "Bulk upserts need a unique index on securities.code"}, 500
+
+        if request.mimetype == stream_util.NDJSON_MIMETYPE:
+            items = iter_ndjson(request.stream)
+        else:
+            items = request.get_json(silent=True)
+            if not isinstance(items, list):
+                return {"message": "Expected a JSON array, or NDJSON"}, 400
+
+        results = []
+        for batch in stream_util.iter_chunks(enumerate(items), BULK_BATCH_SIZE):
+            results.extend(upsert_securities(batch))
+
+        counts = Counter(result["status"] for result in results)
+        return {"summary": {status: counts[status] for status in BULK_STATUSES}, "results": results}, 200
+
+
 class SecurityResource(Resource):
 
     def get(self, code):
@@ -1,12 +1,112 @@
-from dataclasses import dataclass
-from typing import Iterable, List, Tuple
+import base64
+import binascii
+import json
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+from datetime import date, datetime
+from decimal import Decimal
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+from sqlalchemy import Integer, and_, bindparam, func, inspect, literal, literal_column, or_, select, tuple_
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.orm import Query
+from sqlalchemy.sql import Select
+from sqlalchemy.sql.elements import BindParameter
+
+# Request args whose values change the shape of the query, as do `<column>.isnull`
+# args. The values of all other args are bound as parameters.
+STRUCTURAL_ARGS = [".order_by", ".limit", ".fields", ".count", ".stream"]
+
+COMPARISON_OPERATORS = {
+    "gt": lambda column, value: column > value,
+    "gte": lambda column, value: column >= value,
+    "lt": lambda column, value: column < value,
+    "lte": lambda column, value: column <= value
+}
+
+
+@dataclass(frozen=True)
+class BoundValue:
+    """
+    Placeholder for a request arg value which is bound as a parameter.
+    """
+    name: str
+
+    def __repr__(self) -> str:
+        return f":{self.name}"
 
 
 @dataclass
 class RequestAndQueryData:
     request_args: List[Tuple[str, str]]
     query: Query
+    # Column keys and whether they are descending, in the order of `.order_by`.
+    order_by: List[Tuple[str, bool]] = field(default_factory=list)
+    limit: Optional[int] = None
+    fields: Optional[List[str]] = None
+    count_query: Optional[Query] = None
+    stream: Optional[str] = None
+
+
+@lru_cache(maxsize=None)
+def get_column_whitelist(db_model) -> Dict[str, Any]:
+    return {attribute.key: getattr(db_model, attribute.key) for attribute in inspect(db_model).column_attrs}
+
+
+def get_column(db_model, key: str):
+    column = get_column_whitelist(db_model).get(key)
+    if column is None:
+        raise ValueError(f"Unsupported column: {key}")
+    return column
+
+
+def is_structural_arg(key: str) -> bool:
+    return key in STRUCTURAL_ARGS or key.endswith(".isnull")
+
+
+def parse_bool(value: str) -> bool:
+    if value.lower() in ["1", "true", "yes"]:
+        return True
+    if value.lower() in ["0", "false", "no"]:
+        return False
+    raise ValueError(f"Expected true or false: {value}")
+
+
+def parse_value(column, value: str) -> Any:
+    """
+    Parse a request arg value into the Python type of a column.
+    """
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+
+    try:
+        if python_type is bool:
+            return parse_bool(value)
+        if python_type in [date, datetime]:
+            return python_type.fromisoformat(value)
+        if python_type in [int, float, Decimal]:
+            return python_type(value)
+    except (ValueError, ArithmeticError) as e:
+        raise ValueError(f"Invalid value for {column.key}: {value}") from e
+    return value
+
+
+def split_between_value(value: str) -> List[str]:
+    values = value.split(",")
+    if len(values) != 2:
+        raise ValueError(f"Expected two values separated by a comma: {value}")
+    return values
+
+
+def get_bound_value(value: Union[str, BoundValue]):
+    return bindparam(value.name) if isinstance(value, BoundValue) else value
+
+
+def get_filter_value(column, value: Union[str, BoundValue]):
+    return bindparam(value.name, type_=column.type) if isinstance(value, BoundValue) else parse_value(column, value)
 
 
 def create_request_and_query_data(
@@ -23,23 +123,41 @@ def apply_request_args_to_query_filter(
     data: RequestAndQueryData
 ) -> RequestAndQueryData:
 
-    result = RequestAndQueryData(request_args=[], query=data.query)
+    result = replace(data, request_args=[])
 
     for key, value in data.request_args:
         key_parts = key.split(".")
 
         if len(key_parts) == 1:
-            column = getattr(db_model, key)
-            result.query = result.query.filter(column == value)
+            column = get_column(db_model, key)
+            result.query = result.query.filter(column == get_filter_value(column, value))
 
         elif len(key_parts) == 2 and len(key_parts[0]) > 0:
-            column = getattr(db_model, key_parts[0])
+            column = get_column(db_model, key_parts[0])
             operator = key_parts[1]
 
             if operator == "like":
-                result.query = result.query.filter(column.like(value))
+                result.query = result.query.filter(column.like(get_bound_value(value)))
             elif operator == "startswith":
-                result.query = result.query.filter(column.startswith(value))
+                result.query = result.query.filter(column.startswith(get_bound_value(value)))
+            elif operator in COMPARISON_OPERATORS:
+                result.query = result.query.filter(
+                    COMPARISON_OPERATORS[operator](column, get_filter_value(column, value)))
+            elif operator == "in":
+                if isinstance(value, BoundValue):
+                    values = bindparam(value.name, expanding=True)
+                else:
+                    values = [parse_value(column, part) for part in value.split(",")]
+                result.query = result.query.filter(column.in_(values))
+            elif operator == "between":
+                if isinstance(value, BoundValue):
+                    low, high = bindparam(f"{value.name}_0", type_=column.type), \
+                        bindparam(f"{value.name}_1", type_=column.type)
+                else:
+                    low, high = [parse_value(column, part) for part in split_between_value(value)]
+                result.query = result.query.filter(column.between(low, high))
+            elif operator == "isnull":
+                result.query = result.query.filter(column.is_(None) if parse_bool(value) else column.is_not(None))
             else:
                 result.request_args.append((key, value))
 
@@ -54,7 +172,7 @@ def apply_request_args_to_query_order_by(
     data: RequestAndQueryData
 ) -> RequestAndQueryData:
 
-    result = RequestAndQueryData(request_args=[], query=data.query)
+    result = replace(data, request_args=[])
 
     for key, value in data.request_args:
         if key != ".order_by":
@@ -66,16 +184,19 @@ def apply_request_args_to_query_order_by(
             value_part_parts = value_part.split(" ")
 
             if len(value_part_parts) == 1:
-                column = getattr(db_model, value_part)
+                column = get_column(db_model, value_part)
                 result.query = result.query.order_by(column)
+                result.order_by = result.order_by + [(column.key, False)]
 
             elif len(value_part_parts) == 2:
-                column = getattr(db_model, value_part_parts[0])
+                column = get_column(db_model, value_part_parts[0])
                 direction = value_part_parts[1].lower()
                 if direction == "asc":
                     result.query = result.query.order_by(column.asc())
+                    result.order_by = result.order_by + [(column.key, False)]
                 elif direction == "desc":
                     result.query = result.query.order_by(column.desc())
+                    result.order_by = result.order_by + [(column.key, True)]
                 else:
                     result.request_args.append((key, value))
 
@@ -89,35 +210,398 @@ def apply_request_args_to_query_offset_limit(
     data: RequestAndQueryData
 ) -> RequestAndQueryData:
 
-    result = RequestAndQueryData(request_args=[], query=data.query)
+    result = replace(data, request_args=[])
 
     for key, value in data.request_args:
         if key == ".offset":
-            result.query = result.query.offset(int(value))
+            offset = bindparam(value.name, type_=Integer) if isinstance(value, BoundValue) else int(value)
+            result.query = result.query.offset(offset)
         elif key == ".limit":
             result.query = result.query.limit(int(value))
+            result.limit = int(value)
         else:
             result.request_args.append((key, value))
 
     return result
 
 
+def apply_request_args_to_query_count(
+    data: RequestAndQueryData
+) -> RequestAndQueryData:
+
+    result = replace(data, request_args=[])
+
+    for key, value in data.request_args:
+        if key == ".count":
+            # Keep the filtered query, so the count is only run when asked for.
+            result.count_query = result.query if value.lower() in ["1", "true", "yes"] else None
+        else:
+            result.request_args.append((key, value))
+
+    return result
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(values)).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> List[Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (binascii.Error, UnicodeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    if not isinstance(values, list):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return values
+
+
+def _is_nullable(db_model, key: str) -> bool:
+    return bool(get_column(db_model, key).expression.nullable)
+
+
+def _get_keyset_order_clause(db_model, key: str, descending: bool):
+    # NULLs sort last ascending and first descending, as PostgreSQL sorts them by default.
+    column = get_column(db_model, key)
+    if not _is_nullable(db_model, key):
+        return column.desc() if descending else column.asc()
+    return column.desc().nulls_first() if descending else column.asc().nulls_last()
+
+
+def _get_after_condition(column, descending: bool, value, nullable: bool):
+    if not nullable:
+        return column < value if descending else column > value
+    # NULLs sort after every value ascending and before every value descending.
+    if descending:
+        return or_(column < value, and_(value.is_(None), column.is_not(None)))
+    return or_(column > value, and_(column.is_(None), value.is_not(None)))
+
+
+def _get_keyset_condition(db_model, order_by: List[Tuple[str, bool]], values: List[Any]):
+    columns = [get_column(db_model, key) for key, _ in order_by]
+    nullable = [_is_nullable(db_model, key) for key, _ in order_by]
+
+    # A row value comparison can be answered by a single index range scan,
+    # but NULLs never compare true in it.
+    if all(descending == order_by[0][1] for _, descending in order_by) and not any(nullable):
+        if order_by[0][1]:
+            return tuple_(*columns) < tuple_(*values)
+        return tuple_(*columns) > tuple_(*values)
+
+    values = [value if isinstance(value, BindParameter) else literal(value, column.type)
+              for column, value in zip(columns, values)]
+    conditions = []
+    for i, (column, (_, descending), value) in enumerate(zip(columns, order_by, values)):
+        condition = _get_after_condition(column, descending, value, nullable[i])
+        conditions.append(and_(*[columns[j].is_not_distinct_from(values[j]) if nullable[j] else columns[j] == values[j]
+                                 for j in range(i)], condition))
+    return or_(*conditions)
+
+
+def apply_request_args_to_query_keyset(
+    db_model,
+    data: RequestAndQueryData
+) -> RequestAndQueryData:
+
+    result = replace(data, request_args=[])
+    keys = [key for key, _ in data.request_args]
+    if ".cursor" not in keys and ".limit" not in keys:
+        result.request_args = data.request_args
+        return result
+
+    # Break ties by primary key, so every row has exactly one position.
+    ordered = [key for key, _ in result.order_by]
+    for column in inspect(db_model).primary_key:
+        if column.key not in ordered:
+            result.order_by = result.order_by + [(column.key, False)]
+
+    # The cursor conditions place NULLs explicitly, so the order must place them the same way.
+    result.query = result.query.order_by(None).order_by(*[
+        _get_keyset_order_clause(db_model, key, descending) for key, descending in result.order_by
+    ])
+
+    for key, value in data.request_args:
+        if key != ".cursor":
+            result.request_args.append((key, value))
+            continue
+
+        if isinstance(value, BoundValue):
+            values = [bindparam(f"{value.name}_{i}") for i in range(len(result.order_by))]
+        else:
+            values = decode_cursor(value)
+            if len(values) != len(result.order_by):
+                raise ValueError(f"Cursor does not match the order: {value}")
+        result.query = result.query.filter(_get_keyset_condition(db_model, result.order_by, values))
+
+    return result
+
+
+def apply_request_args_to_query_fields(
+    db_model,
+    data: RequestAndQueryData
+) -> RequestAndQueryData:
+
+    result = replace(data, request_args=[])
+
+    for key, value in data.request_args:
+        if key != ".fields":
+            result.request_args.append((key, value))
+            continue
+
+        fields = value.split(",")
+        unknown = [name for name in fields if name not in get_column_whitelist(db_model)]
+        if unknown:
+            raise ValueError(f"Unsupported fields: {unknown}")
+
+        # The order columns are selected as well, to build the next cursor from.
+        selected = list(dict.fromkeys(fields + [key for key, _ in result.order_by]))
+        result.query = result.query.with_entities(*[get_column(db_model, name) for name in selected])
+        result.fields = fields
+
+    return result
+
+
+def apply_request_args_to_query_stream(
+    data: RequestAndQueryData
+) -> RequestAndQueryData:
+
+    result = replace(data, request_args=[])
+
+    for key, value in data.request_args:
+        if key == ".stream":
+            result.stream = value
+        else:
+            result.request_args.append((key, value))
+
+    return result
+
+
+def get_next_cursor(data: Union[RequestAndQueryData, "CompiledQuery"], rows: List[Any]) -> Optional[str]:
+    """
+    Get the cursor of the page after `rows`, or None if it is the last page.
+    """
+    if data.limit is None or len(rows) < data.limit or len(rows) == 0:
+        return None
+    return encode_cursor([getattr(rows[-1], key) for key, _ in data.order_by])
+
+
 def ensure_no_request_args_left(data: RequestAndQueryData) -> None:
     if len(data.request_args) > 0:
         raise ValueError(f"Unsupported request args: {data.request_args}")
 
 
-def create_query_from_request_args(
+def create_request_and_query_data_from_request_args(
     db_model,
     request_args: Iterable[Tuple[str, str]]
-) -> Query:
-
-    # TODO: Prevent SQL injection.
+) -> RequestAndQueryData:
 
     data = create_request_and_query_data(db_model, request_args)
     data = apply_request_args_to_query_filter(db_model, data)
+    data = apply_request_args_to_query_count(data)
     data = apply_request_args_to_query_order_by(db_model, data)
+    data = apply_request_args_to_query_keyset(db_model, data)
     data = apply_request_args_to_query_offset_limit(data)
+    data = apply_request_args_to_query_fields(db_model, data)
+    data = apply_request_args_to_query_stream(data)
     ensure_no_request_args_left(data)
 
-    return data.query
+    return data
+
+
+def create_query_from_request_args(
+    db_model,
+    request_args: Iterable[Tuple[str, str]]
+) -> Query:
+
+    return create_request_and_query_data_from_request_args(db_model, request_args).query
+
+
+@dataclass
+class CompiledQuery:
+    statement: Select
+    count_statement: Optional[Select]
+    order_by: List[Tuple[str, bool]]
+    limit: Optional[int]
+    fields: Optional[List[str]]
+    stream: Optional[str]
+    # Names of the bound parameters by request arg position, and the arg keys.
+    bound_args: List[Tuple[int, str, str]]
+
+
+@dataclass
+class QueryCacheStats:
+    hits: int = 0
+    misses: int = 0
+    entries: int = 0
+
+
+QueryShape = Tuple[Any, ...]
+
+
+class QueryCache:
+    """
+    Cache of the statements built by the request args pipeline, by arg shape.
+
+    The shape of the args is their keys, plus the values of STRUCTURAL_ARGS
+    and of `.isnull` args.
+    Requests of the same shape share one statement whose other values are
+    bound parameters, so the pipeline and the column lookups run once per
+    shape, and SQLAlchemy's compiled cache serves the SQL string. Columns
+    are resolved through a whitelist of the model's mapped columns.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[Any, QueryShape], CompiledQuery]" = OrderedDict()
+        self._stats = QueryCacheStats()
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        db_model,
+        request_args: Iterable[Tuple[str, str]]
+    ) -> Tuple[CompiledQuery, Dict[str, Any]]:
+        """
+        Get the statement for request args and the parameters to execute it with.
+
+        Raises:
+            ValueError: If the args are not supported or a value is invalid.
+        """
+        request_args = list(request_args)
+        shape = tuple((key, value) if is_structural_arg(key) else (key,) for key, value in request_args)
+
+        with self._lock:
+            compiled = self._entries.get((db_model, shape))
+            if compiled is not None:
+                self._stats.hits += 1
+                self._entries.move_to_end((db_model, shape))
+            else:
+                self._stats.misses += 1
+
+        if compiled is None:
+            compiled = self._compile(db_model, request_args)
+            with self._lock:
+                self._entries[(db_model, shape)] = compiled
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                self._stats.entries = len(self._entries)
+
+        return compiled, self._get_params(db_model, compiled, request_args)
+
+    def stats(self) -> QueryCacheStats:
+        with self._lock:
+            return QueryCacheStats(**vars(self._stats))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._stats.entries = 0
+
+    def _compile(self, db_model, request_args: List[Tuple[str, str]]) -> CompiledQuery:
+        args: List[Tuple[str, Union[str, BoundValue]]] = []
+        bound_args = []
+        for i, (key, value) in enumerate(request_args):
+            if is_structural_arg(key):
+                args.append((key, value))
+            else:
+                args.append((key, BoundValue(f"p{i}")))
+                bound_args.append((i, f"p{i}", key))
+
+        data = create_request_and_query_data_from_request_args(db_model, args)
+        count_statement = None
+        if data.count_query is not None:
+            count_statement = select(func.count()).select_from(data.count_query.order_by(None).statement.subquery())
+        return CompiledQuery(statement=data.query.statement, count_statement=count_statement,
+                             order_by=data.order_by, limit=data.limit, fields=data.fields,
+                             stream=data.stream, bound_args=bound_args)
+
+    def _get_params(
+        self,
+        db_model,
+        compiled: CompiledQuery,
+        request_args: List[Tuple[str, str]]
+    ) -> Dict[str, Any]:
+
+        params: Dict[str, Any] = {}
+        for i, name, key in compiled.bound_args:
+            value = request_args[i][1]
+            if key == ".offset":
+                params[name] = int(value)
+                continue
+            if key == ".cursor":
+                values = decode_cursor(value)
+                if len(values) != len(compiled.order_by):
+                    raise ValueError(f"Cursor does not match the order: {value}")
+                params.update({f"{name}_{j}": cursor_value for j, cursor_value in enumerate(values)})
+                continue
+
+            column_key, _, operator = key.partition(".")
+            column = get_column(db_model, column_key)
+            if operator in ["like", "startswith"]:
+                params[name] = value
+            elif operator == "in":
+                params[name] = [parse_value(column, part) for part in value.split(",")]
+            elif operator == "between":
+                low, high = split_between_value(value)
+                params[f"{name}_0"] = parse_value(column, low)
+                params[f"{name}_1"] = parse_value(column, high)
+            else:
+                params[name] = parse_value(column, value)
+        return params
+
+
+query_cache = QueryCache()
+
+
+def create_upsert_statement(
+    db_model,
+    rows: List[Dict[str, Any]],
+    conflict_column: str,
+    keep_when_null: Sequence[str] = ()
+):
+    """
+    Create one INSERT ... ON CONFLICT (conflict_column) DO UPDATE for many rows.
+
+    Every row must have the same keys. Columns in `keep_when_null` keep their
+    current value when the new one is NULL. The statement returns the
+    conflict column of every row, and whether the row was inserted.
+    """
+    table = db_model.__table__
+    statement = postgresql.insert(table).values(rows)
+    excluded = statement.excluded
+    updated = [key for key in rows[0] if key != conflict_column]
+    return statement.on_conflict_do_update(
+        index_elements=[conflict_column],
+        set_={
+            key: func.coalesce(excluded[key], table.c[key]) if key in keep_when_null else excluded[key]
+            for key in updated
+        }
+    ).returning(
+        table.c[conflict_column],
+        # xmax is 0 for a row version created by an insert, but not by an update.
+        literal_column("xmax = 0").label("inserted")
+    )
+
+
+# (database URL, table, column) whose unique index was found, so each is only inspected until it exists.
+_unique_indexes = set()
+
+
+def has_unique_index(bind, db_model, column: str) -> bool:
+    """
+    Check that a column is unique on its own, as ON CONFLICT (column) needs.
+
+    The primary key, unique constraints and unique indexes of the table in
+    the database are inspected, not the model, which may predate them.
+    """
+    table = db_model.__table__
+    key = (str(bind.url), table.name, column)
+    if key in _unique_indexes:
+        return True
+    inspector = inspect(bind)
+    unique_columns = [inspector.get_pk_constraint(table.name)["constrained_columns"]]
+    unique_columns += [constraint["column_names"] for constraint in inspector.get_unique_constraints(table.name)]
+    unique_columns += [index["column_names"] for index in inspector.get_indexes(table.name) if index["unique"]]
+    if [column] not in unique_columns:
+        return False
+    _unique_indexes.add(key)
+    return True
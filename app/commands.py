@@ -0,0 +1,31 @@
+import click
+from flask.cli import with_appcontext
+
+from app.models.views.private_pension import EnhancedIndexFund, IndexFund, TargetDateFundV2
+from myutils.bench_store_util import benchmark_store
+from myutils.bench_util import benchmark_registry
+from myutils.screener_util import build_screener_table, screener_store
+
+@click.command("build-benchmarks")
+@click.option("--rebalance", default="D", help="Rebalance frequency: D, M, Q, Y or N.")
+@with_appcontext
+def build_benchmarks_command(rebalance):
+    """预先计算所有基金的复合基准并写入基准存储"""
+    benchmark_registry.refresh()
+    for fund_id in benchmark_registry.get_fund_ids():
+        stored = benchmark_store.build(fund_id, rebalance)
+        click.echo(f"fund {fund_id}: {stored.series.size} rows")
+
+@click.command("build-screener")
+@click.option("--processes", default=None, type=int, help="Number of worker processes, one per CPU by default.")
+@with_appcontext
+def build_screener_command(processes):
+    """计算所有养老基金的评估指标并写入筛选表"""
+    categories = {
+        "fof": [row.code for row in TargetDateFundV2.query.with_entities(TargetDateFundV2.code).distinct()],
+        "indexfunds": [row.code for row in IndexFund.query.with_entities(IndexFund.code)],
+        "enhanced": [row.code for row in EnhancedIndexFund.query.with_entities(EnhancedIndexFund.code)]
+    }
+    table = build_screener_table(categories, processes)
+    screener_store.write(table)
+    click.echo(f"{len(table)} rows written to {screener_store.path}")
@@ -2,13 +2,11 @@ import pytz
 from datetime import datetime
 
 from flask import abort, render_template
-from data_module.data_api import DataManager
 
 from app.main import main_bp
 from app.models.views import Security
 from app.models.views.private_pension import EnhancedIndexFund, IndexFund, TargetDateFundV2
-
-data_manager = DataManager()
+from myutils.screener_util import screener_store
 
 @main_bp.route("/")
 def index():
@@ -39,19 +37,21 @@ def products_funds_fof():
         (TargetDateFundV2.effective_start_date.is_(None) | (TargetDateFundV2.effective_start_date <= today)) &
         (TargetDateFundV2.effective_end_date.is_(None) | (TargetDateFundV2.effective_end_date >= today))
     )
-    return render_template("products/funds/fof.html", funds=funds)
+    return render_template("products/funds/fof.html", funds=funds, metrics=screener_store.get_metrics("fof"))
 
 @main_bp.route("/products/funds/indexfunds")
 def products_funds_indexfunds():
     """指数基金页面"""
     funds = IndexFund.query.all()
-    return render_template("products/funds/indexfunds.html", funds=funds)
+    return render_template("products/funds/indexfunds.html", funds=funds,
+                           metrics=screener_store.get_metrics("indexfunds"))
 
 @main_bp.route("/products/funds/enhanced")
 def products_funds_enhanced():
     """增强指数基金页面"""
     funds = EnhancedIndexFund.query.all()
-    return render_template("products/funds/enhanced.html", funds=funds)
+    return render_template("products/funds/enhanced.html", funds=funds,
+                           metrics=screener_store.get_metrics("enhanced"))
 
 @main_bp.route("/products/funds/<sub_category>/fund/<fund_code>")
 def single_fund(sub_category, fund_code):
@@ -10,9 +10,9 @@ class Security(db.Model):
     __tablename__ = "securities"
 
     id = db.Column(db.Integer, primary_key=True)
-    code = db.Column(db.String())
+    code = db.Column(db.String(), unique=True, index=True)
     symbol = db.Column(db.String())
-    exchange = db.Column(db.String())
-    type = db.Column(db.String())
+    exchange = db.Column(db.String(), index=True)
+    type = db.Column(db.String(), index=True)
     name = db.Column(db.String())
     full_name = db.Column(db.String())
@@ -0,0 +1,48 @@
+"""
+Benchmark of the JSON and the columnar encodings of a long price series.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_columnar
+"""
+import timeit
+
+import numpy as np
+import pandas as pd
+import simplejson as json
+
+from benchmarks.bench_eval_util import make_price_data_array
+from myutils import columnar_util
+
+def encode_json(da) -> bytes:
+    dates = [date.strftime("%Y-%m-%d") for date in pd.to_datetime(da.datetime)]
+    closing_prices = [price.item() for price in da.values]
+    return json.dumps({"dates": dates, "closing_prices": closing_prices},
+                      ignore_nan=True, ensure_ascii=False).encode("utf-8")
+
+def encode_columnar(da) -> bytes:
+    return columnar_util.encode_columns({
+        "dates": columnar_util.get_epoch_days(da.datetime.values),
+        "closing_prices": da.values[:, 0].astype(np.float64)
+    })
+
+def main():
+    da = make_price_data_array()
+    number = 20
+
+    json_payload = encode_json(da)
+    columnar_payload = encode_columnar(da)
+    columns = columnar_util.decode_columns(columnar_payload)
+    np.testing.assert_array_equal(columns["closing_prices"], da.values[:, 0])
+    np.testing.assert_array_equal(columns["dates"].astype("datetime64[D]"), da.datetime.values.astype("datetime64[D]"))
+
+    json_time = timeit.timeit(lambda: encode_json(da), number=number) / number
+    columnar_time = timeit.timeit(lambda: encode_columnar(da), number=number) / number
+
+    print(f"rows: {da.datetime.size}")
+    print(f"json:     {len(json_payload):>9} bytes, {json_time * 1000:.2f} ms")
+    print(f"columnar: {len(columnar_payload):>9} bytes, {columnar_time * 1000:.2f} ms")
+    print(f"size ratio: {len(json_payload) / len(columnar_payload):.1f}x, speedup: {json_time / columnar_time:.1f}x")
+
+if __name__ == "__main__":
+    main()
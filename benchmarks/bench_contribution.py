@@ -0,0 +1,66 @@
+"""
+Benchmark of contribution_util.get_contribution_table against backtesting every account on its own.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_contribution
+"""
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.bench_eval_util import make_price_data_array
+from myutils import contribution_util
+
+def backtest_account(monthly_price: np.ndarray, last_price: float, amount: float, tail_years: float):
+    units = np.cumsum(amount / monthly_price)
+    balance = units * monthly_price
+    final_value = units[-1] * last_price
+    years_to_end = tail_years + (monthly_price.size - 1 - np.arange(monthly_price.size)) / 12
+    low, high = -10.0, 10.0
+    for _ in range(60):
+        middle = (low + high) / 2
+        if (amount * np.exp(middle * years_to_end)).sum() > final_value:
+            high = middle
+        else:
+            low = middle
+    return {
+        "final_value": final_value,
+        "irr": np.expm1((low + high) / 2),
+        "max_drawdown": np.max(1 - balance / np.maximum.accumulate(balance)),
+        "max_loss": max(np.max(1 - balance / (amount * np.arange(1, monthly_price.size + 1))), 0.0)
+    }
+
+def backtest_accounts(da, amount: float):
+    monthly = contribution_util.get_monthly_prices(da)
+    tail_years = (pd.Timestamp(da.datetime.values[-1]) - pd.Timestamp(monthly.month.values[-1])).days / 365.25
+    return {
+        (start, security): backtest_account(monthly.values[start:, security], da.values[-1, security],
+                                            amount, tail_years)
+        for security in range(monthly.shape[1])
+        for start in range(monthly.shape[0])
+    }
+
+def main():
+    da = make_price_data_array(years=20, securities=300)
+    amount = 1000
+    number = 5
+
+    table = contribution_util.get_contribution_table(da, amount)
+    sample = da.isel(security=slice(0, 3))
+    for (start, security), expected in backtest_accounts(sample, amount).items():
+        for field, value in expected.items():
+            np.testing.assert_allclose(table[field].values[start, security], value, rtol=1e-6, atol=1e-9)
+
+    per_account = timeit.timeit(lambda: backtest_accounts(sample, amount), number=1) / (table.start.size * 3)
+    engine = timeit.timeit(lambda: contribution_util.get_contribution_table(da, amount), number=number) / number
+    accounts = table.start.size * table.security.size
+
+    print(f"funds: {table.security.size}, start months: {table.start.size}, accounts: {accounts}")
+    print(f"per account (extrapolated): {per_account * accounts * 1000:.0f} ms")
+    print(f"contribution table:         {engine * 1000:.1f} ms")
+    print(f"speedup:                    {per_account * accounts / engine:.0f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Benchmark of eval_util.get_evaluation_results on a 40-year daily series.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_eval_util
+"""
+import timeit
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from myutils import eval_util
+
+def make_price_data_array(years: int = 40, securities: int = 1, seed: int = 0) -> xr.DataArray:
+    datetimes = pd.bdate_range(end="2024-12-13", periods=years * 252)
+    rng = np.random.default_rng(seed)
+    r = rng.normal(0.0003, 0.012, size=(datetimes.size, securities))
+    prices = 1000 * np.exp(np.cumsum(r, axis=0))
+    return xr.DataArray(
+        prices,
+        coords={"datetime": datetimes, "security": [f"S{i:04d}" for i in range(securities)]},
+        dims=("datetime", "security")
+    )
+
+def get_evaluation_results_per_period(da: xr.DataArray):
+    periods = eval_util.get_evaluation_periods(da.datetime[0].item(), da.datetime[-1].item())
+    return [eval_util.get_evaluation_result(da, period) for period in periods]
+
+def main():
+    da = make_price_data_array()
+    number = 5
+
+    baseline = timeit.timeit(lambda: get_evaluation_results_per_period(da), number=number) / number
+    engine = timeit.timeit(lambda: eval_util.get_evaluation_results(da), number=number) / number
+
+    expected = get_evaluation_results_per_period(da)
+    actual = eval_util.get_evaluation_results(da)
+    for e, a in zip(expected, actual):
+        for field in ["annualized_return", "annualized_volatility", "sharpe_ratio", "max_drawdown"]:
+            np.testing.assert_allclose(getattr(a, field), getattr(e, field), rtol=1e-9)
+
+    print(f"rows: {da.datetime.size}, periods: {len(actual)}")
+    print(f"per period:  {baseline * 1000:.2f} ms")
+    print(f"single pass: {engine * 1000:.2f} ms")
+    print(f"speedup:     {baseline / engine:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark of portfolio_util on 200 funds, checking the optimality conditions of every solution.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_portfolio
+"""
+import timeit
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from myutils import portfolio_util
+from myutils.correlation_util import get_covariance
+
+def make_fund_data_array(years: int = 5, funds: int = 200, seed: int = 0) -> xr.DataArray:
+    # Funds load on a common market factor, so their returns are correlated.
+    datetimes = pd.bdate_range(end="2024-12-13", periods=years * 252)
+    rng = np.random.default_rng(seed)
+    market = rng.normal(0.0003, 0.01, size=(datetimes.size, 1))
+    r = market * rng.uniform(0.2, 1.2, size=funds) + rng.normal(0.0001, rng.uniform(0.002, 0.01, size=funds),
+                                                                 size=(datetimes.size, funds))
+    return xr.DataArray(
+        1000 * np.exp(np.cumsum(r, axis=0)),
+        coords={"datetime": datetimes, "security": [f"F{i:04d}" for i in range(funds)]},
+        dims=("datetime", "security")
+    )
+
+def project_by_bisection(v: np.ndarray, caps: np.ndarray) -> np.ndarray:
+    low, high = v.min() - 1, v.max()
+    for _ in range(100):
+        tau = (low + high) / 2
+        if np.clip(v - tau, 0, caps).sum() > 1:
+            low = tau
+        else:
+            high = tau
+    return np.clip(v - (low + high) / 2, 0, caps)
+
+def min_variance_by_projected_gradient(covariance: np.ndarray, caps: np.ndarray, tolerance: float = 1e-9):
+    # Plain projected gradient steps, projecting by bisection.
+    step = 1 / (2 * np.linalg.eigvalsh(covariance).max())
+    w = project_by_bisection(np.full(caps.size, 1 / caps.size), caps)
+    for _ in range(100000):
+        w_next = project_by_bisection(w - step * 2 * covariance @ w, caps)
+        if np.abs(w_next - w).max() < tolerance:
+            return w_next
+        w = w_next
+    return w
+
+def check_optimality(gradient: np.ndarray, w: np.ndarray, caps: np.ndarray, tolerance: float):
+    # At the minimum, funds strictly inside their bounds share one gradient,
+    # which no fund at zero undercuts and no fund at its cap exceeds.
+    free = (w > 1e-7) & (w < caps - 1e-7)
+    level = np.median(gradient[free])
+    assert np.abs(gradient[free] - level).max() < tolerance
+    assert (gradient[w <= 1e-7] >= level - tolerance).all()
+    assert (gradient[w >= caps - 1e-7] <= level + tolerance).all()
+
+def main():
+    da = make_fund_data_array()
+    result = get_covariance(da)
+    covariance = result.covariance
+    expected_returns = portfolio_util.get_expected_returns(da)
+    securities = result.securities.tolist()
+    caps = portfolio_util.get_caps(len(securities), 0.1)
+    number = 20
+
+    v = np.random.default_rng(1).normal(0, 0.1, size=(50, caps.size))
+    np.testing.assert_allclose(portfolio_util.project_capped_simplex(v, caps),
+                               [project_by_bisection(row, caps) for row in v], atol=1e-9)
+
+    min_variance = portfolio_util.build_portfolio(securities, covariance, expected_returns, "min_variance", 0.1)
+    w = np.array(min_variance.weights)
+    check_optimality(2 * covariance @ w, w, caps, 1e-6)
+    np.testing.assert_allclose(w, min_variance_by_projected_gradient(covariance, caps), atol=1e-5)
+
+    risk_parity = portfolio_util.build_portfolio(securities, covariance, expected_returns, "risk_parity")
+    np.testing.assert_allclose(risk_parity.risk_contributions, 1 / len(securities), rtol=1e-6)
+
+    target = 0.12
+    target_volatility = portfolio_util.build_portfolio(securities, covariance, expected_returns,
+                                                       "target_volatility", 0.1, target)
+    np.testing.assert_allclose(target_volatility.volatility, target, rtol=1e-9)
+    assert target_volatility.expected_return >= min_variance.expected_return
+    assert all(portfolio.converged for portfolio in [min_variance, risk_parity, target_volatility])
+
+    baseline = timeit.timeit(lambda: min_variance_by_projected_gradient(covariance, caps), number=1)
+    print(f"funds: {len(securities)}, max weight: 0.1, dates: {da.datetime.size}")
+    print(f"min variance (plain projected gradient): {baseline * 1000:.1f} ms")
+    for method in portfolio_util.PORTFOLIO_METHODS:
+        portfolio = portfolio_util.build_portfolio(securities, covariance, expected_returns, method,
+                                                   None if method == "risk_parity" else 0.1, target)
+        elapsed = timeit.timeit(lambda: portfolio_util.build_portfolio(
+            securities, covariance, expected_returns, method, None if method == "risk_parity" else 0.1, target
+        ), number=number) / number
+        print(f"{method + ':':<40} {elapsed * 1000:.1f} ms, {portfolio.iterations} iterations, "
+              f"volatility {portfolio.volatility:.4f}")
+
+    backtest = timeit.timeit(lambda: portfolio_util.evaluate_portfolio(
+        portfolio_util.backtest_portfolio(da, w, "M")
+    ), number=number) / number
+    print(f"{'backtest and evaluation:':<40} {backtest * 1000:.1f} ms")
+
+if __name__ == "__main__":
+    main()
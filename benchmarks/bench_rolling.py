@@ -0,0 +1,59 @@
+"""
+Benchmark of rolling_util.get_rolling_table against evaluating every window on its own.
+
+Evaluating each window with eval_util.get_evaluation_result is quadratic, so
+it is timed on a sample of windows and extrapolated to all of them.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_rolling
+"""
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.bench_eval_util import make_price_data_array
+from myutils import eval_util, rolling_util
+
+METRICS = ["annualized_return", "annualized_volatility", "sharpe_ratio", "max_drawdown"]
+
+def evaluate_windows(da, window: str, ends):
+    months = rolling_util.ROLLING_WINDOWS[window]
+    results = []
+    for end in ends:
+        end_date = pd.Timestamp(da.datetime.values[end])
+        period = eval_util.EvaluationPeriod(window, end_date - pd.DateOffset(months=months), end_date)
+        results.append(eval_util.get_evaluation_result(da, period))
+    return results
+
+def main():
+    da = make_price_data_array(years=20, securities=1)
+    sample = 50
+    number = 5
+
+    table = rolling_util.get_rolling_table(da)
+    for window in table.window.values:
+        has_result = np.flatnonzero(~np.isnan(table["annualized_return"].sel(window=window).values[:, 0]))
+        ends = has_result[np.linspace(0, has_result.size - 1, sample).astype(int)]
+        for end, expected in zip(ends, evaluate_windows(da, window, ends)):
+            for field in METRICS:
+                actual = table[field].sel(window=window).values[end, 0]
+                np.testing.assert_allclose(actual, getattr(expected, field), rtol=1e-9)
+
+    windows = int((table["observations"] > 0).sum())
+    ends = np.arange(da.datetime.size - sample, da.datetime.size)
+    per_window = timeit.timeit(lambda: evaluate_windows(da, "3Y", ends), number=1) / sample
+    rolling = timeit.timeit(lambda: rolling_util.get_rolling_table(da), number=number) / number
+
+    wide = make_price_data_array(years=20, securities=500)
+    wide_rolling = timeit.timeit(lambda: rolling_util.get_rolling_table(wide), number=1)
+
+    print(f"rows: {da.datetime.size}, windows: {windows}")
+    print(f"per window (extrapolated): {per_window * windows * 1000:.0f} ms")
+    print(f"rolling table:             {rolling * 1000:.2f} ms")
+    print(f"speedup:                   {per_window * windows / rolling:.0f}x")
+    print(f"rolling table, 500 securities: {wide_rolling * 1000:.0f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -6,3 +6,23 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.getenv("SQLALCHEMY_DATABASE_URI")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SECRET_KEY = os.getenv("SECRET_KEY")  # 用于会话安全，实际使用中请更换
+    # 行情缓存的内存上限（字节），以及每日收盘数据入库的时刻（北京时间，小时）
+    PRICE_CACHE_MAX_BYTES = int(os.getenv("PRICE_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+    PRICE_CACHE_ROLLOVER_HOUR = int(os.getenv("PRICE_CACHE_ROLLOVER_HOUR", 17))
+    # 预先计算的复合基准序列的存放目录
+    BENCHMARK_STORE_DIR = os.getenv("BENCHMARK_STORE_DIR", "instance/benchmarks")
+    # 基准定义在内存中的刷新间隔（秒）
+    BENCHMARK_REGISTRY_TTL = int(os.getenv("BENCHMARK_REGISTRY_TTL", 3600))
+    # 是否在应用启动时加载基准定义（0 表示在首次使用时加载）
+    BENCHMARK_REGISTRY_PRELOAD = os.getenv("BENCHMARK_REGISTRY_PRELOAD", "1") == "1"
+    # 每晚预先计算的基金筛选表的存放路径
+    SCREENER_TABLE_PATH = os.getenv("SCREENER_TABLE_PATH", "instance/screener.npz")
+    # 接口响应缓存（压缩后）的内存上限（字节）
+    RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+    # 小于该大小（字节）的响应不压缩
+    RESPONSE_CACHE_MIN_COMPRESS_BYTES = int(os.getenv("RESPONSE_CACHE_MIN_COMPRESS_BYTES", 1024))
+    # 持有期模拟（自助抽样）的路径数，以及所用的进程数（1 表示在请求进程内模拟，不创建进程池）
+    HOLDING_SIMULATIONS = int(os.getenv("HOLDING_SIMULATIONS", 10000))
+    HOLDING_SIMULATION_PROCESSES = int(os.getenv("HOLDING_SIMULATION_PROCESSES", 1))
+    # 协方差/相关系数矩阵缓存的内存上限（字节）
+    COVARIANCE_CACHE_MAX_BYTES = int(os.getenv("COVARIANCE_CACHE_MAX_BYTES", 256 * 1024 * 1024))
@@ -0,0 +1,258 @@
+import glob
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from myutils import bench_util
+from myutils.cache_util import get_trading_day, price_cache
+from myutils.rebalance_util import get_rebalance_keys
+
+SERIES_DTYPE = np.dtype([("datetime", "<M8[ns]"), ("value", "<f8")])
+# Files older than this which the sidecar does not name cannot belong to a build still in flight.
+STALE_FILE_SECONDS = 600
+
+@dataclass
+class StoredSeries:
+    definition_version: str
+    trading_day: date
+    series: np.ndarray
+
+def get_definition_version(benchmark_segments: List[bench_util.BenchmarkSegment]) -> str:
+    """
+    Get a version of benchmark definitions which changes whenever they change.
+
+    Args:
+        benchmark_segments: The benchmark segments of a fund.
+
+    Returns:
+        A hex digest of the segments, independent of their order.
+    """
+    definition = sorted(
+        (
+            str(segment.effective_start_date),
+            str(segment.effective_end_date),
+            sorted((con.security, con.weight) for con in segment.constituents)
+        )
+        for segment in benchmark_segments
+    )
+    return hashlib.sha1(repr(definition).encode("utf-8")).hexdigest()
+
+class BenchmarkStore:
+    """
+    Persistent store of chained composite benchmark series, one file per fund.
+
+    Each series is a memory-mapped .npy file of (datetime, value) records
+    with a JSON sidecar holding the definition version and the trading day
+    it was built for, and naming the series file. A series is rebuilt when
+    the fund's benchmark definitions change, and extended with the new rows
+    when a new trading day has started. Requests only slice the stored
+    series.
+
+    Every write creates a new series file under a unique name, then replaces
+    the sidecar. Replacing the sidecar is atomic, so readers always find
+    the series it describes, also when several processes write a fund at
+    once. A series file left behind by a write whose sidecar was replaced
+    by a concurrent one is removed by a later write of the fund.
+    """
+
+    def __init__(self, directory: str = "instance/benchmarks"):
+        self.directory = directory
+        self._series: Dict[Tuple[int, str], StoredSeries] = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        self.directory = app.config.get("BENCHMARK_STORE_DIR", self.directory)
+
+    def get_data(self, fund_id: int, start_date, end_date, rebalance: str = "D") -> xr.DataArray:
+        """
+        Get a slice of the stored benchmark of a fund, building it if needed.
+
+        Args:
+            fund_id: The fund ID.
+            start_date: The start date, or None.
+            end_date: The end date, or None.
+            rebalance: The rebalance frequency of get_chained_benchmark_data.
+
+        Returns:
+            DataArray with dimensions of (datetime) containing the benchmark.
+        """
+        series = self._get_series(int(fund_id), rebalance)
+        datetimes = series["datetime"]
+        start = 0 if start_date is None else \
+            int(np.searchsorted(datetimes, np.datetime64(pd.Timestamp(start_date)), side="left"))
+        end = datetimes.size if end_date is None else \
+            int(np.searchsorted(datetimes, np.datetime64(pd.Timestamp(end_date)), side="right"))
+        return xr.DataArray(np.array(series["value"][start:end]),
+                            coords={"datetime": np.array(datetimes[start:end])},
+                            dims="datetime", name="AdjClose")
+
+    def build(self, fund_id: int, rebalance: str = "D") -> StoredSeries:
+        """
+        Build the whole benchmark series of a fund and write it to the store.
+
+        Args:
+            fund_id: The fund ID.
+            rebalance: The rebalance frequency of get_chained_benchmark_data.
+
+        Returns:
+            The stored series, memory-mapped from its file.
+        """
+        definition_version = get_definition_version(bench_util.get_benchmark_segments(fund_id))
+        trading_day = get_trading_day(datetime.now(), price_cache.rollover_hour)
+        da = bench_util.get_chained_benchmark_data(fund_id, None, None, rebalance)
+        return self._write(fund_id, rebalance, definition_version, trading_day,
+                           _to_series(da.datetime.values, da.values))
+
+    def extend(self, fund_id: int, stored: StoredSeries, rebalance: str = "D") -> StoredSeries:
+        """
+        Append the rows after the last stored date to the series of a fund.
+
+        The benchmark is chained again from the close before the rebalance
+        period of the last stored row, at the stored level, so the weights
+        continue as in a whole build while only that period is reloaded. The
+        stored rows are kept as they are. The definitions must be unchanged
+        since the series was stored; otherwise it must be built again.
+
+        Args:
+            fund_id: The fund ID.
+            stored: The stored series of the fund.
+            rebalance: The rebalance frequency of get_chained_benchmark_data.
+
+        Returns:
+            The extended stored series, memory-mapped from its file.
+        """
+        series = stored.series
+        restart = self._get_restart_row(fund_id, series["datetime"], rebalance)
+        if restart == 0:
+            return self.build(fund_id, rebalance)
+
+        trading_day = get_trading_day(datetime.now(), price_cache.rollover_hour)
+        anchor = restart - 1
+        da = bench_util.get_chained_benchmark_data(fund_id, pd.Timestamp(series["datetime"][anchor]), None,
+                                                   rebalance, base=float(series["value"][anchor]))
+        new_rows = da.datetime.values > series["datetime"][-1]
+        new_series = _to_series(da.datetime.values[new_rows], da.values[new_rows])
+        return self._write(fund_id, rebalance, stored.definition_version, trading_day,
+                           np.concatenate([np.asarray(series), new_series]))
+
+    @staticmethod
+    def _get_restart_row(fund_id: int, datetimes: np.ndarray, rebalance: str) -> int:
+        # The first row of the rebalance period of the last row, which never
+        # reaches back before the segment of the last row, as a segment starts
+        # with its weights restored.
+        if datetimes.size == 0:
+            return 0
+        keys = get_rebalance_keys(datetimes, rebalance)
+        restart = int(np.searchsorted(keys, keys[-1], side="left"))
+        segment = bench_util.benchmark_registry.get_segment_on(fund_id, datetimes[-1])
+        if segment is None:
+            return 0
+        if segment.effective_start_date is not None:
+            segment_start = np.datetime64(pd.Timestamp(segment.effective_start_date), "ns")
+            restart = max(restart, int(np.searchsorted(datetimes, segment_start, side="left")))
+        return restart
+
+    def _write(self, fund_id: int, rebalance: str, definition_version: str, trading_day: date,
+               series: np.ndarray) -> StoredSeries:
+        os.makedirs(self.directory, exist_ok=True)
+        stem = self._get_stem(fund_id, rebalance)
+        previous = self._read_meta(fund_id, rebalance)
+        fd, series_path = tempfile.mkstemp(dir=self.directory, prefix=os.path.basename(stem) + ".", suffix=".npy")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, series)
+        # Map the series before publishing it, as a later write may remove it again.
+        stored = StoredSeries(definition_version=definition_version, trading_day=trading_day,
+                              series=np.load(series_path, mmap_mode="r"))
+        # Write the sidecar to a temporary file and rename it, so readers never see a partial one.
+        fd, meta_tmp_path = tempfile.mkstemp(dir=self.directory, prefix=os.path.basename(stem) + ".", suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump({"definition_version": definition_version, "trading_day": trading_day.isoformat(),
+                       "series_file": os.path.basename(series_path)}, f)
+        os.replace(meta_tmp_path, stem + ".json")
+        if previous is not None and previous.get("series_file") != os.path.basename(series_path):
+            self._remove(os.path.join(self.directory, previous["series_file"]))
+        self._remove_stale_files(fund_id, rebalance)
+
+        with self._lock:
+            self._series[(fund_id, rebalance)] = stored
+        return stored
+
+    def _remove_stale_files(self, fund_id: int, rebalance: str) -> None:
+        # Two writes may read the same previous sidecar, and the one whose
+        # sidecar is replaced first leaves its series file behind. Files the
+        # sidecar does not name are removed once they are too old to belong
+        # to a write still in flight.
+        stem = self._get_stem(fund_id, rebalance)
+        meta = self._read_meta(fund_id, rebalance)
+        current = None if meta is None else meta.get("series_file")
+        cutoff = time.time() - STALE_FILE_SECONDS
+        for path in glob.glob(glob.escape(stem) + ".*.npy") + glob.glob(glob.escape(stem) + ".*.tmp"):
+            if os.path.basename(path) == current:
+                continue
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _get_stem(self, fund_id: int, rebalance: str) -> str:
+        return os.path.join(self.directory, f"{fund_id}-{rebalance}")
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _read_meta(self, fund_id: int, rebalance: str) -> Optional[dict]:
+        try:
+            with open(self._get_stem(fund_id, rebalance) + ".json", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _get_series(self, fund_id: int, rebalance: str) -> np.ndarray:
+        definition_version = get_definition_version(bench_util.get_benchmark_segments(fund_id))
+        trading_day = get_trading_day(datetime.now(), price_cache.rollover_hour)
+
+        stored = self._series.get((fund_id, rebalance)) or self._load(fund_id, rebalance)
+        if stored is None or stored.definition_version != definition_version:
+            stored = self.build(fund_id, rebalance)
+        elif stored.trading_day != trading_day:
+            stored = self.extend(fund_id, stored, rebalance)
+        return stored.series
+
+    def _load(self, fund_id: int, rebalance: str) -> Optional[StoredSeries]:
+        meta = self._read_meta(fund_id, rebalance)
+        if meta is None or "series_file" not in meta:
+            return None
+        try:
+            # A concurrent build may have replaced the sidecar and removed this series since.
+            series = np.load(os.path.join(self.directory, meta["series_file"]), mmap_mode="r")
+        except FileNotFoundError:
+            return None
+        stored = StoredSeries(definition_version=meta["definition_version"],
+                              trading_day=date.fromisoformat(meta["trading_day"]),
+                              series=series)
+        with self._lock:
+            self._series[(fund_id, rebalance)] = stored
+        return stored
+
+def _to_series(datetimes: np.ndarray, values: np.ndarray) -> np.ndarray:
+    series = np.empty(datetimes.size, dtype=SERIES_DTYPE)
+    series["datetime"] = datetimes
+    series["value"] = values
+    return series
+
+benchmark_store = BenchmarkStore()
@@ -1,11 +1,19 @@
+import threading
+import time
 from dataclasses import dataclass
 from datetime import date
-from typing import Dict, List, Union
+from typing import Dict, List, Optional, Tuple
 
+import numpy as np
+import pandas as pd
 import xarray as xr
-from data_module.data_api import DataManager
 
 from app.models import views
+from myutils.cache_util import price_cache
+from myutils.rebalance_util import REBALANCE_FREQUENCIES, get_rebalance_keys, get_rebalanced_growth
+
+# Long enough to find the close before a segment across the longest holidays.
+ANCHOR_LOOKBACK = pd.Timedelta(days=31)
 
 @dataclass
 class BenchmarkCon:
@@ -18,58 +26,300 @@ class BenchmarkSegment:
     effective_start_date: date
     effective_end_date: date
 
-def _get_benchmark_segments(fund_id: int) -> List[BenchmarkSegment]:
-    fund_benchmarks = views.FundBenchmark.query.filter_by(fund_id=fund_id).all()
-    benchmark_dict: Dict[int, List[views.FundBenchmark]] = {}
-    for fund_benchmark in fund_benchmarks:
-        benchmark_dict.setdefault(fund_benchmark.benchmark_id, list()) \
-                      .append(fund_benchmark)
-
-    benchmark_segments: List[BenchmarkSegment] = []
-    for _, benchmark_list in benchmark_dict.items():
-        benchmark_cons: List[BenchmarkCon] = []
-        for benchmark in benchmark_list:
-            benchmark_cons.append(BenchmarkCon(
-                security=benchmark.constituent_security_code,
-                weight=benchmark.constituent_weight
+@dataclass
+class FundBenchmarkSegments:
+    starts: np.ndarray
+    ends: np.ndarray
+    segments: List[BenchmarkSegment]
+
+MIN_DATETIME = np.datetime64(np.iinfo(np.int64).min + 1, "ns")
+MAX_DATETIME = np.datetime64(np.iinfo(np.int64).max, "ns")
+
+class BenchmarkRegistry:
+    """
+    In-memory index of the benchmark definitions of every fund.
+
+    The whole v_fund_benchmarks view is loaded with one query and grouped
+    into segments per fund, sorted by effective start date. It is loaded
+    when the app starts, reloaded once `ttl_seconds` have passed, or on
+    demand with refresh().
+    """
+
+    def __init__(self, ttl_seconds: float = 3600):
+        self.ttl_seconds = ttl_seconds
+        self._funds: Dict[int, FundBenchmarkSegments] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        self.ttl_seconds = app.config.get("BENCHMARK_REGISTRY_TTL", self.ttl_seconds)
+        if app.config.get("BENCHMARK_REGISTRY_PRELOAD", True):
+            with app.app_context():
+                self.refresh()
+
+    def refresh(self) -> None:
+        # The view's primary key is not unique over its rows, so plain columns
+        # are selected; ORM entities would be merged in the identity map.
+        fund_benchmarks = views.FundBenchmark.query.with_entities(
+            views.FundBenchmark.fund_id,
+            views.FundBenchmark.benchmark_id,
+            views.FundBenchmark.effective_start_date,
+            views.FundBenchmark.effective_end_date,
+            views.FundBenchmark.constituent_security_code,
+            views.FundBenchmark.constituent_weight
+        ).all()
+
+        # A benchmark may be used over several date ranges, so a segment is a
+        # (benchmark_id, effective_start_date, effective_end_date) group.
+        segment_dict: Dict[int, Dict[tuple, BenchmarkSegment]] = {}
+        for fund_benchmark in fund_benchmarks:
+            key = (fund_benchmark.benchmark_id, fund_benchmark.effective_start_date,
+                   fund_benchmark.effective_end_date)
+            segment = segment_dict.setdefault(fund_benchmark.fund_id, {}).get(key)
+            if segment is None:
+                segment = BenchmarkSegment(
+                    constituents=[],
+                    effective_start_date=fund_benchmark.effective_start_date,
+                    effective_end_date=fund_benchmark.effective_end_date
+                )
+                segment_dict[fund_benchmark.fund_id][key] = segment
+            segment.constituents.append(BenchmarkCon(
+                security=fund_benchmark.constituent_security_code,
+                weight=fund_benchmark.constituent_weight
             ))
-        benchmark_segments.append(BenchmarkSegment(
-            constituents=benchmark_cons,
-            effective_start_date=benchmark_list[0].effective_start_date,
-            effective_end_date=benchmark_list[0].effective_end_date
-        ))
 
-    return benchmark_segments
+        funds: Dict[int, FundBenchmarkSegments] = {}
+        for fund_id, segments in segment_dict.items():
+            starts = np.array([_to_datetime64(segment.effective_start_date, MIN_DATETIME)
+                               for segment in segments.values()], dtype="datetime64[ns]")
+            order = np.argsort(starts, kind="stable")
+            segments = [list(segments.values())[i] for i in order]
+            ends = np.array([_to_datetime64(segment.effective_end_date, MAX_DATETIME) for segment in segments],
+                            dtype="datetime64[ns]")
+            funds[fund_id] = FundBenchmarkSegments(starts=starts[order], ends=ends, segments=segments)
+
+        with self._lock:
+            self._funds = funds
+            self._loaded_at = time.monotonic()
+
+    def get_fund_ids(self) -> List[int]:
+        return list(self._get_funds())
+
+    def get_segments(self, fund_id: int) -> List[BenchmarkSegment]:
+        """
+        Get the benchmark segments of a fund, sorted by effective start date.
+
+        Args:
+            fund_id: The fund ID.
+
+        Returns:
+            A list of BenchmarkSegment objects.
+        """
+        fund = self._get_funds().get(int(fund_id))
+        return [] if fund is None else list(fund.segments)
+
+    def get_segment_on(self, fund_id: int, on_date) -> Optional[BenchmarkSegment]:
+        """
+        Find the benchmark segment of a fund in effect on a date.
+
+        Args:
+            fund_id: The fund ID.
+            on_date: The date.
+
+        Returns:
+            The BenchmarkSegment, or None if no segment was in effect.
+        """
+        fund = self._get_funds().get(int(fund_id))
+        if fund is None:
+            return None
+        on_date = np.datetime64(pd.Timestamp(on_date), "ns")
+        i = int(np.searchsorted(fund.starts, on_date, side="right")) - 1
+        if i < 0 or on_date > fund.ends[i]:
+            return None
+        return fund.segments[i]
+
+    def _get_funds(self) -> Dict[int, FundBenchmarkSegments]:
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl_seconds:
+            self.refresh()
+        return self._funds
+
+def get_benchmark_segments(fund_id: int) -> List[BenchmarkSegment]:
+    """
+    Get the benchmark segments of a fund from the registry.
+
+    Args:
+        fund_id: The fund ID.
+
+    Returns:
+        A list of BenchmarkSegment objects, sorted by effective start date.
+    """
+    return benchmark_registry.get_segments(fund_id)
+
+def _to_datetime64(value: Optional[date], default: np.datetime64) -> np.datetime64:
+    return default if value is None else np.datetime64(value, "ns")
+
+def _get_weight_matrix(benchmark_segments: List[BenchmarkSegment],
+                       securities: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Build a (segment, security) weight matrix with segments sorted by start date.
 
-def get_benchmark_data(fund_id: str, start_date: date, end_date: date) -> List[Dict[str, Union[str, float]]]:
-    benchmark_segments = _get_benchmark_segments(fund_id)
+    Args:
+        benchmark_segments: The benchmark segments.
+        securities: The securities, in the order of the matrix columns.
+
+    Returns:
+        The start dates, the end dates and the weight matrix of the segments.
+        Open-ended dates are the min or max datetime64.
+    """
+    segments = sorted(benchmark_segments,
+                      key=lambda segment: _to_datetime64(segment.effective_start_date, MIN_DATETIME))
+
+    column = {security: i for i, security in enumerate(securities)}
+    weights = np.zeros((len(segments), len(securities)))
+    for i, segment in enumerate(segments):
+        # A security listed twice in a segment weighs the sum, as in get_chained_benchmark_data.
+        for benchmark_con in segment.constituents:
+            weights[i, column[benchmark_con.security]] += benchmark_con.weight
+
+    starts = np.array([_to_datetime64(segment.effective_start_date, MIN_DATETIME) for segment in segments],
+                      dtype="datetime64[ns]")
+    ends = np.array([_to_datetime64(segment.effective_end_date, MAX_DATETIME) for segment in segments],
+                    dtype="datetime64[ns]")
+    return starts, ends, weights
+
+def get_benchmark_data(fund_id: str, start_date: date, end_date: date) -> xr.DataArray:
+    """
+    Calculate the composite benchmark of a fund as the weighted sum of prices.
+
+    Each date takes the weights of the segment in effect on it, found with a
+    binary search on the segment start dates. Dates outside every segment, or
+    missing the price of a constituent in effect, are left out.
+
+    Args:
+        fund_id: The fund ID.
+        start_date: The start date.
+        end_date: The end date.
+
+    Returns:
+        DataArray with dimensions of (datetime) containing the benchmark.
+    """
+    benchmark_segments = get_benchmark_segments(fund_id)
 
     benchmark_securities: List[str] = []
     for benchmark_segment in benchmark_segments:
         benchmark_securities.extend(benchmark_con.security for benchmark_con in benchmark_segment.constituents)
     benchmark_securities = list(dict.fromkeys(benchmark_securities))
+    if len(benchmark_securities) == 0:
+        return xr.DataArray(np.empty(0), coords={"datetime": np.empty(0, dtype="datetime64[ns]")},
+                            dims="datetime", name="AdjClose")
 
-    data_manager = DataManager()
-    ds = data_manager.get_data(
+    ds = price_cache.get_data(
         start=start_date,
         end=end_date,
         frequency="1d",
         securities=benchmark_securities,
         fields=["AdjClose"]
     )
+    da = ds["AdjClose"].reindex(security=benchmark_securities).transpose("datetime", "security")
+    datetimes = da.datetime.values
+
+    starts, ends, weights = _get_weight_matrix(benchmark_segments, benchmark_securities)
+    segment = np.maximum(np.searchsorted(starts, datetimes, side="right") - 1, 0)
+    in_segment = (datetimes >= starts[segment]) & (datetimes <= ends[segment])
+
+    daily_weights = weights[segment]
+    # Constituents out of the segment must not turn the sum into NaN.
+    price = np.where(daily_weights != 0, da.values, 0.0)
+    value = np.einsum("ij,ij->i", price, daily_weights)
+
+    keep = in_segment & ~np.isnan(value)
+    return xr.DataArray(value[keep], coords={"datetime": datetimes[keep]}, dims="datetime", name="AdjClose")
+
+def get_chained_benchmark_data(fund_id: str, start_date: date, end_date: date,
+                               rebalance: str = "D", base: float = 1000.0) -> xr.DataArray:
+    """
+    Calculate the composite benchmark of a fund by chaining weighted returns.
+
+    Segments are processed one at a time, so only the constituents of one
+    segment are loaded at once. Each segment continues from the level at the
+    end of the previous one, so there are no jumps at segment boundaries.
+
+    Args:
+        fund_id: The fund ID.
+        start_date: The start date.
+        end_date: The end date.
+        rebalance: How often the weights are restored: "D" daily, "M"
+            monthly, "Q" quarterly, "Y" yearly, or "N" only at segment starts.
+        base: The level of the benchmark on its first date.
+
+    Returns:
+        DataArray with dimensions of (datetime) containing the benchmark.
+    """
+    if rebalance not in REBALANCE_FREQUENCIES:
+        raise ValueError(f"Unsupported rebalance frequency: {rebalance}")
+
+    min_datetime = pd.Timestamp.min
+    max_datetime = pd.Timestamp.max
+    start_date = min_datetime if start_date is None else pd.Timestamp(start_date)
+    end_date = max_datetime if end_date is None else pd.Timestamp(end_date)
+    benchmark_segments = sorted(
+        get_benchmark_segments(fund_id),
+        key=lambda segment: min_datetime if segment.effective_start_date is None
+                            else pd.Timestamp(segment.effective_start_date)
+    )
 
-    da_weight = xr.zeros_like(ds["AdjClose"])
+    level = base
+    datetimes_list: List[np.ndarray] = []
+    values_list: List[np.ndarray] = []
     for benchmark_segment in benchmark_segments:
+        window_start = max(start_date, min_datetime if benchmark_segment.effective_start_date is None
+                           else pd.Timestamp(benchmark_segment.effective_start_date))
+        window_end = min(end_date, max_datetime if benchmark_segment.effective_end_date is None
+                         else pd.Timestamp(benchmark_segment.effective_end_date))
+        if datetimes_list:
+            window_start = max(window_start, pd.Timestamp(datetimes_list[-1][-1]) + pd.Timedelta(days=1))
+        if window_start > window_end:
+            continue
+
+        weight_dict: Dict[str, float] = {}
         for benchmark_con in benchmark_segment.constituents:
-            # Set da_weight to benchmark_con.weight, where
-            # datetime between benchmark_segment.effective_start_date and benchmark_segment.effective_end_date, and
-            # security is benchmark_con.security
-            da_weight.loc[{"datetime": slice(benchmark_segment.effective_start_date, benchmark_segment.effective_end_date),
-                           "security": benchmark_con.security}] = benchmark_con.weight
-
-    da = ds["AdjClose"] * da_weight
-    da = da.sum(dim="security", skipna=False)
-    s = da.to_pandas().dropna()
-    datetimes = [i.strftime("%Y-%m-%d") for i in s.index]
-    values = [i.item() for i in s.values]
-    return [{"datetime": datetime, "AdjClose": value} for datetime, value in zip(datetimes, values)]
+            weight_dict[benchmark_con.security] = weight_dict.get(benchmark_con.security, 0.0) + benchmark_con.weight
+        securities = list(weight_dict)
+        weights = np.array([weight_dict[security] for security in securities])
+        if weights.sum() == 0:
+            continue
+        weights = weights / weights.sum()
+
+        ds = price_cache.get_data(
+            start=window_start - ANCHOR_LOOKBACK if datetimes_list else window_start,
+            end=window_end,
+            frequency="1d",
+            securities=securities,
+            fields=["AdjClose"]
+        )
+        if "AdjClose" not in ds.data_vars:
+            continue
+        da = ds["AdjClose"].reindex(security=securities).transpose("datetime", "security")
+        datetimes = da.datetime.values
+        in_window = datetimes >= np.datetime64(window_start)
+        if not in_window.any():
+            continue
+        first = int(np.argmax(in_window))
+        anchor = max(first - 1, 0)
+
+        price = da.to_pandas().ffill().values
+        price = np.concatenate([price[anchor:anchor + 1], price[first:]])
+        growth = get_rebalanced_growth(price, weights, get_rebalance_keys(datetimes[first:], rebalance))
+
+        values = level * growth
+        level = values[-1]
+        datetimes_list.append(datetimes[first:])
+        values_list.append(values)
+
+    if not datetimes_list:
+        return xr.DataArray(np.empty(0), coords={"datetime": np.empty(0, dtype="datetime64[ns]")},
+                            dims="datetime", name="AdjClose")
+    return xr.DataArray(np.concatenate(values_list), coords={"datetime": np.concatenate(datetimes_list)},
+                        dims="datetime", name="AdjClose")
+
+benchmark_registry = BenchmarkRegistry()
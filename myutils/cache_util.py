@@ -0,0 +1,290 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pytz
+import xarray as xr
+from data_module.data_api import DataManager
+
+from myutils import eval_util
+
+HISTORY_START = "1980-01-01"
+
+CacheKey = Tuple[str, str, str]
+
+@dataclass
+class CacheEntry:
+    data: xr.DataArray
+    trading_day: date
+    nbytes: int
+    statistics: Optional[eval_util.CumulativeStatistics] = None
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    refreshes: int = 0
+    appended_rows: int = 0
+    entries: int = 0
+    nbytes: int = 0
+
+def _get_nbytes(data: xr.DataArray, statistics: Optional[eval_util.CumulativeStatistics]) -> int:
+    nbytes = data.nbytes + data.datetime.nbytes
+    if statistics is not None:
+        nbytes += sum(value.nbytes for value in vars(statistics).values())
+    return nbytes
+
+def _trim_nan(da: xr.DataArray) -> xr.DataArray:
+    # Keep the rows between the first and the last price only.
+    valid = ~np.isnan(da.values)
+    if not valid.any():
+        return da.isel(datetime=slice(0, 0))
+    return da.isel(datetime=slice(int(np.argmax(valid)), valid.size - int(np.argmax(valid[::-1]))))
+
+def get_trading_day(now: datetime, rollover_hour: int) -> date:
+    """
+    Get the trading day whose close is the latest one available at `now`.
+
+    Args:
+        now: The current time.
+        rollover_hour: Hour of day in Asia/Shanghai after which the close of
+            the day is expected to be in the data store.
+
+    Returns:
+        The trading day, as a calendar date.
+    """
+    if now.tzinfo is None:
+        now = pytz.timezone("Asia/Shanghai").localize(now)
+    now = now.astimezone(pytz.timezone("Asia/Shanghai"))
+    return (now - timedelta(hours=rollover_hour)).date()
+
+def get_next_rollover(now: datetime, rollover_hour: int) -> datetime:
+    """
+    Get the time at which the trading day of `now` rolls over.
+
+    Args:
+        now: The current time.
+        rollover_hour: Hour of day in Asia/Shanghai, as in get_trading_day.
+
+    Returns:
+        The rollover time, in Asia/Shanghai.
+    """
+    next_day = datetime.combine(get_trading_day(now, rollover_hour) + timedelta(days=1), datetime.min.time())
+    return pytz.timezone("Asia/Shanghai").localize(next_day) + timedelta(hours=rollover_hour)
+
+class PriceCache:
+    """
+    Process-wide cache of full price histories in front of DataManager.get_data.
+
+    Each (security, field, frequency) is loaded once from HISTORY_START and
+    every requested date range is served as a slice of it. When the trading
+    day rolls over, an entry is refreshed by loading only the rows after its
+    last date and appending them, together with its cumulative statistics.
+    The least recently used entries are evicted once the total size exceeds
+    `max_bytes`. Rows restated in the data store are only picked up after an
+    entry is evicted or the cache is cleared.
+    """
+
+    def __init__(self, data_manager: DataManager, max_bytes: int = 256 * 1024 * 1024,
+                 rollover_hour: int = 17):
+        self.data_manager = data_manager
+        self.max_bytes = max_bytes
+        self.rollover_hour = rollover_hour
+        self._entries: "OrderedDict[CacheKey, CacheEntry]" = OrderedDict()
+        self._stats = CacheStats()
+        self._lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        self.max_bytes = app.config.get("PRICE_CACHE_MAX_BYTES", self.max_bytes)
+        self.rollover_hour = app.config.get("PRICE_CACHE_ROLLOVER_HOUR", self.rollover_hour)
+
+    def get_data(self, start, end, frequency: str, securities: List[str], fields: List[str]) -> xr.Dataset:
+        """
+        Get prices like DataManager.get_data, loading only what is not cached.
+
+        Args:
+            start: The start date.
+            end: The end date.
+            frequency: The frequency, e.g. "1d".
+            securities: The security codes.
+            fields: The fields, e.g. ["AdjClose"].
+
+        Returns:
+            Dataset with one variable per field available, each with
+            dimensions of (datetime, security).
+        """
+        keys = [(security, field, frequency) for field in fields for security in securities]
+        found = self._get_fresh_entries(keys, frequency)
+
+        data_vars: Dict[str, xr.DataArray] = {}
+        for field in fields:
+            arrays = [
+                found[(security, field, frequency)].data.sel(datetime=slice(start, end))
+                for security in securities
+                if (security, field, frequency) in found
+            ]
+            if arrays:
+                data_vars[field] = xr.concat(arrays, dim="security", join="outer") \
+                                     .transpose("datetime", "security")
+        return xr.Dataset(data_vars)
+
+    def get_statistics(self, security: str, field: str = "AdjClose",
+                       frequency: str = "1d") -> Optional[eval_util.CumulativeStatistics]:
+        """
+        Get the cumulative statistics of the full history of one security.
+
+        The statistics are computed once per entry and then kept up to date by
+        appending the rows of each refresh.
+
+        Args:
+            security: The security code.
+            field: The field.
+            frequency: The frequency.
+
+        Returns:
+            A CumulativeStatistics object, or None if there is no data.
+        """
+        key = (security, field, frequency)
+        entry = self._get_fresh_entries([key], frequency).get(key)
+        if entry is None:
+            return None
+        if entry.statistics is None:
+            statistics = eval_util.get_cumulative_statistics(entry.data.expand_dims("security", axis=1))
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    entry.statistics = statistics
+                    self._resize(entry, _get_nbytes(entry.data, statistics))
+            return statistics
+        return entry.statistics
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(**vars(self._stats))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._stats.entries = 0
+            self._stats.nbytes = 0
+
+    def _get_fresh_entries(self, keys: List[CacheKey], frequency: str) -> Dict[CacheKey, CacheEntry]:
+        trading_day = get_trading_day(datetime.now(), self.rollover_hour)
+        found, stale = self._get_entries(keys, trading_day)
+        if stale:
+            found.update(self._refresh(stale, frequency, trading_day))
+        missing = [key for key in keys if key not in found]
+        if missing:
+            found.update(self._load(missing, frequency, trading_day))
+        return found
+
+    def _get_entries(self, keys: List[CacheKey],
+                     trading_day: date) -> Tuple[Dict[CacheKey, CacheEntry], Dict[CacheKey, CacheEntry]]:
+        found: Dict[CacheKey, CacheEntry] = {}
+        stale: Dict[CacheKey, CacheEntry] = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    self._stats.misses += 1
+                    continue
+                self._entries.move_to_end(key)
+                if entry.trading_day != trading_day:
+                    self._stats.expirations += 1
+                    stale[key] = entry
+                    continue
+                self._stats.hits += 1
+                found[key] = entry
+        return found, stale
+
+    def _refresh(self, stale: Dict[CacheKey, CacheEntry], frequency: str,
+                 trading_day: date) -> Dict[CacheKey, CacheEntry]:
+        securities = list(dict.fromkeys(key[0] for key in stale))
+        fields = list(dict.fromkeys(key[1] for key in stale))
+        last_date = min(entry.data.datetime.values[-1] for entry in stale.values())
+        ds = self.data_manager.get_data(
+            start=pd.Timestamp(last_date) + timedelta(days=1),
+            end=datetime.now(),
+            frequency=frequency,
+            securities=securities,
+            fields=fields
+        )
+
+        refreshed: Dict[CacheKey, CacheEntry] = {}
+        for key, entry in stale.items():
+            security, field, _ = key
+            data, statistics = entry.data, entry.statistics
+            if field in ds.data_vars and security in ds[field].security.values:
+                tail = ds[field].sel(security=security)
+                tail = _trim_nan(tail.sel(datetime=tail.datetime > data.datetime.values[-1]))
+                if tail.datetime.size > 0:
+                    data = xr.concat([data, tail], dim="datetime")
+                    if statistics is not None:
+                        statistics = eval_util.append_cumulative_statistics(
+                            statistics, tail.expand_dims("security", axis=1))
+                    with self._lock:
+                        self._stats.appended_rows += tail.datetime.size
+            refreshed[key] = CacheEntry(data=data, trading_day=trading_day,
+                                        nbytes=_get_nbytes(data, statistics), statistics=statistics)
+
+        with self._lock:
+            self._stats.refreshes += len(refreshed)
+            for key, entry in refreshed.items():
+                self._put(key, entry)
+        return refreshed
+
+    def _load(self, keys: List[CacheKey], frequency: str, trading_day: date) -> Dict[CacheKey, CacheEntry]:
+        securities = list(dict.fromkeys(key[0] for key in keys))
+        fields = list(dict.fromkeys(key[1] for key in keys))
+        ds = self.data_manager.get_data(
+            start=HISTORY_START,
+            end=datetime.now(),
+            frequency=frequency,
+            securities=securities,
+            fields=fields
+        )
+
+        loaded: Dict[CacheKey, CacheEntry] = {}
+        for key in keys:
+            security, field, _ = key
+            if field not in ds.data_vars or security not in ds[field].security.values:
+                continue
+            da = _trim_nan(ds[field].sel(security=security))
+            if da.datetime.size == 0:
+                continue
+            loaded[key] = CacheEntry(data=da.copy(), trading_day=trading_day, nbytes=_get_nbytes(da, None))
+
+        with self._lock:
+            for key, entry in loaded.items():
+                self._put(key, entry)
+        return loaded
+
+    def _put(self, key: CacheKey, entry: CacheEntry) -> None:
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self._stats.entries += 1
+        self._stats.nbytes += entry.nbytes
+        self._evict()
+
+    def _resize(self, entry: CacheEntry, nbytes: int) -> None:
+        self._stats.nbytes += nbytes - entry.nbytes
+        entry.nbytes = nbytes
+        self._evict()
+
+    def _evict(self) -> None:
+        while self._stats.nbytes > self.max_bytes and len(self._entries) > 1:
+            self._remove(next(iter(self._entries)))
+            self._stats.evictions += 1
+
+    def _remove(self, key: CacheKey) -> None:
+        entry = self._entries.pop(key)
+        self._stats.entries -= 1
+        self._stats.nbytes -= entry.nbytes
+
+price_cache = PriceCache(DataManager())
@@ -0,0 +1,86 @@
+import json
+import struct
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+COLUMNAR_MIMETYPE = "application/vnd.private-pension.columnar"
+MAGIC = b"PPCL"
+ALIGNMENT = 8
+
+def get_epoch_days(datetimes: np.ndarray) -> np.ndarray:
+    """
+    Convert datetimes to days since 1970-01-01.
+
+    Args:
+        datetimes: Array of datetime64.
+
+    Returns:
+        Array of little-endian int32.
+    """
+    return datetimes.astype("datetime64[D]").astype("<i4")
+
+def _get_padding(size: int) -> int:
+    return -size % ALIGNMENT
+
+def encode_columns(columns: Dict[str, np.ndarray], metadata: Optional[Dict[str, Any]] = None) -> bytes:
+    """
+    Encode equally long 1-D arrays as raw little-endian column buffers.
+
+    The payload is the 4-byte magic, the header length as a little-endian
+    uint32, the JSON header padded with spaces, and then every column buffer
+    padded with zero bytes. Both the header and the buffers are padded to 8
+    bytes, so a client can view each buffer as a typed array without copying.
+    The header lists the rows and, per column, its name, dtype and byte
+    offset from the end of the header, and any metadata.
+
+    Args:
+        columns: Arrays keyed by column name.
+        metadata: JSON-serializable values describing the columns, e.g. the
+            labels of a flattened matrix, or None.
+
+    Returns:
+        The encoded payload.
+    """
+    rows = None
+    buffers = []
+    descriptions = []
+    offset = 0
+    for name, values in columns.items():
+        values = np.ascontiguousarray(values, dtype=values.dtype.newbyteorder("<"))
+        if values.ndim != 1 or (rows is not None and values.size != rows):
+            raise ValueError("columns must be 1-D arrays of the same length")
+        rows = values.size
+        descriptions.append({"name": name, "dtype": values.dtype.str, "offset": offset})
+        buffers.append(values.tobytes())
+        buffers.append(b"\0" * _get_padding(values.nbytes))
+        offset += values.nbytes + _get_padding(values.nbytes)
+
+    header = {"rows": rows or 0, "columns": descriptions}
+    if metadata is not None:
+        header["metadata"] = metadata
+    header = json.dumps(header).encode("utf-8")
+    header += b" " * _get_padding(len(MAGIC) + 4 + len(header))
+    return b"".join([MAGIC, struct.pack("<I", len(header)), header] + buffers)
+
+def decode_columns(payload: bytes) -> Dict[str, np.ndarray]:
+    """
+    Decode a payload made by encode_columns.
+
+    Args:
+        payload: The encoded payload.
+
+    Returns:
+        Arrays keyed by column name, viewing the payload without copying.
+    """
+    if payload[:len(MAGIC)] != MAGIC:
+        raise ValueError("not a columnar payload")
+    (header_length,) = struct.unpack_from("<I", payload, len(MAGIC))
+    start = len(MAGIC) + 4
+    header = json.loads(payload[start:start + header_length])
+    start += header_length
+    return {
+        column["name"]: np.frombuffer(payload, dtype=column["dtype"], count=header["rows"],
+                                      offset=start + column["offset"])
+        for column in header["columns"]
+    }
@@ -0,0 +1,144 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+# Annual contribution cap of a private pension account, in yuan.
+ANNUAL_CAP = 12000
+
+CONTRIBUTION_METRICS = ["months", "invested", "final_value", "irr", "max_drawdown", "max_loss"]
+
+def get_monthly_prices(da: xr.DataArray) -> xr.DataArray:
+    """
+    Get the price at which each month's contribution is invested.
+
+    Args:
+        da: DataArray with dimensions of (datetime, security).
+
+    Returns:
+        DataArray with dimensions of (month, security) of the first price of
+        each security in each calendar month, NaN where it has none. The month
+        coordinate holds the first day of each month.
+    """
+    da = da.transpose("datetime", "security")
+    frame = pd.DataFrame(da.values, index=pd.DatetimeIndex(da.datetime.values), columns=da.security.values)
+    monthly = frame.groupby(frame.index.to_period("M")).first()
+    return xr.DataArray(monthly.values.astype(np.float64),
+                        coords={"month": monthly.index.to_timestamp().values, "security": da.security.values},
+                        dims=("month", "security"))
+
+def _get_growth(rate: np.ndarray, months: np.ndarray, tail_years: float) -> np.ndarray:
+    # The value at the end of `months` unit contributions, one a month, the
+    # last `tail_years` before the end, growing at the continuous `rate`.
+    with np.errstate(over="ignore", invalid="ignore", divide="ignore"):
+        annuity = np.where(np.abs(rate) < 1e-12, months, np.expm1(rate * months / 12) / np.expm1(rate / 12))
+    return np.exp(rate * tail_years) * annuity
+
+def get_irr(amount: float, months: np.ndarray, final_value: np.ndarray, tail_years: float,
+            iterations: int = 40) -> np.ndarray:
+    """
+    Solve the money-weighted return of equal monthly contributions, for many accounts at once.
+
+    The contributions are dated a twelfth of a year apart, so the value they
+    grow to is a geometric sum, and every account is solved together by
+    bisection on the annual log return.
+
+    Args:
+        amount: The monthly contribution.
+        months: Array of the number of contributions of every account.
+        final_value: Array of the final value of every account.
+        tail_years: The years from the last contribution to the end.
+        iterations: The number of bisection steps.
+
+    Returns:
+        Array of annual internal rates of return, NaN where there is no value.
+    """
+    low = np.full(final_value.shape, -10.0)
+    high = np.full(final_value.shape, 10.0)
+    target = final_value / amount
+    for _ in range(iterations):
+        middle = (low + high) / 2
+        above = _get_growth(middle, months, tail_years) > target
+        high = np.where(above, middle, high)
+        low = np.where(above, low, middle)
+    with np.errstate(invalid="ignore"):
+        return np.where((months > 0) & (final_value > 0), np.expm1((low + high) / 2), np.nan)
+
+def get_contribution_table(da: xr.DataArray, amount: float = 1000, annual_cap: float = ANNUAL_CAP) -> xr.Dataset:
+    """
+    Backtest contributing a fixed amount every month, from every start month, for many securities.
+
+    Every month's contribution buys units at the first price of the month,
+    and every account is valued at the last price. Units bought from a
+    start month onwards are suffix sums of 1 / price, so the final values of
+    all start months take one pass, and the IRRs of all of them are solved
+    together. Only the drawdowns need the balance at every month, which is
+    one pass per start month over all securities at once. A security has no
+    result for a start month before its first price.
+
+    Args:
+        da: DataArray with dimensions of (datetime, security).
+        amount: The monthly contribution.
+        annual_cap: The annual contribution cap, which the monthly
+            contributions of a year must not exceed.
+
+    Returns:
+        Dataset with dimensions of (start, security), containing months,
+        invested, final_value, irr (money-weighted, annual), max_drawdown
+        (of the account balance, contributions included) and max_loss (of
+        the balance below the amount invested so far). Missing results are
+        NaN, or zero months.
+
+    Raises:
+        ValueError: If the monthly contributions exceed the annual cap.
+    """
+    if amount <= 0 or amount * 12 > annual_cap:
+        raise ValueError(f"amount must be positive and at most {annual_cap / 12:g} a month")
+
+    monthly = get_monthly_prices(da)
+    price = monthly.values
+    values = da.transpose("datetime", "security").values
+    last_price = values[values.shape[0] - 1 - np.argmax(~np.isnan(values[::-1]), axis=0), np.arange(values.shape[1])]
+    count = price.shape[0]
+
+    # A start month is valid from the first price on, if no later month lacks one.
+    with np.errstate(divide="ignore"):
+        units = 1 / price
+    missing = np.isnan(units)
+    later_missing = np.flip(np.logical_or.accumulate(np.flip(missing, axis=0), axis=0), axis=0)
+    units = np.where(missing, 0.0, units)
+    suffix_units = np.flip(np.cumsum(np.flip(units, axis=0), axis=0), axis=0)
+
+    months = np.where(later_missing, 0, (count - np.arange(count))[:, np.newaxis])
+    valid = months > 0
+    invested = amount * months
+    final_value = np.where(valid, amount * suffix_units * last_price, np.nan)
+
+    month_end = pd.Timestamp(monthly.month.values[-1])
+    tail_years = (pd.Timestamp(da.datetime.values[-1]) - month_end).days / 365.25
+    irr = get_irr(amount, months, final_value, tail_years)
+
+    max_drawdown = np.full(price.shape, np.nan)
+    max_loss = np.full(price.shape, np.nan)
+    cumulative_units = np.cumsum(units, axis=0)
+    units_before = cumulative_units - units
+    invested_path = amount * np.arange(1, count + 1)[:, np.newaxis]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for start in range(count):
+            # The balance at every month since the start, for all securities at once.
+            balance = amount * (cumulative_units[start:] - units_before[start]) * price[start:]
+            max_drawdown[start] = np.fmax.reduce(1 - balance / np.fmax.accumulate(balance, axis=0), axis=0)
+            max_loss[start] = np.fmax.reduce(1 - balance / invested_path[:count - start], axis=0)
+    max_loss = np.maximum(max_loss, 0.0)
+
+    return xr.Dataset(
+        {
+            "months": (("start", "security"), months),
+            "invested": (("start", "security"), np.where(valid, invested, np.nan)),
+            "final_value": (("start", "security"), final_value),
+            "irr": (("start", "security"), irr),
+            "max_drawdown": (("start", "security"), np.where(valid, max_drawdown, np.nan)),
+            "max_loss": (("start", "security"), np.where(valid, max_loss, np.nan))
+        },
+        coords={"start": monthly.month.values, "security": monthly.security.values,
+                "end_date": pd.Timestamp(da.datetime.values[-1])}
+    )
@@ -0,0 +1,229 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Hashable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from myutils import eval_util
+
+CovarianceKey = Tuple[Hashable, Optional[str], Optional[str], Optional[float], str]
+
+@dataclass
+class CovarianceResult:
+    securities: np.ndarray
+    # Annualized covariance of daily log returns, and their correlation.
+    covariance: np.ndarray
+    correlation: np.ndarray
+    # The number of days on which both securities have a return.
+    observations: np.ndarray
+    start_date: pd.Timestamp
+    end_date: pd.Timestamp
+    periods_per_year: float
+
+    @property
+    def nbytes(self) -> int:
+        return self.covariance.nbytes + self.correlation.nbytes + self.observations.nbytes
+
+@dataclass
+class CovarianceCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    entries: int = 0
+    nbytes: int = 0
+
+def get_log_returns(da: xr.DataArray) -> np.ndarray:
+    """
+    Calculate daily log returns on the calendar of the array.
+
+    Args:
+        da: DataArray with dimensions of (datetime, security).
+
+    Returns:
+        Array with dimensions of (datetime - 1, security), NaN where either
+        price is missing.
+    """
+    price = da.transpose("datetime", "security").values.astype(np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.log(price[1:] / price[:-1])
+
+def get_ewma_weights(rows: int, halflife: float) -> np.ndarray:
+    """
+    Get exponentially decaying weights which halve every `halflife` rows back from the last.
+
+    Args:
+        rows: The number of rows.
+        halflife: The half-life in rows.
+
+    Returns:
+        Array with dimensions of (rows).
+    """
+    return 0.5 ** ((rows - 1 - np.arange(rows)) / halflife)
+
+def get_pairwise_covariance(r: np.ndarray, weights: Optional[np.ndarray] = None, min_observations: int = 20,
+                            block_size: int = 256) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Calculate the covariance and correlation of every pair of columns over the rows both have.
+
+    Missing values are zeros under a validity mask, so every pairwise sum is
+    a matrix product of weighted values and masks, e.g. the weight of a pair
+    is (mask * w)' mask and its cross sum is (x * w)' x. The products are
+    taken for square blocks of columns on and above the diagonal only, and
+    mirrored, which bounds the temporaries to `block_size` columns.
+    Weighted variances use the reliability-weight correction, which is
+    n - 1 for equal weights.
+
+    Args:
+        r: Array with dimensions of (datetime, security), NaN where missing.
+        weights: Array with dimensions of (datetime), or None for equal weights.
+        min_observations: The minimum number of common rows of a pair.
+        block_size: The number of columns per block.
+
+    Returns:
+        The covariance, correlation and common row count matrices, with NaN
+        for pairs with fewer than `min_observations` common rows.
+    """
+    mask = (~np.isnan(r)).astype(np.float64)
+    x = np.where(mask > 0, r, 0.0)
+    x2 = x * x
+    w = np.ones(r.shape[0]) if weights is None else weights
+    w = w[:, np.newaxis]
+    n = r.shape[1]
+
+    covariance = np.full((n, n), np.nan)
+    correlation = np.full((n, n), np.nan)
+    observations = np.zeros((n, n), dtype=np.int64)
+    blocks = [slice(first, min(first + block_size, n)) for first in range(0, n, block_size)]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for i, rows in enumerate(blocks):
+            mask_w, x_w, x2_w = mask[:, rows] * w, x[:, rows] * w, x2[:, rows] * w
+            for columns in blocks[i:]:
+                count = mask[:, rows].T @ mask[:, columns]
+                if weights is None:
+                    weight = weight2 = count
+                else:
+                    weight = mask_w.T @ mask[:, columns]
+                    weight2 = (mask_w * w).T @ mask[:, columns]
+                sum_x = x_w.T @ mask[:, columns]
+                sum_y = mask_w.T @ x[:, columns]
+                sum_xy = x_w.T @ x[:, columns]
+                sum_xx = x2_w.T @ mask[:, columns]
+                sum_yy = mask_w.T @ x2[:, columns]
+
+                cross = sum_xy - sum_x * sum_y / weight
+                block_covariance = cross / (weight - weight2 / weight)
+                block_correlation = cross / np.sqrt((sum_xx - sum_x ** 2 / weight) * (sum_yy - sum_y ** 2 / weight))
+                enough = count >= max(min_observations, 2)
+                block_covariance = np.where(enough, block_covariance, np.nan)
+                block_correlation = np.where(enough, np.clip(block_correlation, -1.0, 1.0), np.nan)
+
+                covariance[rows, columns] = block_covariance
+                covariance[columns, rows] = block_covariance.T
+                correlation[rows, columns] = block_correlation
+                correlation[columns, rows] = block_correlation.T
+                observations[rows, columns] = count
+                observations[columns, rows] = count.T
+    return covariance, correlation, observations
+
+def get_covariance(da: xr.DataArray, start_date=None, end_date=None, halflife: Optional[float] = None,
+                   min_observations: int = 20) -> CovarianceResult:
+    """
+    Calculate the covariance and correlation matrices of daily log returns.
+
+    Args:
+        da: DataArray with dimensions of (datetime, security).
+        start_date: The first date of the period, or None for the first date.
+        end_date: The last date of the period, or None for the last date.
+        halflife: The half-life in trading days of exponential weights, or
+            None for equal weights.
+        min_observations: The minimum number of common returns of a pair.
+
+    Returns:
+        A CovarianceResult object, with the covariance annualized by the
+        number of returns per year of the period.
+
+    Raises:
+        ValueError: If the period has fewer than three dates.
+    """
+    da = da.sel(datetime=slice(start_date, end_date))
+    if da.datetime.size < 3:
+        raise ValueError("The period must have at least three dates")
+
+    r = get_log_returns(da)
+    weights = None if halflife is None else get_ewma_weights(r.shape[0], halflife)
+    covariance, correlation, observations = get_pairwise_covariance(r, weights, min_observations)
+    start, end = pd.Timestamp(da.datetime.values[0]), pd.Timestamp(da.datetime.values[-1])
+    periods_per_year = r.shape[0] / eval_util.get_years_between_dates(start, end)
+    return CovarianceResult(
+        securities=da.security.values,
+        covariance=covariance * periods_per_year,
+        correlation=correlation,
+        observations=observations,
+        start_date=start,
+        end_date=end,
+        periods_per_year=periods_per_year
+    )
+
+class CovarianceCache:
+    """
+    Covariance results keyed by (universe, start date, end date, half-life, data version).
+
+    The least recently used results are evicted once their total size
+    exceeds `max_bytes`, so the matrices of a large universe are computed
+    once per data version and then served from memory.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[CovarianceKey, CovarianceResult]" = OrderedDict()
+        self._stats = CovarianceCacheStats()
+        self._lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        self.max_bytes = app.config.get("COVARIANCE_CACHE_MAX_BYTES", self.max_bytes)
+
+    def get(self, key: CovarianceKey, compute: Callable[[], CovarianceResult]) -> CovarianceResult:
+        """
+        Get a cached result, or compute and cache it.
+
+        Args:
+            key: The cache key.
+            compute: Function computing the result on a miss.
+
+        Returns:
+            The CovarianceResult.
+        """
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._stats.hits += 1
+                self._entries.move_to_end(key)
+                return result
+            self._stats.misses += 1
+
+        result = compute()
+        with self._lock:
+            if key in self._entries:
+                self._stats.nbytes -= self._entries.pop(key).nbytes
+            self._entries[key] = result
+            self._stats.nbytes += result.nbytes
+            while self._stats.nbytes > self.max_bytes and len(self._entries) > 1:
+                self._stats.nbytes -= self._entries.popitem(last=False)[1].nbytes
+                self._stats.evictions += 1
+            self._stats.entries = len(self._entries)
+        return result
+
+    def stats(self) -> CovarianceCacheStats:
+        with self._lock:
+            return CovarianceCacheStats(**vars(self._stats))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._stats.entries = 0
+            self._stats.nbytes = 0
+
+covariance_cache = CovarianceCache()
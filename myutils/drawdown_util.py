@@ -0,0 +1,119 @@
+from dataclasses import dataclass
+from datetime import date
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+@dataclass
+class DrawdownResult:
+    max_drawdown: float
+    peak_date: Optional[date]
+    trough_date: Optional[date]
+    recovery_date: Optional[date]
+    duration_days: Optional[int]
+
+def get_running_max(da: xr.DataArray) -> xr.DataArray:
+    """
+    Calculate the running max along datetime with a cumulative-max scan.
+
+    NaNs are skipped, so the running max only stays NaN until the first price.
+
+    Args:
+        da: DataArray with a datetime dimension.
+
+    Returns:
+        DataArray of the same shape containing the running max.
+    """
+    return da.copy(data=np.fmax.accumulate(da.values, axis=da.get_axis_num("datetime")))
+
+def get_drawdown(da: xr.DataArray) -> xr.DataArray:
+    """
+    Calculate the drawdown from the running max for each security.
+
+    Args:
+        da: DataArray with a datetime dimension.
+
+    Returns:
+        DataArray of the same shape containing drawdowns (zero or negative).
+    """
+    return da / get_running_max(da) - 1
+
+def get_drawdown_details(da: xr.DataArray) -> xr.Dataset:
+    """
+    Calculate the maximum drawdown and when it happened for each security.
+
+    The peak is the last date at the running max before the trough, and the
+    recovery is the first date after the trough back at that max. The
+    duration runs from the peak to the recovery, or to the last date if the
+    security has not recovered yet.
+
+    Args:
+        da: DataArray with dimensions of (datetime, security).
+
+    Returns:
+        Dataset with dimensions of (security) containing max_drawdown,
+        peak_date, trough_date, recovery_date and duration_days. Dates are
+        NaT and duration_days is NaN where there is no drawdown.
+    """
+    da = da.transpose("datetime", "security")
+    price = da.values.astype(np.float64)
+    datetimes = da.datetime.values
+    row = np.arange(price.shape[0])[:, np.newaxis]
+    column = np.arange(price.shape[1])
+
+    peak = np.fmax.accumulate(price, axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        drawdown = 1 - price / peak
+    drawdown_is_nan = np.isnan(drawdown)
+    trough_row = np.argmax(np.where(drawdown_is_nan, -np.inf, drawdown), axis=0)
+    max_drawdown = np.where(drawdown_is_nan.all(axis=0), np.nan, drawdown[trough_row, column])
+    has_drawdown = max_drawdown > 0
+
+    peak_row = np.maximum.accumulate(np.where(price == peak, row, 0), axis=0)[trough_row, column]
+    recovered = (row > trough_row) & (price >= peak[trough_row, column])
+    recovery_row = np.argmax(recovered, axis=0)
+    has_recovery = has_drawdown & recovered.any(axis=0)
+
+    not_a_time = np.datetime64("NaT", "ns")
+    peak_date = np.where(has_drawdown, datetimes[peak_row], not_a_time)
+    trough_date = np.where(has_drawdown, datetimes[trough_row], not_a_time)
+    recovery_date = np.where(has_recovery, datetimes[recovery_row], not_a_time)
+    duration_end = np.where(has_recovery, recovery_date, datetimes[-1])
+    duration_days = np.where(has_drawdown, (duration_end - peak_date) / np.timedelta64(1, "D"), np.nan)
+
+    return xr.Dataset(
+        {
+            "max_drawdown": ("security", max_drawdown),
+            "peak_date": ("security", peak_date),
+            "trough_date": ("security", trough_date),
+            "recovery_date": ("security", recovery_date),
+            "duration_days": ("security", duration_days)
+        },
+        coords={"security": da.security.values}
+    )
+
+def _to_date(value) -> Optional[date]:
+    value = pd.Timestamp(value)
+    return None if pd.isna(value) else value.date()
+
+def get_drawdown_result(da: xr.DataArray) -> DrawdownResult:
+    """
+    Calculate the maximum drawdown details of a single security.
+
+    Args:
+        da: DataArray with dimensions of (datetime, security) and one security.
+
+    Returns:
+        A DrawdownResult object.
+    """
+    ds = get_drawdown_details(da)
+    duration_days = ds["duration_days"].item()
+    return DrawdownResult(
+        max_drawdown=ds["max_drawdown"].item(),
+        peak_date=_to_date(ds["peak_date"].values[0]),
+        trough_date=_to_date(ds["trough_date"].values[0]),
+        recovery_date=_to_date(ds["recovery_date"].values[0]),
+        duration_days=None if np.isnan(duration_days) else int(duration_days)
+    )
@@ -1,11 +1,13 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 from datetime import date
-from typing import List
+from typing import Dict, List, Optional
 
 import numpy as np
 import pandas as pd
 import xarray as xr
 
+from myutils import drawdown_util
+
 @dataclass
 class EvaluationPeriod:
     label: str
@@ -25,6 +27,29 @@ class EvaluationResult:
     sharpe_ratio: float
     max_drawdown: float
 
+EVALUATION_FIELDS = [field.name for field in fields(EvaluationResult) if field.name != "period"]
+
+@dataclass
+class CumulativeStatistics:
+    """
+    Cumulative statistics of a (datetime, security) price array.
+
+    Prefix arrays have one more row than the series, so the sum over rows
+    [i, j] is `prefix[j + 1] - prefix[i]`. Suffix arrays at row i describe the
+    rows [i, n), so they only serve periods which end at the last row, or at
+    the last price of a security.
+    """
+    datetime: np.ndarray
+    security: np.ndarray
+    price: np.ndarray
+    price_count: np.ndarray
+    return_count: np.ndarray
+    return_sum: np.ndarray
+    return_square_sum: np.ndarray
+    suffix_high: np.ndarray
+    suffix_low: np.ndarray
+    suffix_max_drawdown: np.ndarray
+
 def move_month(date, months: int) -> pd.Timestamp:
     """
     Move the given date by a number of months.
@@ -34,13 +59,14 @@ def move_month(date, months: int) -> pd.Timestamp:
         months: The number of months to move.
 
     Returns:
-        A new date moved by the specified number of months.
+        A new date moved by the specified number of months, on the last day
+        of the new month if it is shorter than the day of the original date.
     """
     date = pd.Timestamp(date)
     new_total_months = date.year * 12 + date.month - 1 + months
     new_year = new_total_months // 12
     new_month = new_total_months % 12 + 1
-    new_day = date.day
+    new_day = min(date.day, pd.Timestamp(year=new_year, month=new_month, day=1).days_in_month)
     return pd.Timestamp(year=new_year, month=new_month, day=new_day)
 
 def get_evaluation_periods(start_date, end_date) -> List[EvaluationPeriod]:
@@ -129,6 +155,30 @@ def get_years_between_dates(start_date, end_date) -> float:
     years += end_year - start_year - 1
     return years
 
+def get_years_between_datetimes(start_dates: np.ndarray, end_date) -> np.ndarray:
+    """
+    Calculate the number of years from each of many start dates to an end date.
+
+    This is the vectorized form of get_years_between_dates.
+
+    Args:
+        start_dates: Array of start dates.
+        end_date: The end date, or an array of end dates of the same length
+            as start_dates.
+
+    Returns:
+        Array of the number of years between each start date and its end date.
+    """
+    start_dates = pd.DatetimeIndex(np.atleast_1d(start_dates))
+    end_dates = pd.DatetimeIndex(np.atleast_1d(end_date))
+    days_in_start_year = np.where(start_dates.is_leap_year, 366, 365)
+    days_in_end_year = np.where(end_dates.is_leap_year, 366, 365)
+
+    years = 1 - start_dates.dayofyear.values / days_in_start_year
+    years += end_dates.dayofyear.values / days_in_end_year
+    years += end_dates.year.values - start_dates.year.values - 1
+    return years
+
 def get_annualized_return(da: xr.DataArray) -> xr.DataArray:
     """
     Calculate the annualized return for each security.
@@ -186,8 +236,7 @@ def get_max_drawdown(da: xr.DataArray) -> xr.DataArray:
     Returns:
         DataArray with dimensions of (security) containing maximum drawdowns.
     """
-    max_price = da.rolling(datetime=da.datetime.size, min_periods=1).max()
-    drawdown = da / max_price - 1
+    drawdown = drawdown_util.get_drawdown(da)
     return -drawdown.min(dim="datetime")
 
 def get_evaluation_result(da: xr.DataArray, period: EvaluationPeriod) -> EvaluationResult:
@@ -216,22 +265,400 @@ def get_evaluation_result(da: xr.DataArray, period: EvaluationPeriod) -> Evaluat
         max_drawdown=get_max_drawdown(da).item()
     )
 
+def get_prefix_sum(values: np.ndarray) -> np.ndarray:
+    """
+    Calculate prefix sums along the first axis, with a leading row of zeros.
+
+    Args:
+        values: Array with dimensions of (datetime, ...).
+
+    Returns:
+        Array with dimensions of (1 + datetime, ...), so the sum over rows
+        [i, j] is `prefix[j + 1] - prefix[i]`.
+    """
+    prefix = np.zeros((values.shape[0] + 1,) + values.shape[1:], dtype=np.float64)
+    np.cumsum(values, axis=0, out=prefix[1:])
+    return prefix
+
+def _get_suffix_accumulate(ufunc: np.ufunc, values: np.ndarray) -> np.ndarray:
+    return ufunc.accumulate(values[::-1], axis=0)[::-1]
+
+def get_cumulative_statistics(da: xr.DataArray) -> CumulativeStatistics:
+    """
+    Calculate the log returns and the cumulative statistics of prices once.
+
+    Args:
+        da: DataArray with dimensions of (datetime, security).
+
+    Returns:
+        A CumulativeStatistics object.
+    """
+    da = da.transpose("datetime", "security")
+    price = da.values.astype(np.float64)
+
+    r = np.full_like(price, np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r[1:] = np.log(price[1:] / price[:-1])
+    r_valid = ~np.isnan(r)
+    r = np.where(r_valid, r, 0.0)
+
+    # The deepest fall after buying at row i is 1 - min(price[i:]) / price[i],
+    # so the max drawdown of the rows [i, n) is the suffix max of it.
+    suffix_low = _get_suffix_accumulate(np.fmin, price)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        drawdown = 1 - suffix_low / price
+
+    return CumulativeStatistics(
+        datetime=da.datetime.values,
+        security=da.security.values,
+        price=price,
+        price_count=get_prefix_sum(~np.isnan(price)),
+        return_count=get_prefix_sum(r_valid),
+        return_sum=get_prefix_sum(r),
+        return_square_sum=get_prefix_sum(r * r),
+        suffix_high=_get_suffix_accumulate(np.fmax, price),
+        suffix_low=suffix_low,
+        suffix_max_drawdown=_get_suffix_accumulate(np.fmax, drawdown)
+    )
+
+def _extend_prefix_sum(prefix: np.ndarray, values: np.ndarray) -> np.ndarray:
+    return np.concatenate([prefix, prefix[-1] + np.cumsum(values, axis=0)])
+
+def append_cumulative_statistics(stats: CumulativeStatistics, da: xr.DataArray) -> CumulativeStatistics:
+    """
+    Append new rows to cumulative statistics without recomputing the old rows.
+
+    Log returns and prefix sums are computed for the new rows only. The old
+    rows of a suffix array only change where the new rows reach a new high or
+    low, and the drawdown is scanned again from the first such row only.
+
+    Args:
+        stats: The cumulative statistics of the earlier rows.
+        da: DataArray with dimensions of (datetime, security) and the same
+            securities, containing only rows after the last row of stats.
+
+    Returns:
+        A new CumulativeStatistics object covering the old and the new rows.
+    """
+    da = da.transpose("datetime", "security").sel(security=stats.security)
+    if da.datetime.size == 0:
+        return stats
+    if da.datetime.values[0] <= stats.datetime[-1]:
+        raise ValueError("new rows must come after the last row of the statistics")
+
+    n = stats.datetime.size
+    new_price = da.values.astype(np.float64)
+    price = np.concatenate([stats.price, new_price])
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r = np.log(price[n:] / price[n - 1:-1])
+    r_valid = ~np.isnan(r)
+    r = np.where(r_valid, r, 0.0)
+
+    new_suffix_high = _get_suffix_accumulate(np.fmax, new_price)
+    new_suffix_low = _get_suffix_accumulate(np.fmin, new_price)
+    suffix_high = np.concatenate([np.fmax(stats.suffix_high, new_suffix_high[0]), new_suffix_high])
+    suffix_low = np.concatenate([np.fmin(stats.suffix_low, new_suffix_low[0]), new_suffix_low])
+
+    # Before the first row whose suffix low changed, the deepest fall after
+    # each row is unchanged, so its suffix max only needs the new maximum.
+    changed = (stats.suffix_low > new_suffix_low[0]).any(axis=1)
+    first = int(np.argmax(changed)) if changed.any() else n
+    with np.errstate(divide="ignore", invalid="ignore"):
+        drawdown = 1 - suffix_low[first:] / price[first:]
+    tail_max_drawdown = _get_suffix_accumulate(np.fmax, drawdown)
+    suffix_max_drawdown = np.concatenate([
+        np.fmax(stats.suffix_max_drawdown[:first], tail_max_drawdown[0]),
+        tail_max_drawdown
+    ])
+
+    return CumulativeStatistics(
+        datetime=np.concatenate([stats.datetime, da.datetime.values]),
+        security=stats.security,
+        price=price,
+        price_count=_extend_prefix_sum(stats.price_count, ~np.isnan(new_price)),
+        return_count=_extend_prefix_sum(stats.return_count, r_valid),
+        return_sum=_extend_prefix_sum(stats.return_sum, r),
+        return_square_sum=_extend_prefix_sum(stats.return_square_sum, r * r),
+        suffix_high=suffix_high,
+        suffix_low=suffix_low,
+        suffix_max_drawdown=suffix_max_drawdown
+    )
+
+def get_period_metrics(stats: CumulativeStatistics, period: EvaluationPeriod,
+                       risk_free_rate: float = 0.025) -> Optional[Dict[str, np.ndarray]]:
+    """
+    Calculate the metrics of a period ending at the last price, by index lookups.
+
+    Each security is evaluated up to its own last price, so the period must
+    not end before the last price of any security.
+
+    Args:
+        stats: The cumulative statistics.
+        period: The evaluation period.
+        risk_free_rate: The risk-free rate for the Sharpe ratio.
+
+    Returns:
+        A dict of arrays with dimensions of (security), keyed by the field
+        names of EvaluationResult, or None if the period spans less than two
+        dates.
+    """
+    last = get_last_rows(~np.isnan(stats.price))
+    start = int(np.searchsorted(stats.datetime, np.datetime64(pd.Timestamp(period.start_date)), side="left"))
+    end = int(np.searchsorted(stats.datetime, np.datetime64(pd.Timestamp(period.end_date)), side="right")) - 1
+    if end < last.max():
+        raise ValueError("period must not end before the last price of the statistics")
+    if start >= end:
+        return None
+
+    start = np.full(stats.security.size, start)
+    end = np.maximum(np.minimum(end, last), start)
+    years = get_years_between_datetimes(stats.datetime[start], stats.datetime[end])
+    if (years == 0).all():
+        return None
+
+    return _get_row_metrics(stats, start, end, years, risk_free_rate)
+
+def get_window_metrics(stats: CumulativeStatistics, start: np.ndarray, end: np.ndarray, years,
+                       risk_free_rate: float = 0.025) -> Dict[str, np.ndarray]:
+    """
+    Calculate the return metrics of arbitrary row windows, by index lookups.
+
+    Unlike get_period_metrics, the windows need not end at the last row, so
+    only the metrics derived from the prefix arrays are available.
+
+    Args:
+        stats: The cumulative statistics.
+        start: The first rows of the windows, broadcastable against the
+            security dimension, e.g. (security) or (window, 1).
+        end: The last rows of the windows, broadcastable like start.
+        years: The years from the start to the end of each window.
+        risk_free_rate: The risk-free rate for the Sharpe ratio.
+
+    Returns:
+        A dict of observations, annualized_return, annualized_volatility and
+        sharpe_ratio arrays, with the broadcast shape of start and end.
+    """
+    column = np.arange(stats.security.size)
+
+    n = stats.price_count[end + 1, column] - stats.price_count[start, column]
+    # The first log return of a period needs the price before it, so skip it.
+    m = stats.return_count[end + 1, column] - stats.return_count[start + 1, column]
+    r_sum = stats.return_sum[end + 1, column] - stats.return_sum[start + 1, column]
+    r2_sum = stats.return_square_sum[end + 1, column] - stats.return_square_sum[start + 1, column]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        annualized_return = (stats.price[end, column] / stats.price[start, column]) ** (1 / years) - 1
+        r_bar = r_sum / (n - 1)
+        squared_deviation = np.maximum(r2_sum - 2 * r_bar * r_sum + m * r_bar ** 2, 0.0)
+        sigma_daily = np.sqrt(squared_deviation / (n - 2))
+        annualized_volatility = sigma_daily * np.sqrt(n / years)
+        sharpe_ratio = (annualized_return - risk_free_rate) / annualized_volatility
+
+    return {
+        "observations": n.astype(np.int64),
+        "annualized_return": annualized_return,
+        "annualized_volatility": annualized_volatility,
+        "sharpe_ratio": sharpe_ratio
+    }
+
+def _get_row_metrics(stats: CumulativeStatistics, start: np.ndarray, end: np.ndarray, years,
+                     risk_free_rate: float) -> Dict[str, np.ndarray]:
+    # A security has no prices after its last row, so the suffix arrays at
+    # the start row already stop at the last row.
+    column = np.arange(stats.security.size)
+    metrics = get_window_metrics(stats, start, end, years, risk_free_rate)
+
+    return {
+        "observations": metrics["observations"],
+        "open": stats.price[start, column],
+        "high": stats.suffix_high[start, column],
+        "low": stats.suffix_low[start, column],
+        "close": stats.price[end, column],
+        "annualized_return": metrics["annualized_return"],
+        "annualized_volatility": metrics["annualized_volatility"],
+        "sharpe_ratio": metrics["sharpe_ratio"],
+        "max_drawdown": stats.suffix_max_drawdown[start, column]
+    }
+
 def get_evaluation_results(da: xr.DataArray) -> List[EvaluationResult]:
     """
     Calculate evaluation results for different periods.
 
+    Log returns and cumulative statistics are computed once, and every period
+    is then answered by index lookups into them.
+
     Args:
         da: DataArray with dimensions of (datetime, security).
 
     Returns:
         A list of EvaluationResult objects containing the results for different periods.
     """
-    periods = get_evaluation_periods(da.datetime[0].item(), da.datetime[-1].item())
+    return get_evaluation_results_from_statistics(get_cumulative_statistics(da))
+
+def get_evaluation_results_from_statistics(stats: CumulativeStatistics) -> List[EvaluationResult]:
+    """
+    Calculate evaluation results for different periods from cumulative statistics.
+
+    Args:
+        stats: The cumulative statistics of a single security.
+
+    Returns:
+        A list of EvaluationResult objects containing the results for different periods.
+    """
+    end = get_last_rows(~np.isnan(stats.price)).max()
+    periods = get_evaluation_periods(stats.datetime[0], stats.datetime[end])
     results = []
     for period in periods:
-        try:
-            result = get_evaluation_result(da, period)
-            results.append(result)
-        except Exception as e:
-            print(f"Error processing period {period.label}: {e}")
+        metrics = get_period_metrics(stats, period)
+        if metrics is None:
+            continue
+        results.append(EvaluationResult(period=period, **{key: value.item() for key, value in metrics.items()}))
     return results
+
+def get_last_rows(has_value: np.ndarray) -> np.ndarray:
+    """
+    Find the last row with a value in every column.
+
+    Args:
+        has_value: Boolean array with dimensions of (datetime, ...).
+
+    Returns:
+        Array of the last rows with a value, with the dimensions of has_value
+        without datetime. Zero for a column without any value.
+    """
+    if has_value.shape[0] == 0:
+        return np.zeros(has_value.shape[1:], dtype=np.int64)
+    last = has_value.shape[0] - 1 - np.argmax(has_value[::-1], axis=0)
+    return np.where(has_value.any(axis=0), last, 0)
+
+def get_last_dates(datetimes: np.ndarray, has_value: np.ndarray) -> np.ndarray:
+    """
+    Find the date of the last value in every column.
+
+    Args:
+        datetimes: Array with dimensions of (datetime).
+        has_value: Boolean array with dimensions of (datetime, security).
+
+    Returns:
+        Array with dimensions of (security), NaT for a column without any value.
+    """
+    has_any_value = has_value.any(axis=0)
+    last_dates = np.full(has_value.shape[1], np.datetime64("NaT", "ns"))
+    last_dates[has_any_value] = datetimes[get_last_rows(has_value)[has_any_value]]
+    return last_dates
+
+@dataclass
+class PeriodStart:
+    period: EvaluationPeriod
+    start: np.ndarray
+    end: np.ndarray
+    start_date: np.ndarray
+    years: np.ndarray
+    covered: np.ndarray
+
+def get_period_starts(datetimes: np.ndarray, has_value: np.ndarray) -> List[PeriodStart]:
+    """
+    Find the start and end rows of every evaluation period for many securities.
+
+    Every security is evaluated up to its own last value, and its periods
+    are counted back from the date of that value. ITD starts at the first
+    value of each security, and a security does not cover a period which
+    starts before its first value.
+
+    Args:
+        datetimes: Array with dimensions of (datetime).
+        has_value: Boolean array with dimensions of (datetime, security).
+
+    Returns:
+        A list of PeriodStart objects, one per period up to the latest last
+        value, whose arrays have dimensions of (security): the start rows,
+        the end rows, the start dates, the years from the start to the end,
+        and whether each security covers the period. Empty if no security
+        has a value.
+    """
+    has_any_value = has_value.any(axis=0)
+    if not has_any_value.any():
+        return []
+    first = np.argmax(has_value, axis=0)
+    last = get_last_rows(has_value)
+    first_dates = datetimes[first]
+    end_dates = datetimes[last]
+
+    # Securities usually share a handful of last dates, so the periods are
+    # counted back from each distinct one only once.
+    start_dates_by_end_date = {
+        end_date: {period.label: np.datetime64(pd.Timestamp(period.start_date), "ns")
+                   for period in get_evaluation_periods(datetimes[0], end_date)}
+        for end_date in np.unique(end_dates[has_any_value])
+    }
+    no_start_dates: Dict[str, np.datetime64] = {}
+
+    period_starts = []
+    for period in get_evaluation_periods(first_dates[has_any_value].min(), end_dates[has_any_value].max()):
+        if period.label == "ITD":
+            start = first
+            start_date = first_dates
+            covered = has_any_value.copy()
+        else:
+            start_date = np.array([
+                start_dates_by_end_date.get(end_date, no_start_dates).get(period.label, np.datetime64("NaT", "ns"))
+                for end_date in end_dates
+            ], dtype="datetime64[ns]")
+            start = np.minimum(np.searchsorted(datetimes, start_date, side="left"), last)
+            covered = has_any_value & ~np.isnat(start_date) & (first_dates <= start_date)
+        years = get_years_between_datetimes(datetimes[start], end_dates)
+        period_starts.append(PeriodStart(period=period, start=start, end=last,
+                                         start_date=np.where(covered, start_date, np.datetime64("NaT", "ns")),
+                                         years=years, covered=covered & (years > 0)))
+    return period_starts
+
+def get_evaluation_table(da: xr.DataArray, risk_free_rate: float = 0.025) -> xr.Dataset:
+    """
+    Calculate evaluation results of every period for many securities at once.
+
+    Every security is evaluated up to its own last price, and its periods
+    start from the date of that price. ITD starts at the first price of each
+    security, and a security has no result for a period which starts before
+    its first price.
+
+    Args:
+        da: DataArray with dimensions of (datetime, security).
+        risk_free_rate: The risk-free rate for the Sharpe ratio.
+
+    Returns:
+        Dataset with dimensions of (period, security), containing one variable
+        per field of EvaluationResult, the start_date of every (period,
+        security) and the end_date of every security. Missing results are NaN,
+        or zero observations, and there are no periods if no security has a
+        price.
+    """
+    stats = get_cumulative_statistics(da)
+    has_price = ~np.isnan(stats.price)
+    period_starts = get_period_starts(stats.datetime, has_price)
+    periods = [period_start.period for period_start in period_starts]
+    start_dates = (np.stack([period_start.start_date for period_start in period_starts]) if period_starts
+                   else np.empty((0, stats.security.size), dtype="datetime64[ns]"))
+    end_dates = get_last_dates(stats.datetime, has_price)
+
+    rows = []
+    for period_start in period_starts:
+        metrics = _get_row_metrics(stats, period_start.start, period_start.end, period_start.years, risk_free_rate)
+        rows.append({
+            key: np.where(period_start.covered, value, 0 if key == "observations" else np.nan)
+            for key, value in metrics.items()
+        })
+
+    return xr.Dataset(
+        {
+            key: (("period", "security"), np.stack([row[key] for row in rows]) if rows
+                                          else np.empty((0, stats.security.size)))
+            for key in EVALUATION_FIELDS
+        },
+        coords={
+            "period": np.array([period.label for period in periods], dtype=str),
+            "security": stats.security,
+            "start_date": (("period", "security"), start_dates),
+            "end_date": ("security", end_dates)
+        }
+    )
@@ -0,0 +1,283 @@
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import date
+from typing import Dict, Hashable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+HOLDING_METHODS = ["auto", "historical", "bootstrap"]
+
+HOLDING_PERCENTILES = [5, 25, 50, 75, 95]
+
+# Below this many entry dates, "auto" resamples the history instead of using it as is.
+MIN_HISTORICAL_SAMPLES = 250
+
+BLOCK_LENGTH = 20
+
+# Resampling needs at least MIN_HISTORICAL_SAMPLES daily returns, and at least this share of a holding path,
+# so a short history is not stretched over a holding period far longer than itself.
+MIN_BOOTSTRAP_HISTORY_FRACTION = 0.5
+
+HoldingKey = Tuple[Hashable, str, str, str]
+
+@dataclass
+class HoldingPeriodOutcomes:
+    holding_period: str
+    method: str
+    samples: int
+    loss_probability: float
+    mean_return: float
+    worst_return: float
+    best_return: float
+    percentiles: Dict[str, float]
+    # Entry dates are only known for historical outcomes.
+    first_start_date: Optional[date] = None
+    last_start_date: Optional[date] = None
+    worst_start_date: Optional[date] = None
+
+@dataclass
+class HoldingCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    entries: int = 0
+
+def parse_holding_period(value: str) -> int:
+    """
+    Parse a holding period like the holding_period of TargetDateFundV2.
+
+    Args:
+        value: The holding period, e.g. "3Y" or "18M".
+
+    Returns:
+        The holding period in months.
+
+    Raises:
+        ValueError: If the value is not a positive number of years or months.
+    """
+    match = re.fullmatch(r"(\d+)([YM])", value or "")
+    if match is None or int(match.group(1)) == 0:
+        raise ValueError(f"Invalid holding period: {value}")
+    return int(match.group(1)) * (12 if match.group(2) == "Y" else 1)
+
+def get_holding_returns(datetimes: np.ndarray, price: np.ndarray, months: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calculate the return of holding from every entry date for a number of months.
+
+    Every row is an entry date, and the exit is the first row on or after the
+    entry date moved by `months`, so all entry dates are evaluated at once.
+
+    Args:
+        datetimes: Array with dimensions of (datetime).
+        price: Array with dimensions of (datetime).
+        months: The holding period in months.
+
+    Returns:
+        The entry rows which have an exit within the data, and their total
+        returns.
+    """
+    exit_dates = (pd.DatetimeIndex(datetimes) + pd.DateOffset(months=months)).values
+    exits = np.searchsorted(datetimes, exit_dates, side="left")
+    starts = np.flatnonzero(exits < datetimes.size)
+    exits = exits[starts]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = price[exits] / price[starts] - 1
+    valid = np.isfinite(returns)
+    return starts[valid], returns[valid]
+
+def _simulate_chunk(args) -> np.ndarray:
+    # Moving block bootstrap: a path is whole blocks of consecutive log
+    # returns plus one partial block, each summed from the prefix sums.
+    prefix, block_length, path_length, simulations, seed = args
+    rng = np.random.default_rng(seed)
+    count = prefix.size - 1
+    blocks, remainder = divmod(path_length, block_length)
+
+    starts = rng.integers(0, count - block_length + 1, size=(simulations, blocks))
+    total = (prefix[starts + block_length] - prefix[starts]).sum(axis=1)
+    if remainder > 0:
+        starts = rng.integers(0, count - remainder + 1, size=simulations)
+        total += prefix[starts + remainder] - prefix[starts]
+    return np.expm1(total)
+
+def bootstrap_holding_returns(datetimes: np.ndarray, price: np.ndarray, months: int, simulations: int = 10000,
+                              processes: Optional[int] = None, chunk_size: int = 2500,
+                              seed: int = 0) -> np.ndarray:
+    """
+    Simulate holding returns by resampling blocks of the daily log returns.
+
+    Blocks of BLOCK_LENGTH consecutive returns keep short-term dependence,
+    and paths are as many rows long as the holding period has on average in
+    the history. The simulations are split into chunks with independent
+    seeds and run in a process pool, so the result only depends on `seed`.
+
+    Args:
+        datetimes: Array with dimensions of (datetime).
+        price: Array with dimensions of (datetime).
+        months: The holding period in months.
+        simulations: The number of simulated paths.
+        processes: The number of worker processes, None for one per CPU, or
+            1 to simulate in this process.
+        chunk_size: The number of paths per worker task.
+        seed: The random seed.
+
+    Returns:
+        Array of the total return of every simulated path.
+
+    Raises:
+        ValueError: If the history has fewer than MIN_HISTORICAL_SAMPLES
+            returns, or fewer than MIN_BOOTSTRAP_HISTORY_FRACTION of a path.
+    """
+    valid = np.isfinite(price)
+    datetimes, price = datetimes[valid], price[valid]
+    r = np.diff(np.log(price))
+    if r.size < MIN_HISTORICAL_SAMPLES:
+        raise ValueError(f"Not enough history to resample: {r.size} daily returns, "
+                         f"at least {MIN_HISTORICAL_SAMPLES} are needed")
+
+    prefix = np.concatenate([[0.0], np.cumsum(r)])
+    years = (datetimes[-1] - datetimes[0]) / np.timedelta64(1, "D") / 365.25
+    path_length = max(int(round(r.size / years * months / 12)), 1)
+    if r.size < MIN_BOOTSTRAP_HISTORY_FRACTION * path_length:
+        raise ValueError(f"Not enough history to resample a {months}-month holding period: {r.size} daily returns, "
+                         f"at least {int(np.ceil(MIN_BOOTSTRAP_HISTORY_FRACTION * path_length))} are needed")
+
+    seeds = np.random.SeedSequence(seed).spawn((simulations + chunk_size - 1) // chunk_size)
+    chunks = [(prefix, BLOCK_LENGTH, path_length, min(chunk_size, simulations - i * chunk_size), child)
+              for i, child in enumerate(seeds)]
+    if processes == 1 or len(chunks) == 1:
+        return np.concatenate([_simulate_chunk(chunk) for chunk in chunks])
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return np.concatenate(list(executor.map(_simulate_chunk, chunks)))
+
+def _to_date(value) -> date:
+    return pd.Timestamp(value).date()
+
+def get_holding_outcomes(returns: np.ndarray, holding_period: str, method: str,
+                         start_dates: Optional[np.ndarray] = None) -> HoldingPeriodOutcomes:
+    """
+    Summarize the distribution of holding returns.
+
+    Args:
+        returns: Array of total returns, one per entry date or simulated path.
+        holding_period: The holding period label.
+        method: "historical" or "bootstrap".
+        start_dates: The entry date of every return, for historical returns.
+
+    Returns:
+        A HoldingPeriodOutcomes object.
+    """
+    if returns.size == 0:
+        return HoldingPeriodOutcomes(holding_period=holding_period, method=method, samples=0,
+                                     loss_probability=np.nan, mean_return=np.nan, worst_return=np.nan,
+                                     best_return=np.nan, percentiles={f"p{q}": np.nan for q in HOLDING_PERCENTILES})
+
+    worst = int(np.argmin(returns))
+    outcomes = HoldingPeriodOutcomes(
+        holding_period=holding_period,
+        method=method,
+        samples=int(returns.size),
+        loss_probability=float((returns < 0).mean()),
+        mean_return=float(returns.mean()),
+        worst_return=float(returns[worst]),
+        best_return=float(returns.max()),
+        percentiles={f"p{q}": float(value)
+                     for q, value in zip(HOLDING_PERCENTILES, np.percentile(returns, HOLDING_PERCENTILES))}
+    )
+    if start_dates is not None:
+        outcomes.first_start_date = _to_date(start_dates[0])
+        outcomes.last_start_date = _to_date(start_dates[-1])
+        outcomes.worst_start_date = _to_date(start_dates[worst])
+    return outcomes
+
+class HoldingSimulator:
+    """
+    Holding-period outcomes of a price series, cached per (series, holding period).
+
+    With the "historical" method every entry date of the series is
+    evaluated at once. With "bootstrap", blocks of its returns are
+    resampled, for series too short to have many entry dates. The default
+    of one process simulates inside the request, which takes milliseconds;
+    a pool per cache miss would cost more than it saves under a
+    multi-worker server. "auto" picks bootstrap below MIN_HISTORICAL_SAMPLES entry dates.
+    Outcomes are kept keyed by the caller's series key, the holding period,
+    the method and a data version, and the least recently used ones are
+    evicted once there are more than `max_entries`.
+    """
+
+    def __init__(self, simulations: int = 10000, processes: Optional[int] = 1, max_entries: int = 1024):
+        self.simulations = simulations
+        self.processes = processes
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[HoldingKey, HoldingPeriodOutcomes]" = OrderedDict()
+        self._stats = HoldingCacheStats()
+        self._lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        self.simulations = app.config.get("HOLDING_SIMULATIONS", self.simulations)
+        self.processes = app.config.get("HOLDING_SIMULATION_PROCESSES", self.processes)
+
+    def get_outcomes(self, key: Hashable, version: str, datetimes: np.ndarray, price: np.ndarray,
+                     holding_period: str, method: str = "auto") -> HoldingPeriodOutcomes:
+        """
+        Get the outcomes of holding a series, simulating them on a cache miss.
+
+        Args:
+            key: The series, e.g. ("fund", code).
+            version: The data version of the series, e.g. the trading day.
+            datetimes: Array with dimensions of (datetime).
+            price: Array with dimensions of (datetime).
+            holding_period: The holding period, e.g. "3Y".
+            method: One of HOLDING_METHODS.
+
+        Returns:
+            A HoldingPeriodOutcomes object.
+
+        Raises:
+            ValueError: If the holding period or the method is invalid, or the
+                series is too short to resample.
+        """
+        if method not in HOLDING_METHODS:
+            raise ValueError(f"method must be one of {HOLDING_METHODS}")
+        months = parse_holding_period(holding_period)
+
+        cache_key = (key, holding_period, method, version)
+        with self._lock:
+            outcomes = self._entries.get(cache_key)
+            if outcomes is not None:
+                self._stats.hits += 1
+                self._entries.move_to_end(cache_key)
+                return outcomes
+            self._stats.misses += 1
+
+        starts, returns = get_holding_returns(datetimes, price, months)
+        if method == "bootstrap" or (method == "auto" and returns.size < MIN_HISTORICAL_SAMPLES):
+            returns = bootstrap_holding_returns(datetimes, price, months, self.simulations, self.processes)
+            outcomes = get_holding_outcomes(returns, holding_period, "bootstrap")
+        else:
+            outcomes = get_holding_outcomes(returns, holding_period, "historical", datetimes[starts])
+
+        with self._lock:
+            self._entries[cache_key] = outcomes
+            self._entries.move_to_end(cache_key)
+            self._stats.entries = len(self._entries)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats.evictions += 1
+                self._stats.entries -= 1
+        return outcomes
+
+    def stats(self) -> HoldingCacheStats:
+        with self._lock:
+            return HoldingCacheStats(**vars(self._stats))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._stats.entries = 0
+
+holding_simulator = HoldingSimulator()
@@ -0,0 +1,221 @@
+import functools
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pytz
+from flask import Response, make_response, request
+
+from myutils.cache_util import get_next_rollover, get_trading_day, price_cache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ResponseKey = Tuple[str, str, str]
+
+CACHED_HEADERS = ["Content-Type", "Vary"]
+
+@dataclass
+class CachedResponse:
+    # Bodies keyed by content coding. Small bodies are kept as "identity" only.
+    bodies: Dict[str, bytes]
+    headers: Dict[str, str]
+    raw_nbytes: int
+    nbytes: int
+
+@dataclass
+class ResponseCacheStats:
+    hits: int = 0
+    misses: int = 0
+    not_modified: int = 0
+    evictions: int = 0
+    entries: int = 0
+    nbytes: int = 0
+    raw_nbytes: int = 0
+    sent_bytes: int = 0
+    raw_sent_bytes: int = 0
+    hit_rate: float = 0.0
+
+def get_trading_day_version() -> str:
+    """
+    Get the data version of resources which change at most once per trading day.
+    """
+    return get_trading_day(datetime.now(), price_cache.rollover_hour).isoformat()
+
+def get_max_age() -> int:
+    """
+    Get the seconds until the current trading day rolls over.
+    """
+    now = datetime.now(tz=pytz.timezone("Asia/Shanghai"))
+    return max(int((get_next_rollover(now, price_cache.rollover_hour) - now).total_seconds()), 0)
+
+def get_etag(key: ResponseKey) -> str:
+    return hashlib.sha1("\0".join(key).encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """
+    HTTP caching for GET endpoints whose data has a cheap version.
+
+    Each cached view gets a version function, e.g. the trading day or a
+    definition hash. The ETag is derived from the URL, the Accept header and
+    that version, so a request whose If-None-Match matches is answered with
+    304 before the view runs. Other responses are compressed once per
+    version, with gzip and, if the brotli package is installed, brotli, and
+    kept in memory keyed the same way. Entries are evicted least recently
+    used once the total size exceeds `max_bytes`, so a repeated request is
+    answered without running the view or compressing again, in the best
+    coding its Accept-Encoding allows.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, min_compress_bytes: int = 1024,
+                 gzip_level: int = 6, brotli_quality: int = 9):
+        self.max_bytes = max_bytes
+        self.min_compress_bytes = min_compress_bytes
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self._entries: "OrderedDict[ResponseKey, CachedResponse]" = OrderedDict()
+        self._stats = ResponseCacheStats()
+        self._lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        self.max_bytes = app.config.get("RESPONSE_CACHE_MAX_BYTES", self.max_bytes)
+        self.min_compress_bytes = app.config.get("RESPONSE_CACHE_MIN_COMPRESS_BYTES", self.min_compress_bytes)
+
+    def get_codings(self) -> List[str]:
+        """
+        Get the content codings stored for compressible bodies, best first.
+        """
+        return (["br"] if brotli is not None else []) + ["gzip"]
+
+    def cached(self, get_version: Callable[[], Optional[str]]):
+        """
+        Decorate a view to be served with ETags, 304 replies and the cache.
+
+        Args:
+            get_version: Function returning the data version of the current
+                request, or None to bypass the cache.
+
+        Returns:
+            The decorator.
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                version = get_version()
+                if version is None:
+                    return view(*args, **kwargs)
+
+                key = (request.full_path, request.headers.get("Accept", ""), version)
+                etag = get_etag(key)
+                # Reply with the ETag that matched, as it names the coding of the client's copy.
+                matched = next((etag + suffix for suffix in [""] + [f"-{coding}" for coding in self.get_codings()]
+                                if request.if_none_match.contains_weak(etag + suffix)), None)
+                if matched is not None:
+                    with self._lock:
+                        self._stats.not_modified += 1
+                    response = Response(status=304)
+                    response.vary.add("Accept-Encoding")
+                    return self._set_cache_headers(response, matched)
+
+                cached = self._get(key)
+                if cached is None:
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200 or response.is_streamed:
+                        if response.status_code == 200:
+                            self._set_cache_headers(response, etag)
+                        return response
+                    cached = self._compress(response)
+                    self._put(key, cached)
+                return self._get_response(cached, etag)
+            return wrapper
+        return decorator
+
+    def stats(self) -> ResponseCacheStats:
+        with self._lock:
+            stats = ResponseCacheStats(**vars(self._stats))
+        requests = stats.hits + stats.misses
+        stats.hit_rate = stats.hits / requests if requests > 0 else 0.0
+        return stats
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._stats.entries = 0
+            self._stats.nbytes = 0
+            self._stats.raw_nbytes = 0
+
+    def _compress(self, response: Response) -> CachedResponse:
+        data = response.get_data()
+        if len(data) < self.min_compress_bytes:
+            bodies = {"identity": data}
+        else:
+            # In the order of get_codings, which best_match prefers among equal qualities.
+            bodies = {}
+            if brotli is not None:
+                bodies["br"] = brotli.compress(data, quality=self.brotli_quality)
+            bodies["gzip"] = gzip.compress(data, self.gzip_level)
+        return CachedResponse(
+            bodies=bodies,
+            headers={name: response.headers[name] for name in CACHED_HEADERS if name in response.headers},
+            raw_nbytes=len(data),
+            nbytes=sum(len(body) for body in bodies.values())
+        )
+
+    def _get_response(self, cached: CachedResponse, etag: str) -> Response:
+        coding = request.accept_encodings.best_match([coding for coding in cached.bodies if coding != "identity"])
+        if coding is not None:
+            body = cached.bodies[coding]
+            response = Response(body, headers=cached.headers)
+            response.headers["Content-Encoding"] = coding
+            etag += f"-{coding}"
+        else:
+            # Few clients do not accept gzip, so the uncompressed body is not kept.
+            body = cached.bodies["identity"] if "identity" in cached.bodies else gzip.decompress(cached.bodies["gzip"])
+            response = Response(body, headers=cached.headers)
+        with self._lock:
+            self._stats.sent_bytes += len(body)
+            self._stats.raw_sent_bytes += cached.raw_nbytes
+        response.vary.add("Accept-Encoding")
+        return self._set_cache_headers(response, etag)
+
+    def _set_cache_headers(self, response: Response, etag: str) -> Response:
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = get_max_age()
+        return response
+
+    def _get(self, key: ResponseKey) -> Optional[CachedResponse]:
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is None:
+                self._stats.misses += 1
+                return None
+            self._stats.hits += 1
+            self._entries.move_to_end(key)
+            return cached
+
+    def _put(self, key: ResponseKey, cached: CachedResponse) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = cached
+            self._stats.entries += 1
+            self._stats.nbytes += cached.nbytes
+            self._stats.raw_nbytes += cached.raw_nbytes
+            while self._stats.nbytes > self.max_bytes and len(self._entries) > 1:
+                self._remove(next(iter(self._entries)))
+                self._stats.evictions += 1
+
+    def _remove(self, key: ResponseKey) -> None:
+        cached = self._entries.pop(key)
+        self._stats.entries -= 1
+        self._stats.nbytes -= cached.nbytes
+        self._stats.raw_nbytes -= cached.raw_nbytes
+
+response_cache = ResponseCache()
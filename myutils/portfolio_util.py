@@ -0,0 +1,428 @@
+from dataclasses import dataclass
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+import xarray as xr
+
+from myutils import correlation_util, drawdown_util, eval_util, rebalance_util
+
+PORTFOLIO_METHODS = ["min_variance", "risk_parity", "target_volatility"]
+
+# Risk aversions of the mean-variance portfolios searched for a target volatility.
+RISK_AVERSIONS = np.geomspace(1e-2, 1e4, 32)
+
+@dataclass
+class PortfolioWeights:
+    method: str
+    securities: List[str]
+    weights: List[float]
+    risk_contributions: List[float]
+    expected_return: float
+    volatility: float
+    iterations: int
+    converged: bool
+
+def project_capped_simplex(v: np.ndarray, caps: np.ndarray) -> np.ndarray:
+    """
+    Project points onto {w : sum(w) = 1, 0 <= w <= caps} exactly.
+
+    The projection is clip(v - tau, 0, caps) for the tau at which it sums to
+    one. That sum is piecewise linear in tau with breakpoints at v - caps
+    and v, so it is evaluated at all breakpoints with one sort and running
+    sums, and tau is interpolated within the segment where it crosses one.
+
+    Args:
+        v: Array with dimensions of (..., security).
+        caps: Array with dimensions of (security), summing to at least one.
+
+    Returns:
+        Array of the same shape as v.
+    """
+    caps = np.broadcast_to(caps, v.shape)
+    points = np.concatenate([v - caps, v], axis=-1)
+    # Walking tau upwards, a term starts falling at v - cap and stops at v.
+    changes = np.concatenate([-np.ones_like(v), np.ones_like(v)], axis=-1)
+    order = np.argsort(points, axis=-1)
+    points = np.take_along_axis(points, order, axis=-1)
+    slopes = np.cumsum(np.take_along_axis(changes, order, axis=-1), axis=-1)
+
+    total = np.concatenate([
+        caps.sum(axis=-1, keepdims=True),
+        caps.sum(axis=-1, keepdims=True) + np.cumsum(slopes[..., :-1] * np.diff(points, axis=-1), axis=-1)
+    ], axis=-1)
+    k = np.maximum(np.argmax(total <= 1, axis=-1), 1)[..., np.newaxis]
+    previous_total = np.take_along_axis(total, k - 1, axis=-1)
+    previous_point = np.take_along_axis(points, k - 1, axis=-1)
+    slope = np.take_along_axis(slopes, k - 1, axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tau = np.where(previous_total <= 1, previous_point, previous_point + (1 - previous_total) / slope)
+    return np.clip(v - tau, 0.0, caps)
+
+def get_caps(count: int, max_weight: Union[float, np.ndarray, None]) -> np.ndarray:
+    """
+    Get the per-security weight caps, checking that they allow a full allocation.
+
+    Args:
+        count: The number of securities.
+        max_weight: A cap for every security, an array of caps, or None.
+
+    Returns:
+        Array with dimensions of (security).
+
+    Raises:
+        ValueError: If the caps sum to less than one.
+    """
+    caps = np.broadcast_to(np.asarray(1.0 if max_weight is None else max_weight, dtype=np.float64), (count,))
+    if (caps < 0).any() or caps.sum() < 1 - 1e-12:
+        raise ValueError("max_weight is too small to invest everything")
+    return np.minimum(caps, 1.0)
+
+def _get_step(covariance: np.ndarray) -> float:
+    return 1 / (2 * max(np.abs(np.linalg.eigvalsh(covariance)).max(), 1e-12))
+
+def _get_volatility(covariance: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    return np.sqrt(np.maximum(np.einsum("...i,ij,...j->...", weights, covariance, weights), 0.0))
+
+def _polish(covariance: np.ndarray, linear: np.ndarray, scale: float, w: np.ndarray, caps: np.ndarray,
+            passes: int = 10) -> Optional[np.ndarray]:
+    # Solve exactly from the optimality conditions, starting with the weights
+    # of w at zero and at their caps: the other weights have gradients equal
+    # to the multiplier of the budget, which no weight at zero undercuts and
+    # no weight at its cap exceeds. Weights breaking those conditions switch
+    # between bounded and free for the next pass (a primal-dual active set
+    # step). None if that does not settle within `passes`.
+    at_zero = w <= 0
+    at_cap = w >= caps
+    for _ in range(passes):
+        free = np.flatnonzero(~at_zero & ~at_cap)
+        fixed = np.where(at_cap, caps, 0.0)
+        system = np.zeros((free.size + 1, free.size + 1))
+        system[:-1, :-1] = 2 * scale * covariance[np.ix_(free, free)]
+        system[:-1, -1] = -1
+        system[-1, :-1] = 1
+        rhs = np.r_[linear[free] - 2 * scale * covariance[free] @ fixed, 1 - fixed.sum()]
+        try:
+            solution = np.linalg.solve(system, rhs)
+        except np.linalg.LinAlgError:
+            return None
+
+        exact = fixed
+        exact[free] = solution[:-1]
+        level = solution[-1]
+        gradient = 2 * scale * (covariance @ exact) - linear
+        slack = 1e-9 * np.abs(gradient).max()
+        to_zero = np.zeros_like(at_zero)
+        to_zero[free] = exact[free] < 0
+        to_cap = np.zeros_like(at_cap)
+        to_cap[free] = exact[free] > caps[free]
+        from_zero = at_zero & (gradient < level - slack)
+        from_cap = at_cap & (gradient > level + slack)
+        if not (to_zero.any() or to_cap.any() or from_zero.any() or from_cap.any()):
+            return exact
+        at_zero = (at_zero & ~from_zero) | to_zero
+        at_cap = (at_cap & ~from_cap) | to_cap
+    return None
+
+def _solve_quadratic(covariance: np.ndarray, linear: np.ndarray, scale: np.ndarray, w: np.ndarray, caps: np.ndarray,
+                     tolerance: float, max_iterations: int, polish_every: int = 5,
+                     step: Optional[float] = None) -> Tuple[np.ndarray, int, bool]:
+    # Minimize scale * w' cov w - linear' w over the capped simplex for every
+    # row of w, by FISTA: a gradient step from an extrapolated point, then the
+    # projection. The momentum of a row restarts once it points uphill, which
+    # keeps ill-conditioned problems from oscillating. The projections soon
+    # put nearly the right weights at zero and at their caps, so every few
+    # steps the unfinished rows are polished, and a row is done once that is
+    # exact or its steps are below the tolerance.
+    scale = np.broadcast_to(np.reshape(scale, (-1, 1)), (w.shape[0], 1))
+    step = (_get_step(covariance) if step is None else step) / scale
+    w = w.copy()
+    y, t = w.copy(), np.ones((w.shape[0], 1))
+    done = np.zeros(w.shape[0], dtype=bool)
+    for iteration in range(1, max_iterations + 1):
+        rows = np.flatnonzero(~done)
+        y_rows = y[rows]
+        w_next = project_capped_simplex(
+            y_rows - step[rows] * (2 * scale[rows] * (y_rows @ covariance) - linear), caps
+        )
+        change = w_next - w[rows]
+        uphill = ((y_rows - w_next) * change).sum(axis=-1, keepdims=True) > 0
+        t_rows = np.where(uphill, 1.0, t[rows])
+        t_next = (1 + np.sqrt(1 + 4 * t_rows * t_rows)) / 2
+        y[rows] = w_next + (t_rows - 1) / t_next * change
+        w[rows], t[rows] = w_next, t_next
+
+        done[rows] = np.abs(change).max(axis=-1) < tolerance
+        if iteration % polish_every == 0:
+            for row in np.flatnonzero(~done):
+                exact = _polish(covariance, linear, scale[row, 0], w[row], caps)
+                if exact is not None:
+                    w[row] = exact
+                    done[row] = True
+        if done.all():
+            return w, iteration, True
+    return w, max_iterations, False
+
+def get_min_variance_weights(covariance: np.ndarray, caps: np.ndarray, tolerance: float = 1e-9,
+                             max_iterations: int = 5000) -> Tuple[np.ndarray, int, bool]:
+    """
+    Solve the long-only minimum variance weights.
+
+    Accelerated projected gradient steps find the securities at zero and at
+    their caps, and the weights of the rest are then solved exactly.
+
+    Args:
+        covariance: The covariance matrix.
+        caps: The weight caps, as returned by get_caps.
+        tolerance: The largest weight change of a converged step, if the
+            exact solution is not found first.
+        max_iterations: The maximum number of steps.
+
+    Returns:
+        The weights, the number of steps and whether they converged.
+    """
+    w = project_capped_simplex(np.full((1, caps.size), 1 / caps.size), caps)
+    weights, iterations, converged = _solve_quadratic(covariance, np.zeros(caps.size), 1.0, w, caps,
+                                                      tolerance, max_iterations)
+    return weights[0], iterations, converged
+
+def get_risk_parity_weights(covariance: np.ndarray, caps: np.ndarray, budgets: Optional[np.ndarray] = None,
+                            tolerance: float = 1e-9, max_iterations: int = 5000,
+                            damping: float = 0.5) -> Tuple[np.ndarray, int, bool]:
+    """
+    Solve the weights whose risk contributions are proportional to `budgets`.
+
+    Risk parity is the minimum of y' cov y / 2 - sum(budgets * log(y)),
+    normalized. Each coordinate of its optimality condition is a quadratic
+    in y_i, so all coordinates are updated at once from their roots, with
+    damping. Weights above their caps are then projected onto the capped
+    simplex, which gives up exact parity where a cap binds.
+
+    Args:
+        covariance: The covariance matrix.
+        caps: The weight caps, as returned by get_caps.
+        budgets: The risk budgets, or None for equal ones.
+        tolerance: The largest relative change of a converged step.
+        max_iterations: The maximum number of steps.
+        damping: The share of the new point in every step.
+
+    Returns:
+        The weights, the number of steps and whether they converged.
+    """
+    n = caps.size
+    budgets = np.full(n, 1 / n) if budgets is None else budgets / budgets.sum()
+    variance = np.diag(covariance)
+    y = 1 / np.sqrt(variance)
+    y = y / y.sum()
+    converged = False
+    for iteration in range(1, max_iterations + 1):
+        other = y @ covariance - variance * y
+        root = (-other + np.sqrt(other * other + 4 * variance * budgets)) / (2 * variance)
+        y_next = (1 - damping) * y + damping * root
+        converged = np.abs(y_next - y).max() < tolerance * y_next.max()
+        y = y_next
+        if converged:
+            break
+    w = y / y.sum()
+    if (w > caps).any():
+        w = project_capped_simplex(w, caps)
+    return w, iteration, converged
+
+def get_mean_variance_weights(covariance: np.ndarray, expected_returns: np.ndarray, risk_aversions: np.ndarray,
+                              caps: np.ndarray, tolerance: float = 1e-9,
+                              max_iterations: int = 5000) -> Tuple[np.ndarray, int, bool]:
+    """
+    Solve long-only mean-variance weights for many risk aversions at once.
+
+    Every row maximizes expected_returns' w - risk_aversion * w' cov w. The
+    rows take projected gradient steps together, as one (risk aversion,
+    security) array with a step size per row, and are solved exactly like
+    the minimum variance weights.
+
+    Args:
+        covariance: The covariance matrix.
+        expected_returns: The annualized expected returns.
+        risk_aversions: Array with dimensions of (portfolio).
+        caps: The weight caps, as returned by get_caps.
+        tolerance: The largest weight change of a converged step, if the
+            exact solution is not found first.
+        max_iterations: The maximum number of steps.
+
+    Returns:
+        The weights with dimensions of (portfolio, security), the number of
+        steps and whether all rows converged.
+    """
+    w = project_capped_simplex(np.full((risk_aversions.size, caps.size), 1 / caps.size), caps)
+    return _solve_quadratic(covariance, expected_returns, risk_aversions, w, caps, tolerance, max_iterations)
+
+def _has_same_bounds(w: np.ndarray, other: np.ndarray, caps: np.ndarray) -> bool:
+    return bool(((w <= 0) == (other <= 0)).all() and ((w >= caps) == (other >= caps)).all())
+
+def get_target_volatility_weights(covariance: np.ndarray, expected_returns: np.ndarray, target_volatility: float,
+                                  caps: np.ndarray, max_refinements: int = 50) -> Tuple[np.ndarray, int, bool]:
+    """
+    Solve the long-only weights of the highest expected return at a target volatility.
+
+    These are efficient weights for some risk aversion, so the efficient
+    weights of RISK_AVERSIONS, and the minimum variance weights for an
+    infinite one, are solved together to bracket the target. While the same
+    securities are at zero and at their caps, efficient weights are affine
+    in 1 / risk aversion, so the bracket is bisected until both ends agree
+    on those, and their mix at the target volatility is then exact. A target
+    below the minimum volatility gets the minimum variance weights, and one
+    above the largest the riskiest weights.
+
+    Args:
+        covariance: The covariance matrix.
+        expected_returns: The annualized expected returns.
+        target_volatility: The annualized target volatility.
+        caps: The weight caps, as returned by get_caps.
+        max_refinements: The maximum number of bisections of the bracket.
+
+    Returns:
+        The weights, the number of steps and whether they converged.
+    """
+    weights, iterations, converged = get_mean_variance_weights(covariance, expected_returns, RISK_AVERSIONS, caps)
+    min_variance, min_variance_iterations, min_variance_converged = get_min_variance_weights(covariance, caps)
+    weights = np.concatenate([weights, min_variance[np.newaxis]])
+    risk_aversions = np.r_[RISK_AVERSIONS, np.inf]
+    iterations += min_variance_iterations
+    converged &= min_variance_converged
+
+    # Volatility falls as the risk aversion rises, so the first row at or below the target is the riskiest one.
+    below = np.flatnonzero(_get_volatility(covariance, weights) <= target_volatility + 1e-12)
+    if below.size == 0:
+        return min_variance, iterations, converged
+    if below[0] == 0:
+        return weights[0], iterations, converged
+
+    low, high = weights[below[0]], weights[below[0] - 1]
+    low_aversion, high_aversion = risk_aversions[below[0]], risk_aversions[below[0] - 1]
+    step = _get_step(covariance)
+    for _ in range(max_refinements):
+        if _has_same_bounds(low, high, caps):
+            break
+        middle = high_aversion * 10 if np.isinf(low_aversion) else np.sqrt(low_aversion * high_aversion)
+        w, count, ok = _solve_quadratic(covariance, expected_returns, middle, low[np.newaxis], caps,
+                                        1e-9, 5000, step=step)
+        iterations += count
+        converged &= ok
+        if _get_volatility(covariance, w[0]) <= target_volatility:
+            low, low_aversion = w[0], middle
+        else:
+            high, high_aversion = w[0], middle
+
+    # The variance of (1 - a) * low + a * high is a quadratic in a; take its root in [0, 1].
+    d = high - low
+    a2, a1, a0 = d @ covariance @ d, 2 * low @ covariance @ d, low @ covariance @ low - target_volatility ** 2
+    roots = np.roots([a2, a1, a0]) if a2 > 0 else np.array([-a0 / a1])
+    roots = roots[np.isreal(roots)].real
+    roots = roots[(roots >= 0) & (roots <= 1)]
+    a = roots.min() if roots.size > 0 else 0.0
+    return low + a * d, iterations, converged
+
+def get_expected_returns(da: xr.DataArray) -> np.ndarray:
+    """
+    Estimate expected returns as the annualized mean daily log return.
+
+    Args:
+        da: DataArray with dimensions of (datetime, security).
+
+    Returns:
+        Array with dimensions of (security).
+    """
+    r = correlation_util.get_log_returns(da)
+    years = eval_util.get_years_between_dates(da.datetime.values[0], da.datetime.values[-1])
+    with np.errstate(invalid="ignore"):
+        return np.nanmean(r, axis=0) * r.shape[0] / years
+
+def build_portfolio(securities: List[str], covariance: np.ndarray, expected_returns: np.ndarray, method: str,
+                    max_weight: Union[float, np.ndarray, None] = None,
+                    target_volatility: Optional[float] = None) -> PortfolioWeights:
+    """
+    Build long-only, capped portfolio weights.
+
+    Pairs without a covariance, e.g. without enough common history, are
+    taken as uncorrelated.
+
+    Args:
+        securities: The security codes.
+        covariance: The annualized covariance matrix.
+        expected_returns: The annualized expected returns.
+        method: One of PORTFOLIO_METHODS.
+        max_weight: The weight cap of every security, or an array of caps.
+        target_volatility: The annualized target volatility of target_volatility.
+
+    Returns:
+        A PortfolioWeights object.
+
+    Raises:
+        ValueError: If the method, the caps or the target are invalid, or a
+            security has no variance.
+    """
+    if method not in PORTFOLIO_METHODS:
+        raise ValueError(f"method must be one of {PORTFOLIO_METHODS}")
+    if np.isnan(np.diag(covariance)).any() or (np.diag(covariance) <= 0).any():
+        raise ValueError("Every security needs a positive variance")
+    covariance = np.where(np.isnan(covariance), 0.0, covariance)
+    caps = get_caps(len(securities), max_weight)
+
+    if method == "min_variance":
+        weights, iterations, converged = get_min_variance_weights(covariance, caps)
+    elif method == "risk_parity":
+        weights, iterations, converged = get_risk_parity_weights(covariance, caps)
+    else:
+        if target_volatility is None or target_volatility <= 0:
+            raise ValueError("target_volatility must be positive")
+        expected_returns = np.where(np.isnan(expected_returns), 0.0, expected_returns)
+        weights, iterations, converged = get_target_volatility_weights(covariance, expected_returns,
+                                                                       target_volatility, caps)
+
+    variance = weights @ covariance @ weights
+    return PortfolioWeights(
+        method=method,
+        securities=list(securities),
+        weights=weights.tolist(),
+        risk_contributions=(weights * (covariance @ weights) / variance).tolist(),
+        expected_return=float(np.nansum(weights * expected_returns)),
+        volatility=float(np.sqrt(variance)),
+        iterations=iterations,
+        converged=bool(converged)
+    )
+
+def backtest_portfolio(da: xr.DataArray, weights: np.ndarray, rebalance: str = "M",
+                       base: float = 1000.0) -> xr.DataArray:
+    """
+    Calculate the value of a portfolio rebalanced to fixed weights.
+
+    The rebalancing is that of the chained composite benchmarks. Prices are
+    carried forward over the dates a security has none, as the universes mix
+    calendars, and a security without a price yet is held as cash.
+
+    Args:
+        da: DataArray with dimensions of (datetime, security).
+        weights: Array with dimensions of (security) summing to one.
+        rebalance: One of rebalance_util.REBALANCE_FREQUENCIES.
+        base: The value on the first date.
+
+    Returns:
+        DataArray with dimensions of (datetime) containing the value.
+    """
+    da = da.transpose("datetime", "security")
+    keys = rebalance_util.get_rebalance_keys(da.datetime.values[1:], rebalance)
+    price = da.to_pandas().ffill().values.astype(np.float64)
+    growth = rebalance_util.get_rebalanced_growth(price, weights, keys)
+    return xr.DataArray(base * np.r_[1.0, growth], coords={"datetime": da.datetime.values},
+                        dims="datetime", name="AdjClose")
+
+def evaluate_portfolio(value: xr.DataArray) -> Tuple[List[eval_util.EvaluationResult], drawdown_util.DrawdownResult]:
+    """
+    Evaluate a backtested portfolio like a single security.
+
+    Args:
+        value: DataArray with dimensions of (datetime), from backtest_portfolio.
+
+    Returns:
+        The evaluation results of every period and the drawdown details.
+    """
+    da = value.expand_dims("security", axis=1)
+    return eval_util.get_evaluation_results(da), drawdown_util.get_drawdown_result(da)
@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+
+REBALANCE_FREQUENCIES = ["D", "M", "Q", "Y", "N"]
+
+def get_rebalance_keys(datetimes: np.ndarray, rebalance: str) -> np.ndarray:
+    """
+    Label every date with its rebalance period.
+
+    Args:
+        datetimes: Array with dimensions of (datetime).
+        rebalance: One of REBALANCE_FREQUENCIES: "D" daily, "M" monthly, "Q"
+            quarterly, "Y" yearly, or "N" never.
+
+    Returns:
+        Array with dimensions of (datetime), equal within a rebalance period.
+    """
+    index = pd.DatetimeIndex(datetimes)
+    if rebalance == "D":
+        return np.arange(index.size)
+    if rebalance == "M":
+        return index.year.values * 12 + index.month.values
+    if rebalance == "Q":
+        return index.year.values * 4 + (index.month.values - 1) // 3
+    if rebalance == "Y":
+        return index.year.values
+    if rebalance == "N":
+        return np.zeros(index.size, dtype=np.int64)
+    raise ValueError(f"Unsupported rebalance frequency: {rebalance}")
+
+def get_rebalanced_growth(price: np.ndarray, weights: np.ndarray, keys: np.ndarray) -> np.ndarray:
+    """
+    Calculate the growth of a segment relative to its anchor row.
+
+    Within each rebalance period the constituents are bought and held from
+    the close before the period, so the growth of a row is a weighted sum of
+    price relatives. The periods are then chained with a cumulative product.
+
+    Args:
+        price: Array with dimensions of (1 + datetime, security), whose first
+            row is the close before the segment.
+        weights: Array with dimensions of (security) summing to one.
+        keys: Array with dimensions of (datetime), equal within a rebalance
+            period.
+
+    Returns:
+        Array with dimensions of (datetime) containing the growth factors.
+    """
+    rows = np.arange(keys.size)
+    new_period = np.r_[True, keys[1:] != keys[:-1]]
+    period_start = np.maximum.accumulate(np.where(new_period, rows, 0))
+
+    # price[period_start] is the close before the period, as price is shifted by the anchor row.
+    with np.errstate(divide="ignore", invalid="ignore"):
+        relative = price[1:] / price[period_start]
+    # A constituent without a price yet contributes a zero return.
+    relative = np.where(np.isnan(relative), 1.0, relative)
+    growth = relative @ weights
+
+    period_end = np.r_[new_period[1:], True]
+    growth_before_period = np.r_[1.0, np.cumprod(growth[period_end])[:-1]]
+    return growth_before_period[np.cumsum(new_period) - 1] * growth
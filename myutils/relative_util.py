@@ -0,0 +1,149 @@
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from myutils import eval_util
+
+RELATIVE_FIELDS = [
+    "observations",
+    "annualized_return",
+    "benchmark_annualized_return",
+    "excess_return",
+    "tracking_error",
+    "information_ratio",
+    "beta",
+    "up_capture",
+    "down_capture"
+]
+
+def align_fund_and_benchmark(fund: xr.DataArray, benchmark: xr.DataArray) -> xr.DataArray:
+    """
+    Align fund and benchmark prices on their shared calendar.
+
+    Args:
+        fund: DataArray with dimensions of (datetime, security).
+        benchmark: DataArray with dimensions of (datetime, security), where
+            each security is the fund whose benchmark the column holds.
+
+    Returns:
+        DataArray with dimensions of (side, datetime, security), where side
+        is "fund" or "benchmark". A date is NaN on both sides unless both
+        have a price on it.
+    """
+    fund, benchmark = xr.align(fund.transpose("datetime", "security"),
+                               benchmark.transpose("datetime", "security"), join="inner")
+    both = fund.notnull() & benchmark.notnull()
+    return xr.concat([fund.where(both), benchmark.where(both)],
+                     dim=pd.Index(["fund", "benchmark"], name="side"))
+
+def get_relative_table(fund: xr.DataArray, benchmark: xr.DataArray) -> xr.Dataset:
+    """
+    Calculate fund-vs-benchmark metrics of every period for many funds at once.
+
+    Prefix sums of daily log returns, their products and their up/down
+    market splits are built once, and each period is answered by index
+    lookups into them, as in eval_util.get_evaluation_table.
+
+    Args:
+        fund: DataArray with dimensions of (datetime, security).
+        benchmark: DataArray with dimensions of (datetime, security), where
+            each security is the fund whose benchmark the column holds.
+
+    Returns:
+        Dataset with dimensions of (period, security) containing the fields
+        in RELATIVE_FIELDS, the start_date of every (period, security) and the
+        end_date of every security. Each fund is evaluated up to the last date
+        both sides have a price. Missing results are NaN, or zero observations.
+    """
+    aligned = align_fund_and_benchmark(fund, benchmark)
+    datetimes = aligned.datetime.values
+    price_f = aligned.sel(side="fund").values.astype(np.float64)
+    price_b = aligned.sel(side="benchmark").values.astype(np.float64)
+    has_price = ~np.isnan(price_f)
+
+    r_f = np.full_like(price_f, np.nan)
+    r_b = np.full_like(price_b, np.nan)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r_f[1:] = np.log(price_f[1:] / price_f[:-1])
+        r_b[1:] = np.log(price_b[1:] / price_b[:-1])
+    r_valid = ~np.isnan(r_f) & ~np.isnan(r_b)
+    r_f = np.where(r_valid, r_f, 0.0)
+    r_b = np.where(r_valid, r_b, 0.0)
+    r_d = r_f - r_b
+    up = r_b > 0
+    down = r_b < 0
+
+    prefix = {
+        "price_count": eval_util.get_prefix_sum(has_price),
+        "count": eval_util.get_prefix_sum(r_valid),
+        "f": eval_util.get_prefix_sum(r_f),
+        "b": eval_util.get_prefix_sum(r_b),
+        "d": eval_util.get_prefix_sum(r_d),
+        "dd": eval_util.get_prefix_sum(r_d * r_d),
+        "fb": eval_util.get_prefix_sum(r_f * r_b),
+        "bb": eval_util.get_prefix_sum(r_b * r_b),
+        "up_f": eval_util.get_prefix_sum(np.where(up, np.expm1(r_f), 0.0)),
+        "up_b": eval_util.get_prefix_sum(np.where(up, np.expm1(r_b), 0.0)),
+        "down_f": eval_util.get_prefix_sum(np.where(down, np.expm1(r_f), 0.0)),
+        "down_b": eval_util.get_prefix_sum(np.where(down, np.expm1(r_b), 0.0))
+    }
+
+    column = np.arange(price_f.shape[1])
+    period_starts = eval_util.get_period_starts(datetimes, has_price)
+    rows = []
+    for period_start in period_starts:
+        start, end, years = period_start.start, period_start.end, period_start.years
+        # The first log return of a period needs the price before it, so skip it.
+        sums: Dict[str, np.ndarray] = {
+            key: value[end + 1, column] - value[start + (0 if key == "price_count" else 1), column]
+            for key, value in prefix.items()
+        }
+        n = sums["price_count"]
+        m = sums["count"]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            annualized_return = (price_f[end, column] / price_f[start, column]) ** (1 / years) - 1
+            benchmark_annualized_return = (price_b[end, column] / price_b[start, column]) ** (1 / years) - 1
+            excess_return = annualized_return - benchmark_annualized_return
+            active_variance = np.maximum(sums["dd"] - sums["d"] ** 2 / m, 0.0) / (m - 1)
+            tracking_error = np.sqrt(active_variance) * np.sqrt(n / years)
+            information_ratio = excess_return / tracking_error
+            beta = (sums["fb"] - sums["f"] * sums["b"] / m) / (sums["bb"] - sums["b"] ** 2 / m)
+            up_capture = sums["up_f"] / sums["up_b"]
+            down_capture = sums["down_f"] / sums["down_b"]
+
+        metrics = {
+            "observations": n.astype(np.int64),
+            "annualized_return": annualized_return,
+            "benchmark_annualized_return": benchmark_annualized_return,
+            "excess_return": excess_return,
+            "tracking_error": tracking_error,
+            "information_ratio": information_ratio,
+            "beta": beta,
+            "up_capture": up_capture,
+            "down_capture": down_capture
+        }
+        rows.append({
+            key: np.where(period_start.covered, value, 0 if key == "observations" else np.nan)
+            for key, value in metrics.items()
+        })
+
+    periods = [period_start.period for period_start in period_starts]
+    start_dates = (np.stack([period_start.start_date for period_start in period_starts]) if period_starts
+                   else np.empty((0, aligned.security.size), dtype="datetime64[ns]"))
+    end_dates = eval_util.get_last_dates(datetimes, has_price)
+    return xr.Dataset(
+        {
+            key: (("period", "security"), np.stack([row[key] for row in rows]) if rows
+                                          else np.empty((0, aligned.security.size)))
+            for key in RELATIVE_FIELDS
+        },
+        coords={
+            "period": np.array([period.label for period in periods], dtype=str),
+            "security": aligned.security.values,
+            "start_date": (("period", "security"), start_dates),
+            "end_date": ("security", end_dates)
+        }
+    )
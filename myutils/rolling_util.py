@@ -0,0 +1,170 @@
+import warnings
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from myutils import eval_util
+
+ROLLING_WINDOWS: Dict[str, int] = {"1Y": 12, "3Y": 36, "5Y": 60}
+
+ROLLING_METRICS = ["annualized_return", "annualized_volatility", "sharpe_ratio", "max_drawdown"]
+
+def get_window_start_dates(datetimes: np.ndarray, months: int) -> np.ndarray:
+    """
+    Get the start date of the window of a number of months ending at every date.
+
+    Args:
+        datetimes: Array with dimensions of (datetime).
+        months: The window length in calendar months.
+
+    Returns:
+        Array with dimensions of (datetime) of the dates moved back by
+        `months`, clipped to the end of the month like pd.DateOffset.
+    """
+    return (pd.DatetimeIndex(datetimes) - pd.DateOffset(months=months)).values
+
+def _get_segment_starts(starts: np.ndarray) -> np.ndarray:
+    # The boundaries of a two-stack queue: a new segment begins at the first
+    # window which no longer reaches back to the start of the current one,
+    # so every window spans the tail of one segment and the head of the next.
+    segment_starts = [0]
+    while (j := int(np.searchsorted(starts, segment_starts[-1], side="right"))) < starts.size:
+        segment_starts.append(j)
+    return np.array(segment_starts)
+
+def get_rolling_max_drawdown(price: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """
+    Calculate the max drawdown of the window ending at every row in O(n).
+
+    This is the sliding-window form of a monotonic deque, made of scans:
+    the rows are split into segments such that every window covers a suffix
+    of one segment and a prefix of the next. The high, low and max drawdown
+    of every prefix and suffix are running max/min scans within a segment,
+    and a window combines its two parts, including the fall from the high of
+    the suffix to the low of the prefix. The segments are the same for every
+    security, so the scans run over all securities at once.
+
+    Args:
+        price: Array with dimensions of (datetime, security).
+        starts: Non-decreasing array with dimensions of (datetime) of the
+            first row of the window ending at each row, as found by
+            np.searchsorted on get_window_start_dates.
+
+    Returns:
+        Array with dimensions of (datetime, security) of max drawdowns, zero
+        or positive, NaN where a window has no prices.
+    """
+    prefix_high = np.empty_like(price)
+    prefix_low = np.empty_like(price)
+    prefix_max_drawdown = np.empty_like(price)
+    suffix_high = np.empty_like(price)
+    suffix_max_drawdown = np.empty_like(price)
+
+    segment_starts = _get_segment_starts(starts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for first, last in zip(segment_starts, np.append(segment_starts[1:], price.shape[0])):
+            segment = price[first:last]
+            prefix_high[first:last] = np.fmax.accumulate(segment, axis=0)
+            prefix_low[first:last] = np.fmin.accumulate(segment, axis=0)
+            prefix_max_drawdown[first:last] = np.fmax.accumulate(1 - segment / prefix_high[first:last], axis=0)
+
+            reverse = segment[::-1]
+            suffix_high[first:last] = np.fmax.accumulate(reverse, axis=0)[::-1]
+            suffix_low = np.fmin.accumulate(reverse, axis=0)[::-1]
+            suffix_max_drawdown[first:last] = np.fmax.accumulate((1 - suffix_low / segment)[::-1], axis=0)[::-1]
+
+        segment_first = segment_starts[np.searchsorted(segment_starts, np.arange(price.shape[0]), side="right") - 1]
+        spans = (starts < segment_first)[:, np.newaxis]
+        max_drawdown = np.fmax(
+            np.fmax(suffix_max_drawdown[starts], prefix_max_drawdown),
+            1 - prefix_low / suffix_high[starts]
+        )
+    return np.where(spans, max_drawdown, prefix_max_drawdown)
+
+def get_rolling_table(da: xr.DataArray, windows: Optional[List[str]] = None,
+                      risk_free_rate: float = 0.025) -> xr.Dataset:
+    """
+    Calculate rolling metrics of every window ending at every date, for many securities.
+
+    Return, volatility and Sharpe ratio are index lookups into the prefix
+    sums of eval_util.get_cumulative_statistics, and max drawdown comes from
+    get_rolling_max_drawdown, so every window of every security costs O(1)
+    instead of a pass over its rows. A security has no result for a window
+    which starts before its first price.
+
+    Args:
+        da: DataArray with dimensions of (datetime, security).
+        windows: Labels of ROLLING_WINDOWS, or None for all of them.
+        risk_free_rate: The risk-free rate for the Sharpe ratio.
+
+    Returns:
+        Dataset with dimensions of (window, datetime, security), containing
+        one variable per ROLLING_METRICS and observations. Missing results are
+        NaN, or zero observations.
+    """
+    windows = list(ROLLING_WINDOWS) if windows is None else windows
+    stats = eval_util.get_cumulative_statistics(da)
+    has_value = ~np.isnan(stats.price)
+    first_dates = stats.datetime[np.argmax(has_value, axis=0)]
+    has_any_value = has_value.any(axis=0)
+    end = np.arange(stats.datetime.size)
+
+    rows = []
+    for window in windows:
+        start_dates = get_window_start_dates(stats.datetime, ROLLING_WINDOWS[window])
+        starts = np.searchsorted(stats.datetime, start_dates, side="left")
+        years = eval_util.get_years_between_datetimes(stats.datetime[starts], stats.datetime)
+        covered = (has_any_value & (first_dates <= start_dates[:, np.newaxis])
+                   & ((starts < end) & (years > 0))[:, np.newaxis])
+
+        metrics = eval_util.get_window_metrics(stats, starts[:, np.newaxis], end[:, np.newaxis],
+                                               years[:, np.newaxis], risk_free_rate)
+        metrics["max_drawdown"] = get_rolling_max_drawdown(stats.price, starts)
+        rows.append({
+            key: np.where(covered, value, 0 if key == "observations" else np.nan)
+            for key, value in metrics.items()
+        })
+
+    return xr.Dataset(
+        {key: (("window", "datetime", "security"), np.stack([row[key] for row in rows])) for key in rows[0]},
+        coords={"window": windows, "datetime": stats.datetime, "security": stats.security}
+    )
+
+def get_rolling_summary(table: xr.Dataset) -> xr.Dataset:
+    """
+    Summarize the outcomes of holding for every rolling window.
+
+    The probability of loss is the share of windows whose return is
+    negative, i.e. how often buying and holding for the window lost money.
+
+    Args:
+        table: The result of get_rolling_table.
+
+    Returns:
+        Dataset with dimensions of (window, security), containing windows (the
+        number of windows with a result), loss_probability and the worst,
+        median and best annualized_return.
+    """
+    annualized_return = table["annualized_return"].values
+    has_result = ~np.isnan(annualized_return)
+    windows = has_result.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        loss_probability = np.where(windows > 0, (annualized_return < 0).sum(axis=1) / windows, np.nan)
+
+    with warnings.catch_warnings():
+        # Securities without any window are all-NaN slices, whose quantiles are NaN.
+        warnings.simplefilter("ignore", RuntimeWarning)
+        quantiles = np.nanquantile(annualized_return, [0.0, 0.5, 1.0], axis=1)
+
+    return xr.Dataset(
+        {
+            "windows": (("window", "security"), windows),
+            "loss_probability": (("window", "security"), loss_probability),
+            "worst_annualized_return": (("window", "security"), quantiles[0]),
+            "median_annualized_return": (("window", "security"), quantiles[1]),
+            "best_annualized_return": (("window", "security"), quantiles[2])
+        },
+        coords={"window": table.window.values, "security": table.security.values}
+    )
@@ -0,0 +1,143 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from myutils import eval_util
+from myutils.cache_util import HISTORY_START, price_cache
+
+SCREENER_PERIODS = ["YTD", "1Y", "3Y", "5Y", "ITD"]
+SCREENER_METRICS = ["annualized_return", "annualized_volatility", "sharpe_ratio", "max_drawdown"]
+SCREENER_COLUMNS = [f"{period}_{metric}" for period in SCREENER_PERIODS for metric in SCREENER_METRICS]
+
+def _evaluate_chunk(codes: List[str]) -> pd.DataFrame:
+    # Each fund is read once per build, so filling the worker's own price cache would only cost memory.
+    ds = price_cache.data_manager.get_data(
+        start=HISTORY_START,
+        end=datetime.now(),
+        frequency="1d",
+        securities=codes,
+        fields=["AdjClose"]
+    )
+    if "AdjClose" not in ds.data_vars:
+        return pd.DataFrame(columns=SCREENER_COLUMNS, dtype=np.float64)
+
+    table = eval_util.get_evaluation_table(ds["AdjClose"]).reindex(period=SCREENER_PERIODS)
+    return pd.DataFrame(
+        {f"{period}_{metric}": table[metric].sel(period=period).values
+         for period in SCREENER_PERIODS for metric in SCREENER_METRICS},
+        index=pd.Index(table.security.values, name="code")
+    )
+
+def build_screener_table(categories: Dict[str, List[str]], processes: Optional[int] = None,
+                         chunk_size: int = 50) -> pd.DataFrame:
+    """
+    Evaluate every fund of every category in a process pool.
+
+    Each worker loads a chunk of funds with one get_data call and evaluates
+    them with eval_util.get_evaluation_table.
+
+    Args:
+        categories: Fund codes keyed by category.
+        processes: The number of worker processes, or None for one per CPU.
+        chunk_size: The number of funds per worker task.
+
+    Returns:
+        DataFrame with one row per (category, code) and the columns code,
+        category and SCREENER_COLUMNS.
+    """
+    codes = list(dict.fromkeys(code for category_codes in categories.values() for code in category_codes))
+    chunks = [codes[i:i + chunk_size] for i in range(0, len(codes), chunk_size)]
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        frames = list(executor.map(_evaluate_chunk, chunks))
+    metrics = pd.concat(frames) if frames else pd.DataFrame(columns=SCREENER_COLUMNS, dtype=np.float64)
+    metrics = metrics[~metrics.index.duplicated()]
+
+    tables = []
+    for category, category_codes in categories.items():
+        table = metrics.reindex(list(dict.fromkeys(category_codes)))
+        table.index.name = "code"
+        table = table.reset_index()
+        table.insert(1, "category", category)
+        tables.append(table)
+    if not tables:
+        return pd.DataFrame(columns=["code", "category"] + SCREENER_COLUMNS)
+    return pd.concat(tables, ignore_index=True)
+
+class ScreenerStore:
+    """
+    Columnar file holding the nightly fund-screener table.
+
+    The table is written as an .npz file of one array per column, and read
+    back once per file modification.
+    """
+
+    def __init__(self, path: str = "instance/screener.npz"):
+        self.path = path
+        self._table: Optional[pd.DataFrame] = None
+        self._built_at: Optional[str] = None
+        self._mtime: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        self.path = app.config.get("SCREENER_TABLE_PATH", self.path)
+
+    def write(self, table: pd.DataFrame) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        arrays = {
+            "code": table["code"].to_numpy(dtype=str),
+            "category": table["category"].to_numpy(dtype=str),
+            "built_at": np.array(datetime.now().isoformat(timespec="seconds"))
+        }
+        arrays.update({column: table[column].to_numpy(dtype=np.float64) for column in SCREENER_COLUMNS})
+        # Write to a temporary file and rename, so readers never see a partial file.
+        np.savez(self.path + ".tmp.npz", **arrays)
+        os.replace(self.path + ".tmp.npz", self.path)
+
+    def read(self) -> Optional[pd.DataFrame]:
+        """
+        Read the screener table.
+
+        Returns:
+            DataFrame with the columns code, category and SCREENER_COLUMNS,
+            or None if the table has not been built yet.
+        """
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return None
+        with self._lock:
+            if self._mtime != mtime:
+                with np.load(self.path, allow_pickle=False) as npz:
+                    self._built_at = str(npz["built_at"])
+                    self._table = pd.DataFrame({column: npz[column] for column in ["code", "category"] + SCREENER_COLUMNS})
+                self._mtime = mtime
+            return self._table
+
+    def get_built_at(self) -> Optional[str]:
+        return self._built_at if self.read() is not None else None
+
+    def get_metrics(self, category: str) -> Dict[str, Dict[str, Optional[float]]]:
+        """
+        Get the screener metrics of a category for rendering list pages.
+
+        Args:
+            category: The category.
+
+        Returns:
+            Dicts of metrics keyed by fund code, with None for missing values.
+        """
+        table = self.read()
+        if table is None:
+            return {}
+        table = table[table["category"] == category]
+        values = table[SCREENER_COLUMNS].astype(object).where(table[SCREENER_COLUMNS].notna(), None)
+        return dict(zip(table["code"], values.to_dict("records")))
+
+screener_store = ScreenerStore()
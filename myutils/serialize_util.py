@@ -0,0 +1,94 @@
+import json
+import math
+from datetime import date, datetime, time
+from decimal import Decimal
+from operator import itemgetter
+from typing import Any, Callable, Dict, List, Optional, Sequence, Union
+
+from sqlalchemy import types
+from sqlalchemy.orm import Query
+from sqlalchemy.sql import Select
+
+def _get_finite(value: float) -> Optional[float]:
+    return value if math.isfinite(value) else None
+
+def _get_finite_decimal(value: Decimal) -> Optional[float]:
+    # Numeric columns hold NaN too, which JSON cannot.
+    return float(value) if value.is_finite() else None
+
+def _get_converter(column_type: types.TypeEngine) -> Optional[Callable[[Any], Any]]:
+    # The converters are unbound C methods where possible, so no Python frame is entered per value.
+    if isinstance(column_type, types.DateTime):
+        return datetime.isoformat
+    if isinstance(column_type, types.Date):
+        return date.isoformat
+    if isinstance(column_type, types.Time):
+        return time.isoformat
+    if isinstance(column_type, types.Float):
+        return _get_finite
+    if isinstance(column_type, types.Numeric):
+        return _get_finite_decimal
+    return None
+
+def dumps(obj: Any) -> str:
+    """
+    Encode plain JSON types with the C encoder of the standard library.
+    """
+    return json.dumps(obj, ensure_ascii=False, allow_nan=False)
+
+class RowEncoder:
+    """
+    Precomputed encoder of the result rows of one select.
+
+    The keys, the columns to pick and a converter per column whose type is
+    not plain JSON (dates, Decimal, NaN floats) are worked out once from the
+    column types, so encoding a row is a tuple pick, the converters of those
+    columns only and dict(zip()), and the dicts are encoded without any
+    `default` hook.
+    """
+
+    def __init__(self, keys: Sequence[str], column_types: Sequence[types.TypeEngine],
+                 only: Optional[Sequence[str]] = None):
+        keys = list(keys)
+        only = keys if only is None else list(only)
+        indexes = [keys.index(key) for key in only]
+        self.keys = tuple(only)
+        self._pick = itemgetter(*indexes) if len(indexes) > 1 else (lambda row: tuple(row[i] for i in indexes))
+        self._converters = [
+            (i, converter)
+            for i, index in enumerate(indexes)
+            if (converter := _get_converter(column_types[index])) is not None
+        ]
+
+    @classmethod
+    def from_query(cls, query: Union[Query, Select], only: Optional[Sequence[str]] = None) -> "RowEncoder":
+        """
+        Create the encoder of a with_entities query or of a select of columns.
+
+        Args:
+            query: The query or select, whose rows are encoded by column label.
+            only: The labels to encode, or None for all of them.
+
+        Returns:
+            The encoder.
+        """
+        descriptions = query.column_descriptions
+        return cls([description["name"] for description in descriptions],
+                   [description["type"] for description in descriptions], only)
+
+    def to_dicts(self, rows: Sequence[Sequence[Any]]) -> List[Dict[str, Any]]:
+        keys, pick, converters = self.keys, self._pick, self._converters
+        if not converters:
+            return [dict(zip(keys, pick(row))) for row in rows]
+
+        result = []
+        for row in rows:
+            values = list(pick(row))
+            for i, convert in converters:
+                if values[i] is not None:
+                    values[i] = convert(values[i])
+            result.append(dict(zip(keys, values)))
+        return result
+
+    def encode(self, rows: Sequence[Sequence[Any]]) -> str:
+        return dumps(self.to_dicts(rows))
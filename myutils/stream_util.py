@@ -0,0 +1,118 @@
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from flask import Response, current_app, stream_with_context
+from sqlalchemy.orm import Query
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+STREAM_MODES = ["ndjson", "json"]
+
+def get_stream_mode(mode: Optional[str], accept_mimetypes) -> Optional[str]:
+    """
+    Get the streaming mode asked for by a request.
+
+    Args:
+        mode: The requested mode, "ndjson" or "json", or None.
+        accept_mimetypes: The Accept header of the request.
+
+    Returns:
+        "ndjson", "json", or None for a regular response.
+    """
+    if mode is not None:
+        if mode not in STREAM_MODES:
+            raise ValueError(f"stream must be one of {STREAM_MODES}")
+        return mode
+    if accept_mimetypes.best == NDJSON_MIMETYPE:
+        return "ndjson"
+    return None
+
+def iter_chunks(items: Iterable, batch_size: int) -> Iterator[List]:
+    """
+    Split any iterable into lists, reading only one list ahead.
+
+    Args:
+        items: The items.
+        batch_size: The number of items per list.
+
+    Returns:
+        Iterator of lists of at most `batch_size` items.
+    """
+    items = iter(items)
+    while True:
+        batch = list(islice(items, batch_size))
+        if not batch:
+            return
+        yield batch
+
+def iter_batches(query: Query, batch_size: int = 1000) -> Iterator[List]:
+    """
+    Read the rows of a query in batches with a server-side cursor.
+
+    Args:
+        query: The query.
+        batch_size: The number of rows fetched and yielded at a time.
+
+    Returns:
+        Iterator of lists of at most `batch_size` rows.
+    """
+    return iter_chunks(query.yield_per(batch_size), batch_size)
+
+def iter_statement_batches(session, statement, params: Optional[Dict[str, Any]] = None,
+                           batch_size: int = 1000) -> Iterator[List]:
+    """
+    Execute a statement and read its rows in batches with a server-side cursor.
+
+    Args:
+        session: The session to execute the statement in.
+        statement: The statement.
+        params: The bound parameters.
+        batch_size: The number of rows fetched and yielded at a time.
+
+    Returns:
+        Iterator of lists of at most `batch_size` rows.
+    """
+    result = session.execute(statement.execution_options(yield_per=batch_size), params or {})
+    for partition in result.partitions():
+        yield partition
+
+def _get_row_dicts(rows: List) -> List[Dict]:
+    return [row._asdict() for row in rows]
+
+def get_streaming_response(batches: Iterator[List], mode: str,
+                           dump_batch: Callable[[List], List[Dict]] = _get_row_dicts,
+                           dumps: Optional[Callable[[Any], str]] = None,
+                           headers: Optional[Dict[str, str]] = None) -> Response:
+    """
+    Stream batches of rows as NDJSON or as a chunked JSON array.
+
+    Only one batch of rows is held in memory at a time, and the response
+    starts as soon as the first batch is read.
+
+    Args:
+        batches: Batches of rows from iter_batches or iter_statement_batches,
+            which are only read while the response is sent.
+        mode: "ndjson" for one JSON object per line, or "json" for an array.
+        dump_batch: Function turning a batch of rows into dicts. By default
+            rows of with_entities queries are turned into dicts by label.
+        dumps: Function encoding one dict, by default the app's JSON provider.
+        headers: Extra response headers.
+
+    Returns:
+        The streaming response.
+    """
+    dumps = dumps or current_app.json.dumps
+
+    def generate_ndjson():
+        for batch in batches:
+            yield "".join(dumps(item) + "\n" for item in dump_batch(batch))
+
+    def generate_json():
+        separator = "["
+        for batch in batches:
+            yield separator + ",".join(dumps(item) for item in dump_batch(batch))
+            separator = ","
+        yield "[]" if separator == "[" else "]"
+
+    if mode == "ndjson":
+        return Response(stream_with_context(generate_ndjson()), mimetype=NDJSON_MIMETYPE, headers=headers)
+    return Response(stream_with_context(generate_json()), mimetype="application/json", headers=headers)